@@ -1,33 +1,95 @@
 import os
 import time
+import asyncio
 import csv
-from io import StringIO
-from datetime import datetime
-
-from flask import Flask, jsonify, request, render_template, Response
+import gzip
+import json
+import queue
+import atexit
+import hashlib
+import math
+import mimetypes
+import codecs
+import base64
+import threading
+import unicodedata
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import wraps
+from io import StringIO, TextIOWrapper
+from urllib.parse import parse_qs
+from datetime import date, datetime, timedelta
+
+import click
+from flask import Blueprint, Flask, current_app, g, jsonify, request, render_template, Response, send_from_directory, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import (
     LoginManager, login_user, login_required, logout_user, current_user, UserMixin
 )
 from passlib.hash import bcrypt
-from sqlalchemy import text, or_
+from sqlalchemy import case, cast, delete, event, insert, literal, literal_column, select, text, or_, tuple_, type_coerce, update
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.exc import IntegrityError
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
 
-app = Flask(__name__, template_folder="templates", static_folder="static")
+try:  # variantes .br des ressources statiques (facultatif : .gz seul sinon)
+    import brotli
+except ImportError:
+    brotli = None
 
 # ---------------------------------------------------------------------
 # Config
 # ---------------------------------------------------------------------
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "change")
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SESSION_COOKIE_SAMESITE"] = os.environ.get("SESSION_COOKIE_SAMESITE", "Lax")
-app.config["SESSION_COOKIE_SECURE"] = os.environ.get("SESSION_COOKIE_SECURE", "false").lower() == "true"
-
-db = SQLAlchemy(app)
-login_manager = LoginManager(app)
-login_manager.login_view = "index"
+def configure(app: Flask):
+    """Configuration lue dans l'environnement."""
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "change")
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SESSION_COOKIE_SAMESITE"] = os.environ.get("SESSION_COOKIE_SAMESITE", "Lax")
+    app.config["SESSION_COOKIE_SECURE"] = os.environ.get("SESSION_COOKIE_SECURE", "false").lower() == "true"
+    app.config["PAGE_DEFAULT_LIMIT"] = int(os.environ.get("PAGE_DEFAULT_LIMIT", "100"))  # sans ?limit= ni ?stream=1
+    app.config["PAGE_MAX_LIMIT"] = int(os.environ.get("PAGE_MAX_LIMIT", "1000"))
+    app.config["STREAM_BATCH_SIZE"] = int(os.environ.get("STREAM_BATCH_SIZE", "500"))
+    app.config["PUBLIC_CACHE_SIZE"] = int(os.environ.get("PUBLIC_CACHE_SIZE", "512"))
+    app.config["IMPORT_CHUNK_ROWS"] = int(os.environ.get("IMPORT_CHUNK_ROWS", "1000"))
+    app.config["LOW_STOCK_THRESHOLD"] = int(os.environ.get("LOW_STOCK_THRESHOLD", "5"))  # antennes sans seuil
+    app.config["AUDIT_ASYNC"] = os.environ.get("AUDIT_ASYNC", "true").lower() == "true"  # false : journal dans la transaction
+    app.config["AUDIT_QUEUE_SIZE"] = int(os.environ.get("AUDIT_QUEUE_SIZE", "10000"))
+    app.config["AUDIT_BATCH_SIZE"] = int(os.environ.get("AUDIT_BATCH_SIZE", "500"))
+    app.config["AUDIT_FLUSH_INTERVAL"] = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "0.5"))  # secondes
+    app.config["LOG_RETENTION_DAYS"] = int(os.environ.get("LOG_RETENTION_DAYS", "180"))
+    app.config["LOG_ARCHIVE_BATCH_SIZE"] = int(os.environ.get("LOG_ARCHIVE_BATCH_SIZE", "5000"))  # lignes par fichier
+    app.config["LOG_ARCHIVE_API_BATCHES"] = int(os.environ.get("LOG_ARCHIVE_API_BATCHES", "1"))   # lots par appel de POST /api/logs/archive
+    app.config["LOG_ARCHIVE_DIR"] = os.environ.get("LOG_ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "archives"))
+    app.config["BCRYPT_ROUNDS"] = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+    app.config["BCRYPT_WORKERS"] = int(os.environ.get("BCRYPT_WORKERS", "1"))   # hachages simultanés
+    app.config["BCRYPT_BACKLOG"] = int(os.environ.get("BCRYPT_BACKLOG", "2"))   # en attente, au-delà : 503 (rester sous --threads)
+    app.config["LOGIN_WINDOW"] = int(os.environ.get("LOGIN_WINDOW", "300"))      # secondes
+    # compteurs par processus : avec N workers gunicorn, la limite effective est N fois la valeur
+    app.config["LOGIN_IP_LIMIT"] = int(os.environ.get("LOGIN_IP_LIMIT", "30"))   # échecs par IP (0 : illimité)
+    app.config["LOGIN_ACCOUNT_LIMIT"] = int(os.environ.get("LOGIN_ACCOUNT_LIMIT", "5"))  # échecs par compte et par IP
+    app.config["USER_CACHE_TTL"] = float(os.environ.get("USER_CACHE_TTL", "60"))     # secondes
+    app.config["USER_CACHE_CHECK"] = float(os.environ.get("USER_CACHE_CHECK", "5"))  # relecture de la version partagée
+    app.config["TRUST_PROXY"] = os.environ.get("TRUST_PROXY", "false").lower() == "true"  # derrière nginx
+    app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN", "")                # /metrics : jeton Bearer si défini
+    app.config["SLOW_QUERY_MS"] = float(os.environ.get("SLOW_QUERY_MS", "200"))      # 0 : désactivé
+    app.config["SLOW_QUERY_LOG_SIZE"] = int(os.environ.get("SLOW_QUERY_LOG_SIZE", "100"))
+    app.config["STREAM_URL"] = os.environ.get("STREAM_URL", "")  # serveur SSE si pas de nginx devant, ex. http://hote:8011/api/public/stream
+    app.config["STREAM_MAX_CLIENTS"] = int(os.environ.get("STREAM_MAX_CLIENTS", "5000"))
+    app.config["IDEMPOTENCY_TTL_DAYS"] = int(os.environ.get("IDEMPOTENCY_TTL_DAYS", "30"))  # files hors ligne rejouables
+    app.config["SYNC_MAX_OPERATIONS"] = int(os.environ.get("SYNC_MAX_OPERATIONS", "500"))
+    app.config["STREAM_HEARTBEAT"] = float(os.environ.get("STREAM_HEARTBEAT", "20"))  # secondes
+    app.config["ASSETS_DIR"] = os.environ.get("ASSETS_DIR", os.path.join(os.path.dirname(__file__), "static", "dist"))
+    app.config["COMPRESS_MIN_SIZE"] = int(os.environ.get("COMPRESS_MIN_SIZE", "1024"))  # octets ; 0 : pas de gzip à la volée
+    app.config["COMPRESS_LEVEL"] = int(os.environ.get("COMPRESS_LEVEL", "6"))
+
+db = SQLAlchemy()
+login_manager = LoginManager()
+login_manager.login_view = "main.index"
+bp = Blueprint("main", __name__, cli_group=None)
 
 # ---------------------------------------------------------------------
 # Models
@@ -57,25 +119,61 @@ class GarmentType(db.Model):
 
 class StockItem(db.Model):
     __tablename__ = "stock_items"
+    __table_args__ = (db.Index("ix_stock_items_antenna_type_size", "antenna_id", "garment_type_id", "size"),)
     id = db.Column(db.Integer, primary_key=True)
     garment_type_id = db.Column(db.Integer, db.ForeignKey("garment_types.id"), nullable=False)
     antenna_id = db.Column(db.Integer, db.ForeignKey("antennas.id"), nullable=False)
     size = db.Column(db.String(20))
     quantity = db.Column(db.Integer, default=0)
-    # tags stockés en texte (csv)
-    tags_text = db.Column(db.Text, default="")
     garment_type = db.relationship(GarmentType)
     antenna = db.relationship(Antenna)
 
+# un seul article par (type, antenne, taille) ; taille absente et vide confondues comme dans les filtres publics
+STOCK_ITEM_KEY = (StockItem.garment_type_id, StockItem.antenna_id, db.func.coalesce(StockItem.size, literal_column("''")))
+uq_stock_items_type_antenna_size = db.Index("uq_stock_items_type_antenna_size", *STOCK_ITEM_KEY, unique=True)
+
+class StockItemTag(db.Model):
+    __tablename__ = "stock_item_tags"
+    __table_args__ = (db.Index("ix_stock_item_tags_tag", "tag", "stock_item_id"),)
+    stock_item_id = db.Column(db.Integer, db.ForeignKey("stock_items.id", ondelete="CASCADE"), primary_key=True)
+    tag = db.Column(db.String(80), primary_key=True)
+
+# Alertes stock bas précalculées (réévaluées à chaque mouvement sur les seuls articles touchés)
+class StockAlert(db.Model):
+    __tablename__ = "stock_alerts"
+    stock_item_id = db.Column(db.Integer, db.ForeignKey("stock_items.id", ondelete="CASCADE"), primary_key=True)
+    antenna_id = db.Column(db.Integer, nullable=False, index=True)
+    quantity = db.Column(db.Integer, nullable=False)
+    threshold = db.Column(db.Integer, nullable=False)
+    since = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Volunteer(db.Model):
     __tablename__ = "volunteers"
+    __table_args__ = (
+        db.Index("ix_volunteers_name_id", "last_name", "first_name", "id"),
+        db.Index("ix_volunteers_keys", "last_key", "first_key",
+                 postgresql_ops={"last_key": "varchar_pattern_ops", "first_key": "varchar_pattern_ops"}),
+        db.Index("ix_volunteers_first_key", "first_key", postgresql_ops={"first_key": "varchar_pattern_ops"}),
+        db.Index("uq_volunteers_name_key", "name_key", unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(120), index=True, nullable=False)
     last_name = db.Column(db.String(120), index=True, nullable=False)
     note = db.Column(db.Text, default="")
+    # clés normalisées (minuscules, sans accents) pour la recherche indexée
+    first_key = db.Column(db.String(120))
+    last_key = db.Column(db.String(120))
+    # "nom|prénom" normalisé, unique : dédoublonnage en base (NULL pour les homonymes historiques)
+    name_key = db.Column(db.String(255))
 
 class Loan(db.Model):
     __tablename__ = "loans"
+    __table_args__ = (
+        db.Index("ix_loans_volunteer_returned", "volunteer_id", "returned_at"),  # prêts d'un bénévole, ouverts ou non
+        db.Index("ix_loans_stock_item_id", "stock_item_id"),
+        # prêts ouverts (~ une fraction de l'historique) : index partiel, parcours dans l'ordre des id
+        db.Index("ix_loans_open", "id", postgresql_where=text("returned_at IS NULL"), sqlite_where=text("returned_at IS NULL")),
+    )
     id = db.Column(db.Integer, primary_key=True)
     volunteer_id = db.Column(db.Integer, db.ForeignKey("volunteers.id"), nullable=False)
     stock_item_id = db.Column(db.Integer, db.ForeignKey("stock_items.id"), nullable=False)
@@ -88,6 +186,12 @@ class Loan(db.Model):
 # Logs & inventaire
 class Log(db.Model):
     __tablename__ = "logs"
+    __table_args__ = (
+        db.Index("ix_logs_at_id", "at", "id"),
+        db.Index("ix_logs_actor_at", "actor", "at", "id"),
+        db.Index("ix_logs_action_at", "action", "at", "id"),
+        db.Index("ix_logs_entity_at", "entity", "entity_id", "at", "id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     at = db.Column(db.DateTime, default=datetime.utcnow)
     actor = db.Column(db.String(255))  # email utilisateur ou "public"
@@ -98,6 +202,7 @@ class Log(db.Model):
 
 class InventorySession(db.Model):
     __tablename__ = "inventory_sessions"
+    __table_args__ = (db.Index("ix_inventory_sessions_antenna_started", "antenna_id", "started_at"),)
     id = db.Column(db.Integer, primary_key=True)
     antenna_id = db.Column(db.Integer, db.ForeignKey("antennas.id"), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
@@ -108,6 +213,10 @@ class InventorySession(db.Model):
 
 class InventoryLine(db.Model):
     __tablename__ = "inventory_lines"
+    __table_args__ = (
+        db.Index("uq_inventory_lines_session_item", "session_id", "stock_item_id", unique=True),
+        db.Index("ix_inventory_lines_stock_item_id", "stock_item_id"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(db.Integer, db.ForeignKey("inventory_sessions.id"), nullable=False)
     stock_item_id = db.Column(db.Integer, db.ForeignKey("stock_items.id"), nullable=False)
@@ -117,13 +226,331 @@ class InventoryLine(db.Model):
     session = db.relationship(InventorySession)
     stock_item = db.relationship(StockItem)
 
+class StockMovement(db.Model):
+    """Une ligne de transfert entre antennes (les quantités restent tracées même si l'article change)."""
+    __tablename__ = "stock_movements"
+    id = db.Column(db.Integer, primary_key=True)
+    transfer_id = db.Column(db.String(32), nullable=False, index=True)  # lignes d'un même transfert
+    at = db.Column(db.DateTime, default=datetime.utcnow)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    from_antenna_id = db.Column(db.Integer, db.ForeignKey("antennas.id"), nullable=False, index=True)
+    to_antenna_id = db.Column(db.Integer, db.ForeignKey("antennas.id"), nullable=False, index=True)
+    garment_type_id = db.Column(db.Integer, db.ForeignKey("garment_types.id"), nullable=False)
+    size = db.Column(db.String(20))
+    qty = db.Column(db.Integer, nullable=False)
+    from_stock_item_id = db.Column(db.Integer, nullable=False)
+    to_stock_item_id = db.Column(db.Integer, nullable=False)
+
+# Agrégats maintenus à chaque mouvement (tableau de bord sans balayer les tables)
+class Counter(db.Model):
+    __tablename__ = "counters"
+    name = db.Column(db.String(40), primary_key=True)  # "loans_open", "volunteers"
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+
+class StockTotal(db.Model):
+    __tablename__ = "stock_totals"
+    antenna_id = db.Column(db.Integer, primary_key=True)
+    garment_type_id = db.Column(db.Integer, primary_key=True)
+    quantity = db.Column(db.BigInteger, nullable=False, default=0)
+
+class LoanDaily(db.Model):
+    """Prêts et retours du jour par antenne, type et taille (analyses de consommation)."""
+    __tablename__ = "loan_daily"
+    day = db.Column(db.Date, primary_key=True)  # UTC, comme les dates des prêts
+    antenna_id = db.Column(db.Integer, primary_key=True)
+    garment_type_id = db.Column(db.Integer, primary_key=True)
+    size = db.Column(db.String(20), primary_key=True, default="")  # "" pour les articles sans taille
+    loans = db.Column(db.Integer, nullable=False, default=0)
+    qty_out = db.Column(db.Integer, nullable=False, default=0)
+    returns = db.Column(db.Integer, nullable=False, default=0)
+    qty_in = db.Column(db.Integer, nullable=False, default=0)
+    duration_days = db.Column(db.Float, nullable=False, default=0)  # somme des durées des prêts rendus ce jour
+
+# Migrations appliquées (flask --app app migrate)
+class SchemaMigration(db.Model):
+    __tablename__ = "schema_migrations"
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Compteurs de version partagés entre workers (invalidation des caches)
+class CacheVersion(db.Model):
+    __tablename__ = "cache_versions"
+    scope = db.Column(db.String(40), primary_key=True)  # ex. "stock:3"
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Réponses déjà servies, par clé d'idempotence (retries et files hors ligne des kiosques)
+class IdempotencyKey(db.Model):
+    __tablename__ = "idempotency_keys"
+    key = db.Column(db.String(100), primary_key=True)  # fournie par le kiosque (UUID)
+    endpoint = db.Column(db.String(80), nullable=False)
+    status_code = db.Column(db.Integer)
+    response = db.Column(db.Text)  # corps JSON rejoué tel quel
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+@dataclass(frozen=True, eq=False)
+class UserIdentity(UserMixin):
+    """Instantané immuable de l'utilisateur connecté (current_user), sans objet ORM."""
+    id: int
+    email: str
+    name: str
+    role: str
+
+class UserCache:
+    """Identités par processus avec TTL.
+
+    users_update/users_delete invalident l'entrée locale et incrémentent la
+    version partagée "users" (cache_versions) ; les autres workers la relisent au
+    plus toutes les USER_CACHE_CHECK secondes et vident alors leur cache.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked = float("-inf")
+
+    def get(self, uid: int):
+        cfg, now = current_app.config, time.monotonic()
+        if now - self._checked >= cfg["USER_CACHE_CHECK"]:
+            version = db.session.query(CacheVersion.version).filter(CacheVersion.scope == "users").scalar() or 0
+            with self._lock:
+                if version != self._version:
+                    self._items.clear()
+                    self._version = version
+                self._checked = now
+        with self._lock:
+            hit = self._items.get(uid)
+        if hit and hit[0] > now:
+            return hit[1]
+        row = db.session.query(User.id, User.email, User.name, User.role).filter(User.id == uid).first()
+        if not row:
+            return None
+        identity = UserIdentity(*row)
+        with self._lock:
+            self._items[uid] = (now + cfg["USER_CACHE_TTL"], identity)
+        return identity
+
+    def invalidate(self, uid: int):
+        with self._lock:
+            self._items.pop(uid, None)
+
+user_cache = UserCache()
+
 @login_manager.user_loader
 def load_user(uid):
-    return db.session.get(User, int(uid))
+    return user_cache.get(int(uid))
+
+def current_actor() -> str:
+    return current_user.email if hasattr(current_user, "is_authenticated") and current_user.is_authenticated else "public"
+
+# ---------------------------------------------------------------------
+# Journal d'audit : écrit par lots hors de la requête, après le commit
+# ---------------------------------------------------------------------
+class AuditWriter:
+    """File bornée de journaux, vidée par un thread de fond en INSERT multi-lignes.
+
+    Les journaux d'une transaction ne sont mis en file qu'une fois celle-ci
+    validée (rollback : écartés). Ce qui arrive en cas d'incident :
+    - file pleine (AUDIT_QUEUE_SIZE) : l'appelant écrit lui-même son lot, rien n'est perdu ;
+    - base indisponible : nouvelles tentatives, puis chaque ligne est tracée dans les logs applicatifs ;
+    - arrêt normal (SIGTERM, fin du processus) : la file est vidée (atexit) ;
+    - arrêt brutal (SIGKILL, crash) : les journaux encore en file, soit au plus
+      AUDIT_FLUSH_INTERVAL secondes d'actions, sont perdus.
+    AUDIT_ASYNC=0, ou SQLite en mémoire (une seule connexion partagée entre threads) :
+    pas de thread, les journaux sont écrits dans la transaction de l'action.
+    """
+    _STOP = object()
+
+    def __init__(self, app: Flask, retries: int = 5):
+        self.app, self.retries = app, retries
+        self.maxsize, self.batch_size = app.config["AUDIT_QUEUE_SIZE"], app.config["AUDIT_BATCH_SIZE"]
+        self.interval = app.config["AUDIT_FLUSH_INTERVAL"]
+        self.inline = not app.config["AUDIT_ASYNC"] or app.config["SQLALCHEMY_DATABASE_URI"] in ("sqlite://", "sqlite:///:memory:")
+        self._lock = threading.Lock()
+        self._pid = self._thread = self._queue = None
+        app.extensions["audit"] = self
+        atexit.register(self.close)
+
+    def _started(self) -> queue.Queue:
+        # thread propre à chaque processus (gunicorn --preload : fork après create_app)
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(self.maxsize)
+                    self._thread = threading.Thread(target=self._run, args=(self._queue,), name="audit-writer", daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def submit(self, rows: list):
+        q = self._started()
+        for i, row in enumerate(rows):
+            try:
+                q.put_nowait(row)
+            except queue.Full:
+                self.write(rows[i:])
+                return
+
+    def _run(self, q: queue.Queue):
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.interval
+            while batch[-1] is not self._STOP and len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            rows = [r for r in batch if r is not self._STOP]
+            if rows:
+                self.write(rows)
+            for _ in batch:
+                q.task_done()
+            if batch[-1] is self._STOP:
+                return
+
+    def write(self, rows: list):
+        for attempt in range(self.retries):
+            try:
+                with self.app.app_context(), db.engine.begin() as conn:
+                    conn.execute(insert(Log), rows)
+                return
+            except Exception:
+                self.app.logger.exception("Écriture du journal impossible (tentative %s)", attempt + 1)
+                time.sleep(min(2 ** attempt, 10))
+        for row in rows:
+            self.app.logger.error("Journal non écrit : %s", json.dumps(row, default=str))
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Attend que la file de ce processus soit écrite (lecture de ses propres journaux)."""
+        q = self._queue if self._pid == os.getpid() else None
+        if q is None:
+            return True
+        with q.all_tasks_done:
+            return q.all_tasks_done.wait_for(lambda: not q.unfinished_tasks, timeout)
+
+    def close(self, timeout: float = 10.0):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+
+def audit_writer() -> AuditWriter:
+    return current_app.extensions["audit"]
+
+@event.listens_for(db.session, "before_commit")
+def write_audit(session):
+    # mode synchrone : un seul INSERT multi-lignes, validé ou annulé avec les mouvements journalisés
+    if session.in_nested_transaction() or not audit_writer().inline:
+        return
+    rows = session.info.pop("audit", None)
+    if rows:
+        session.connection().execute(insert(Log), rows)
+
+@event.listens_for(db.session, "after_commit")
+def queue_audit(session):
+    if session.in_nested_transaction():
+        return
+    rows = session.info.pop("audit", None)
+    if rows:
+        audit_writer().submit(rows)
+
+@event.listens_for(db.session, "after_transaction_create")
+def audit_savepoint(session, transaction):
+    if transaction.nested:
+        transaction._audit_mark = len(session.info.get("audit", ()))
+
+@event.listens_for(db.session, "after_soft_rollback")
+def audit_after_rollback(session, previous_transaction):
+    # savepoint annulé : seuls ses journaux sont écartés, pas ceux du reste de la transaction
+    if previous_transaction.nested:
+        del session.info.get("audit", [])[previous_transaction._audit_mark:]
+    else:
+        session.info.pop("audit", None)
 
 def log_action(action: str, entity: str, entity_id: int | None = None, details: str = ""):
-    actor = current_user.email if hasattr(current_user, "is_authenticated") and current_user.is_authenticated else "public"
-    db.session.add(Log(actor=actor, action=action, entity=entity, entity_id=entity_id, details=details))
+    """Journalise une action de la transaction en cours ; écrite seulement si elle est validée."""
+    log_actions([(action, entity, entity_id, details)])
+
+def log_actions(entries):
+    """entries = [(action, entity, entity_id, details)], à appeler avant le commit (écrites à sa validation)."""
+    if not entries:
+        return
+    actor, at = current_actor(), datetime.utcnow()
+    db.session.info.setdefault("audit", []).extend(
+        {"at": at, "actor": actor, "action": a, "entity": e, "entity_id": eid, "details": det} for a, e, eid, det in entries
+    )
+
+def search_key(value) -> str:
+    """Forme normalisée d'un nom : minuscules, sans accents, tirets et espaces réduits."""
+    decomposed = unicodedata.normalize("NFKD", str(value or ""))
+    plain = "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+    return " ".join(plain.replace("-", " ").split())
+
+def volunteer_name_key(last_name, first_name) -> str:
+    return f"{search_key(last_name)}|{search_key(first_name)}"
+
+@event.listens_for(Volunteer, "before_insert")
+@event.listens_for(Volunteer, "before_update")
+def volunteer_keys(mapper, connection, v):
+    v.first_key = search_key(v.first_name)
+    v.last_key = search_key(v.last_name)
+    state = db.inspect(v)
+    if not state.persistent or state.attrs.first_name.history.has_changes() or state.attrs.last_name.history.has_changes():
+        v.name_key = volunteer_name_key(v.last_name, v.first_name)
+
+def backfill_volunteer_keys(batch_size: int = 1000):
+    """Calcule les clés de recherche des bénévoles existants (lignes antérieures à la colonne)."""
+    while True:
+        rows = (
+            db.session.query(Volunteer.id, Volunteer.first_name, Volunteer.last_name)
+            .filter(Volunteer.last_key.is_(None)).limit(batch_size).all()
+        )
+        if not rows:
+            return
+        db.session.execute(update(Volunteer), [
+            {"id": r.id, "first_key": search_key(r.first_name), "last_key": search_key(r.last_name)} for r in rows
+        ])
+        db.session.commit()
+    # clé unique : seul le plus ancien de chaque homonyme la reçoit
+    db.session.execute(text(
+        "UPDATE volunteers SET name_key = last_key || '|' || first_key "
+        "WHERE name_key IS NULL AND last_key IS NOT NULL "
+        "AND id = (SELECT min(w.id) FROM volunteers w WHERE w.last_key = volunteers.last_key AND w.first_key = volunteers.first_key) "
+        "AND NOT EXISTS (SELECT 1 FROM volunteers x WHERE x.name_key = volunteers.last_key || '|' || volunteers.first_key)"
+    ))
+    db.session.commit()
+
+def rebuild_stats():
+    """Recalcule tous les agrégats depuis les tables de base (initialisation ou réparation)."""
+    db.session.execute(delete(StockTotal))
+    db.session.execute(insert(StockTotal).from_select(
+        ["antenna_id", "garment_type_id", "quantity"],
+        select(StockItem.antenna_id, StockItem.garment_type_id, db.func.coalesce(db.func.sum(StockItem.quantity), 0))
+        .group_by(StockItem.antenna_id, StockItem.garment_type_id),
+    ))
+    db.session.execute(delete(Counter))
+    db.session.execute(insert(Counter), [
+        {"name": "loans_open", "value": Loan.query.filter(Loan.returned_at.is_(None)).count()},
+        {"name": "volunteers", "value": Volunteer.query.count()},
+    ])
+    db.session.commit()
+
+def low_stock_threshold():
+    return db.func.coalesce(Antenna.low_stock_threshold, current_app.config["LOW_STOCK_THRESHOLD"])
+
+def low_stock_select(*where):
+    """Articles dont la quantité est au plus le seuil de leur antenne."""
+    threshold = low_stock_threshold()
+    return (
+        select(StockItem.id, StockItem.antenna_id, StockItem.quantity, threshold)
+        .join(Antenna, Antenna.id == StockItem.antenna_id)
+        .where(StockItem.quantity <= threshold, *where)
+    )
+
+def rebuild_alerts():
+    db.session.execute(delete(StockAlert))
+    db.session.execute(insert(StockAlert).from_select(["stock_item_id", "antenna_id", "quantity", "threshold"], low_stock_select()))
+    db.session.commit()
 
 # ---------------------------------------------------------------------
 # DB bootstrapping
@@ -137,53 +564,886 @@ def wait_for_db(max_tries: int = 60, delay: float = 1.0):
             time.sleep(delay)
     raise RuntimeError("Base de données indisponible après attente")
 
-with app.app_context():
-    wait_for_db()
-    db.create_all()
-    # Migrations idempotentes
-    try:
-        db.session.execute(text("ALTER TABLE stock_items ADD COLUMN IF NOT EXISTS tags_text TEXT DEFAULT ''"))
-        db.session.execute(text("ALTER TABLE antennas ADD COLUMN IF NOT EXISTS low_stock_threshold INTEGER"))
-        db.session.execute(text("ALTER TABLE antennas ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION"))
-        db.session.execute(text("ALTER TABLE antennas ADD COLUMN IF NOT EXISTS lng DOUBLE PRECISION"))
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-    # Admin par défaut
+def ensure_admin():
+    """Crée l'administrateur par défaut s'il n'existe pas (seul hachage bcrypt du démarrage)."""
     email = os.environ.get("ADMIN_EMAIL", "admin@pc.fr")
     if not User.query.filter_by(email=email).first():
         db.session.add(
             User(
                 email=email,
                 name=os.environ.get("ADMIN_NAME", "Admin"),
-                pwd_hash=bcrypt.hash(os.environ.get("ADMIN_PASSWORD", "admin123")),
+                pwd_hash=passwords.hash(os.environ.get("ADMIN_PASSWORD", "admin123")),
                 role="admin",
             )
         )
         db.session.commit()
 
+def pg_statements(*statements):
+    """Étape de rattrapage des bases Postgres créées par d'anciennes versions (create_all crée le reste)."""
+    def step():
+        if db.engine.dialect.name == "postgresql":
+            for sql in statements:
+                db.session.execute(text(sql))
+    return step
+
+def migrate_tags_text():
+    # ancien stockage des tags (texte csv) -> table stock_item_tags
+    if "tags_text" in {c["name"] for c in db.inspect(db.engine).get_columns("stock_items")}:
+        db.session.execute(text(
+            "INSERT INTO stock_item_tags (stock_item_id, tag) "
+            "SELECT DISTINCT s.id, left(trim(t), 80) FROM stock_items s, unnest(string_to_array(s.tags_text, ',')) AS t "
+            "WHERE trim(t) <> '' ON CONFLICT DO NOTHING"
+        ))
+        db.session.execute(text("UPDATE stock_items SET tags_text = '' WHERE tags_text <> ''"))
+
+def create_tables(*models):
+    """Étape créant les tables ajoutées après la version 1 (create_all ne tourne qu'une fois)."""
+    def step():
+        for model in models:
+            model.__table__.create(db.engine, checkfirst=True)
+    return step
+
+def create_indexes(*names):
+    """Étape créant des index déclarés sur les modèles (bases SQLite comprises), dans la transaction de migration."""
+    def step():
+        conn = db.session.connection()
+        indexes = {ix.name: ix for table in db.metadata.tables.values() for ix in table.indexes}
+        # la réflexion SQLite ignore les index sur expression : on interroge sqlite_master directement
+        existing = set(conn.scalars(text("SELECT name FROM sqlite_master WHERE type = 'index'"))) if conn.dialect.name == "sqlite" else set()
+        for name in names:
+            if name not in existing:
+                indexes[name].create(conn, checkfirst=True)
+    return step
+
+def create_trigram_indexes():
+    """Index pg_trgm servant les LIKE '%x%' du filtre de la liste des bénévoles (nom, prénom, note)."""
+    if db.engine.dialect.name != "postgresql":
+        return
+    if not db.session.scalar(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")):
+        current_app.logger.warning("Extension pg_trgm absente (postgresql-contrib) : filtre des bénévoles sans index")
+        return
+    for sql in (
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_volunteers_keys_trgm ON volunteers USING gin (last_key gin_trgm_ops, first_key gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_volunteers_note_trgm ON volunteers USING gin (lower(note) gin_trgm_ops)",
+    ):
+        db.session.execute(text(sql))
+
+def merge_duplicate_stock_items():
+    """Fusionne les articles en double (même type, antenne, taille) avant l'index unique.
+
+    Le plus ancien garde les quantités, prêts, tags et lignes d'inventaire ; si
+    les deux articles ont été comptés dans la même session, la ligne du double
+    est abandonnée.
+    """
+    first, keep_of = {}, {}
+    for item_id, *key in db.session.execute(select(StockItem.id, *STOCK_ITEM_KEY).order_by(StockItem.id)):
+        keep_of[item_id] = first.setdefault(tuple(key), item_id)
+    for dup, keep in keep_of.items():
+        if dup == keep:
+            continue
+        db.session.execute(update(Loan).where(Loan.stock_item_id == dup).values(stock_item_id=keep))
+        db.session.execute(delete(InventoryLine).where(
+            InventoryLine.stock_item_id == dup,
+            InventoryLine.session_id.in_(select(InventoryLine.session_id).where(InventoryLine.stock_item_id == keep)),
+        ))
+        db.session.execute(update(InventoryLine).where(InventoryLine.stock_item_id == dup).values(stock_item_id=keep))
+        db.session.execute(dialect_insert(StockItemTag).from_select(
+            ["stock_item_id", "tag"], select(literal(keep), StockItemTag.tag).where(StockItemTag.stock_item_id == dup)
+        ).on_conflict_do_nothing())
+        db.session.execute(delete(StockItemTag).where(StockItemTag.stock_item_id == dup))
+        db.session.execute(delete(StockAlert).where(StockAlert.stock_item_id == dup))
+        db.session.execute(update(StockItem).where(StockItem.id == keep).values(
+            quantity=StockItem.quantity + select(StockItem.quantity).where(StockItem.id == dup).scalar_subquery()
+        ))
+        db.session.execute(delete(StockItem).where(StockItem.id == dup))
+    rebuild_alerts()
+
+def rebuild_loan_daily():
+    """Recalcule les agrégats journaliers depuis l'historique des prêts (sorties à la création, retours au rendu)."""
+    size = STOCK_ITEM_KEY[2]
+    def per_day(day, *aggregates):
+        return db.session.execute(
+            select(day, StockItem.antenna_id, StockItem.garment_type_id, size, *aggregates)
+            .join(StockItem, StockItem.id == Loan.stock_item_id)
+            .where(day.isnot(None))
+            .group_by(day, StockItem.antenna_id, StockItem.garment_type_id, size)
+        )
+    if db.engine.dialect.name == "sqlite":
+        duration = db.func.julianday(Loan.returned_at) - db.func.julianday(Loan.created_at)
+    else:
+        duration = db.func.extract("epoch", Loan.returned_at - Loan.created_at) / 86400
+    rows = {}
+    for day, a, t, sz, n, qty in per_day(db.func.date(Loan.created_at), db.func.count(), db.func.sum(Loan.qty)):
+        rows[(day, a, t, sz)] = {"loans": n, "qty_out": qty or 0}
+    for day, a, t, sz, n, qty, days in per_day(db.func.date(Loan.returned_at), db.func.count(), db.func.sum(Loan.qty), db.func.sum(duration)):
+        rows.setdefault((day, a, t, sz), {}).update(returns=n, qty_in=qty or 0, duration_days=float(days or 0))
+    db.session.execute(delete(LoanDaily))
+    values = [
+        {"day": day if isinstance(day, date) else date.fromisoformat(day), "antenna_id": a, "garment_type_id": t, "size": sz,
+         "loans": 0, "qty_out": 0, "returns": 0, "qty_in": 0, "duration_days": 0, **v}
+        for (day, a, t, sz), v in rows.items()
+    ]
+    for i in range(0, len(values), 5000):
+        db.session.execute(insert(LoanDaily), values[i:i + 5000])
+    db.session.commit()
+
+def rebuild_summaries():
+    rebuild_stats()
+    rebuild_alerts()
+
+# (version, description, étape) : ne jamais modifier une étape publiée, en ajouter une nouvelle
+MIGRATIONS = [
+    (1, "schéma de base", db.create_all),
+    (2, "antennes : seuil et coordonnées", pg_statements(
+        "ALTER TABLE antennas ADD COLUMN IF NOT EXISTS low_stock_threshold INTEGER",
+        "ALTER TABLE antennas ADD COLUMN IF NOT EXISTS lat DOUBLE PRECISION",
+        "ALTER TABLE antennas ADD COLUMN IF NOT EXISTS lng DOUBLE PRECISION",
+    )),
+    (3, "tags en table", migrate_tags_text),
+    (4, "index de pagination, inventaire sans doublon", pg_statements(
+        "CREATE INDEX IF NOT EXISTS ix_volunteers_name_id ON volunteers (last_name, first_name, id)",
+        "CREATE INDEX IF NOT EXISTS ix_logs_at_id ON logs (at, id)",
+        "DELETE FROM inventory_lines a USING inventory_lines b "
+        "WHERE a.session_id = b.session_id AND a.stock_item_id = b.stock_item_id AND a.id < b.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_inventory_lines_session_item ON inventory_lines (session_id, stock_item_id)",
+    )),
+    (5, "bénévoles : clés de recherche et de dédoublonnage", pg_statements(
+        "ALTER TABLE volunteers ADD COLUMN IF NOT EXISTS first_key VARCHAR(120)",
+        "ALTER TABLE volunteers ADD COLUMN IF NOT EXISTS last_key VARCHAR(120)",
+        "CREATE INDEX IF NOT EXISTS ix_volunteers_keys ON volunteers (last_key varchar_pattern_ops, first_key varchar_pattern_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_volunteers_first_key ON volunteers (first_key varchar_pattern_ops)",
+        "ALTER TABLE volunteers ADD COLUMN IF NOT EXISTS name_key VARCHAR(255)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_volunteers_name_key ON volunteers (name_key)",
+    )),
+    (6, "bénévoles : calcul des clés", backfill_volunteer_keys),
+    (7, "index stock et journaux", pg_statements(
+        "CREATE INDEX IF NOT EXISTS ix_stock_items_antenna_type_size ON stock_items (antenna_id, garment_type_id, size)",
+        "CREATE INDEX IF NOT EXISTS ix_logs_actor_at ON logs (actor, at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_logs_action_at ON logs (action, at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_logs_entity_at ON logs (entity, entity_id, at, id)",
+    )),
+    (8, "agrégats du tableau de bord et alertes stock bas", rebuild_summaries),
+    (9, "clés d'idempotence des kiosques", create_tables(IdempotencyKey)),
+    (10, "articles en double fusionnés", merge_duplicate_stock_items),
+    (11, "index prêts et inventaire, article unique par type/antenne/taille", create_indexes(
+        "ix_loans_volunteer_returned", "ix_loans_stock_item_id", "ix_loans_open",
+        "ix_inventory_lines_stock_item_id", "ix_inventory_sessions_antenna_started",
+        "uq_stock_items_type_antenna_size",
+    )),
+    (12, "agrégats journaliers des prêts", create_tables(LoanDaily)),
+    (13, "historique des prêts agrégé par jour", rebuild_loan_daily),
+    (14, "transferts de stock entre antennes", create_tables(StockMovement)),
+    (15, "bénévoles : index trigrammes du filtre de la liste", create_trigram_indexes),
+]
+
+def migrate():
+    """Applique les migrations pas encore enregistrées dans schema_migrations ; renvoie celles appliquées."""
+    SchemaMigration.__table__.create(db.engine, checkfirst=True)
+    done = set(db.session.scalars(select(SchemaMigration.version)))
+    applied = []
+    for version, name, step in MIGRATIONS:
+        if version in done:
+            continue
+        step()
+        db.session.add(SchemaMigration(version=version, name=name))
+        db.session.commit()
+        applied.append((version, name))
+    return applied
+
+@bp.cli.command("migrate")
+def migrate_command():
+    """Met le schéma à jour puis crée l'administrateur par défaut (une fois par déploiement)."""
+    wait_for_db()
+    for version, name in migrate():
+        print(f"{version:03d} {name}")
+    ensure_admin()
+
 # ---------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------
-def tags_to_text(tags):
-    if not tags: return ""
+def parse_tags(tags):
+    """Liste de tags sans doublons depuis une liste ou un texte séparé par des virgules."""
+    if not tags: return []
     if isinstance(tags, str):
-        return ",".join([t.strip() for t in tags.split(",") if t.strip()])
-    return ",".join([str(t).strip() for t in tags if str(t).strip()])
+        tags = tags.split(",")
+    return list(dict.fromkeys(str(t).strip()[:80] for t in tags if str(t).strip()))
+
+def tags_column():
+    """Sous-requête corrélée : tags de l'article agrégés en texte (une seule requête pour la liste)."""
+    return (
+        select(db.func.aggregate_strings(StockItemTag.tag, ","))
+        .where(StockItemTag.stock_item_id == StockItem.id)
+        .scalar_subquery()
+        .label("tags")
+    )
+
+def add_tags(item_id: int, tags):
+    if tags:
+        stmt = dialect_insert(StockItemTag).values([{"stock_item_id": item_id, "tag": t} for t in tags])
+        db.session.execute(stmt.on_conflict_do_nothing())
+
+def set_tags(item_id: int, tags):
+    db.session.execute(delete(StockItemTag).where(StockItemTag.stock_item_id == item_id, StockItemTag.tag.notin_(tags)))
+    add_tags(item_id, tags)
+
+def filter_by_tags(qry):
+    """Filtre ?tag=a&tag=b (ou tag=a,b) ; ?tag_match=all exige tous les tags, sinon au moins un."""
+    tags = parse_tags([t for raw in request.args.getlist("tag") for t in raw.split(",")])
+    if not tags:
+        return qry
+    ids = select(StockItemTag.stock_item_id).where(StockItemTag.tag.in_(tags))
+    if request.args.get("tag_match") == "all":
+        ids = ids.group_by(StockItemTag.stock_item_id).having(db.func.count() == len(tags))
+    return qry.filter(StockItem.id.in_(ids))
+
+def open_loans_query(*extra_cols):
+    """Projection jointe des prêts ouverts (aucun chargement paresseux par ligne)."""
+    return (
+        db.session.query(
+            Loan.id, Loan.qty, Loan.created_at,
+            GarmentType.label.label("type"), StockItem.size, Antenna.name.label("antenna"),
+            *extra_cols,
+        )
+        .join(StockItem, Loan.stock_item_id == StockItem.id)
+        .join(GarmentType, StockItem.garment_type_id == GarmentType.id)
+        .join(Antenna, StockItem.antenna_id == Antenna.id)
+        .filter(Loan.returned_at.is_(None))
+    )
+
+def loan_row(r):
+    return {"id": r.id, "qty": r.qty, "since": r.created_at.isoformat(), "type": r.type, "size": r.size, "antenna": r.antenna}
+
+def dialect_insert(model):
+    """INSERT supportant ON CONFLICT (PostgreSQL en production, SQLite en local)."""
+    dialect = sqlite if db.engine.dialect.name == "sqlite" else postgresql
+    return dialect.insert(model)
+
+# ---------------------------------------------------------------------
+# Cache versionné des endpoints publics (QR)
+# ---------------------------------------------------------------------
+def bump_versions(*scopes):
+    """Incrémente des versions partagées entre workers (dans la transaction en cours)."""
+    scopes = sorted(set(scopes))
+    if not scopes:
+        return
+    stmt = dialect_insert(CacheVersion).values([{"scope": sc, "version": 1} for sc in scopes])
+    db.session.execute(stmt.on_conflict_do_update(index_elements=["scope"], set_={"version": CacheVersion.version + 1}))
+
+def bump_stock_version(*antenna_ids):
+    """Invalide le cache public des antennes touchées (dans la transaction en cours)."""
+    bump_versions(*(f"stock:{a}" for a in antenna_ids if a))
+
+def stock_version(antenna_id=None):
+    """Version du stock d'une antenne, ou de tout le stock (somme croissante des versions)."""
+    if antenna_id:
+        v = db.session.query(CacheVersion.version).filter(CacheVersion.scope == f"stock:{antenna_id}").scalar()
+    else:
+        v = db.session.query(db.func.sum(CacheVersion.version)).filter(CacheVersion.scope.like("stock:%")).scalar()
+    return v or 0
+
+_public_cache = OrderedDict()
+_public_cache_lock = threading.Lock()
+
+def stock_cached(view):
+    """Sert la réponse depuis un cache LRU par processus, validé par la version du stock.
+
+    La version est lue en base à chaque appel, ce qui garde le cache juste avec
+    plusieurs workers ; si le client présente le même ETag, on répond 304 sans
+    recalculer ni resérialiser le stock.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = stock_version(request.args.get("antenna_id", type=int))
+        etag = f"stock-{version}"
+        if request.if_none_match.contains_weak(etag):
+            resp = Response(status=304)
+        else:
+            key = request.full_path
+            with _public_cache_lock:
+                hit = _public_cache.get(key)
+                if hit and hit[0] == version:
+                    _public_cache.move_to_end(key)
+            if hit and hit[0] == version:
+                resp = Response(hit[1], mimetype="application/json")
+            else:
+                resp = view(*args, **kwargs)
+                if resp.status_code != 200:
+                    return resp
+                with _public_cache_lock:
+                    _public_cache[key] = (version, resp.get_data())
+                    _public_cache.move_to_end(key)
+                    while len(_public_cache) > current_app.config["PUBLIC_CACHE_SIZE"]:
+                        _public_cache.popitem(last=False)
+        resp.set_etag(etag)
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+    return wrapper
+
+# ---------------------------------------------------------------------
+# Flux temps réel du stock (SSE) : NOTIFY au commit, diffusion asyncio
+# ---------------------------------------------------------------------
+STOCK_CHANNEL = "stock_changes"
+STOCK_NOTIFY_CHUNK = 200  # articles par notification (charge utile NOTIFY < 8000 octets)
+
+def stock_changed(pairs):
+    """Note les articles modifiés [(antenna_id, stock_item_id)] ; diffusés au commit de la transaction."""
+    db.session.info.setdefault("stock_changes", set()).update((a, i) for a, i in pairs if a and i)
+
+@event.listens_for(db.session, "before_commit")
+def notify_stock_changes(session):
+    # NOTIFY est transactionnel : délivré au commit, dans l'ordre des commits, jamais en cas de rollback.
+    # Quantités absolues (null : article supprimé ou changé d'antenne) -> rejouables sans ordre strict.
+    if session.in_nested_transaction():
+        return
+    changes = session.info.pop("stock_changes", None)
+    if not changes or session.get_bind().dialect.name != "postgresql":
+        return
+    session.flush()  # before_commit précède le flush final : suppressions et += ORM visibles ci-dessous
+    antennas, items = zip(*sorted(changes))
+    session.execute(text(
+        "SELECT pg_notify(:channel, json_build_object('antenna_id', antenna_id, 'items', json_agg(json_build_array(item_id, quantity) ORDER BY item_id))::text) "
+        "FROM (SELECT c.antenna_id, c.item_id, s.quantity, "
+        "(row_number() OVER (PARTITION BY c.antenna_id ORDER BY c.item_id) - 1) / :chunk AS part "
+        "FROM unnest(CAST(:antennas AS integer[]), CAST(:items AS integer[])) AS c(antenna_id, item_id) "
+        "LEFT JOIN stock_items s ON s.id = c.item_id AND s.antenna_id = c.antenna_id) AS t "
+        "GROUP BY antenna_id, part"
+    ), {"channel": STOCK_CHANNEL, "chunk": STOCK_NOTIFY_CHUNK, "antennas": list(antennas), "items": list(items)})
+
+@event.listens_for(db.session, "after_soft_rollback")
+def discard_stock_changes(session, previous_transaction):
+    if not previous_transaction.nested:  # savepoint : quantités absolues, renvoyer l'état courant suffit
+        session.info.pop("stock_changes", None)
+
+class StockStream:
+    """Serveur SSE asyncio (processus séparé) : une seule boucle pour toutes les connexions inactives.
+
+    Écoute LISTEN stock_changes sur PostgreSQL et pousse chaque notification aux
+    abonnés de l'antenne (ou à tous sans antenna_id). Un client trop lent est
+    déconnecté : il se reconnecte et recharge le stock complet.
+    """
+    PATH = "/api/public/stream"
+
+    def __init__(self, app: Flask, max_clients: int = 5000, heartbeat: float = 20.0, queue_size: int = 64):
+        self.app, self.max_clients, self.heartbeat, self.queue_size = app, max_clients, heartbeat, queue_size
+        self.subscribers = {}  # antenna_id (None : toutes) -> {asyncio.Queue}
+        self.clients = 0
+        self.loop = None
+
+    def publish(self, message: bytes, antenna_id=None):
+        targets = self.subscribers.get(None, set())
+        if antenna_id is not None:
+            targets = targets | self.subscribers.get(antenna_id, set())
+        for q in targets:
+            try:
+                q.put_nowait(message)
+            except asyncio.QueueFull:
+                # client trop lent : file vidée puis coupure, il rechargera le stock à la reconnexion
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait(None)
+
+    @staticmethod
+    def event(name: str, data) -> bytes:
+        return f"event: {name}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n".encode()
+
+    # --- source : LISTEN/NOTIFY PostgreSQL
+    async def listen(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    conn = db.engine.raw_connection()
+                pg = conn.driver_connection
+                conn.detach()  # connexion dédiée, hors du pool
+                pg.autocommit = True
+                pg.cursor().execute(f"LISTEN {STOCK_CHANNEL}")
+            except Exception:
+                self.app.logger.exception("Écoute des changements de stock impossible")
+                await asyncio.sleep(5)
+                continue
+            lost = self.loop.create_future()
+            def on_ready():
+                try:
+                    pg.poll()
+                except Exception as e:
+                    self.loop.remove_reader(pg.fileno())
+                    if not lost.done():
+                        lost.set_result(e)
+                    return
+                while pg.notifies:
+                    payload = json.loads(pg.notifies.pop(0).payload)
+                    self.publish(self.event("stock", payload), payload["antenna_id"])
+            self.loop.add_reader(pg.fileno(), on_ready)
+            # des notifications ont pu être perdues pendant la coupure : les clients rechargent
+            self.publish(self.event("reset", {}))
+            error = await lost
+            self.app.logger.warning("Connexion LISTEN perdue (%s), reconnexion", error)
+            try:
+                pg.close()
+            except Exception:
+                pass
+            await asyncio.sleep(1)
+
+    # --- clients : HTTP minimal, réponse text/event-stream sans fin
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            writer.close()
+            return
+        method, _, target = head.split(b"\r\n", 1)[0].decode("latin-1").partition(" ")
+        path, _, query = target.split(" ", 1)[0].partition("?")
+        if method != "GET" or path != self.PATH:
+            return await self.reply(writer, "404 Not Found")
+        if self.clients >= self.max_clients:
+            return await self.reply(writer, "503 Service Unavailable", "Retry-After: 30\r\n")
+        antenna = parse_qs(query).get("antenna_id", [""])[0]
+        antenna_id = int(antenna) if antenna.isdigit() else None
+        q = asyncio.Queue(self.queue_size)
+        self.subscribers.setdefault(antenna_id, set()).add(q)
+        self.clients += 1
+        try:
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                b"X-Accel-Buffering: no\r\nAccess-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n"
+                b"retry: 3000\n\n"
+            )
+            await writer.drain()
+            while True:
+                try:
+                    message = await asyncio.wait_for(q.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    message = b": ping\n\n"  # détecte les clients partis, garde les proxys ouverts
+                if message is None:
+                    break
+                writer.write(message)
+                await asyncio.wait_for(writer.drain(), self.heartbeat)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.subscribers[antenna_id].discard(q)
+            if not self.subscribers[antenna_id]:
+                del self.subscribers[antenna_id]
+            self.clients -= 1
+            writer.close()
+
+    @staticmethod
+    async def reply(writer, status: str, headers: str = ""):
+        writer.write(f"HTTP/1.1 {status}\r\n{headers}Content-Length: 0\r\nConnection: close\r\n\r\n".encode())
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_server(self.handle, host, port, limit=8192)
+        listener = asyncio.create_task(self.listen())
+        self.app.logger.info("Flux du stock sur %s:%s%s", host, port, self.PATH)
+        async with server:
+            await server.serve_forever()
+        listener.cancel()
+
+@bp.cli.command("stream")
+@click.option("--host", default="0.0.0.0")
+@click.option("--port", default=8001, type=int)
+def stream_command(host, port):
+    """Sert /api/public/stream (SSE) ; à lancer à côté de gunicorn, derrière le même nginx."""
+    if db.engine.dialect.name != "postgresql":
+        raise click.ClickException("Le flux du stock nécessite PostgreSQL (LISTEN/NOTIFY)")
+    cfg = current_app.config
+    stream = StockStream(current_app._get_current_object(), cfg["STREAM_MAX_CLIENTS"], cfg["STREAM_HEARTBEAT"])
+    asyncio.run(stream.serve(host, port))
+
+@bp.get("/api/public/stream")
+def public_stream():
+    """Sans nginx devant : redirige vers le serveur de flux (STREAM_URL), sinon 503 (les pages se passent du direct)."""
+    url = current_app.config["STREAM_URL"]
+    if not url:
+        return jsonify({"ok": False, "error": "Flux temps réel non configuré"}), 503
+    return Response(status=307, headers={"Location": f"{url}?{request.query_string.decode()}"})
 
-def text_to_tags(txt):
-    if not txt: return []
-    return [t.strip() for t in str(txt).split(",") if t.strip()]
+# ---------------------------------------------------------------------
+# Compteurs du tableau de bord (mis à jour dans la transaction de chaque mouvement)
+# ---------------------------------------------------------------------
+def adjust_counters(**deltas):
+    rows = [{"name": k, "value": v} for k, v in sorted(deltas.items()) if v]
+    if rows:
+        stmt = dialect_insert(Counter).values(rows)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=["name"], set_={"value": Counter.value + stmt.excluded.value}))
+
+def adjust_stock_totals(deltas):
+    """Applique {(antenna_id, garment_type_id): delta} aux totaux de stock (ordre fixe : pas d'interblocage)."""
+    rows = [{"antenna_id": a, "garment_type_id": t, "quantity": d} for (a, t), d in sorted(deltas.items()) if d]
+    if rows:
+        stmt = dialect_insert(StockTotal).values(rows)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["antenna_id", "garment_type_id"], set_={"quantity": StockTotal.quantity + stmt.excluded.quantity}
+        ))
+
+def adjust_loan_daily(deltas):
+    """Ajoute {(antenna_id, garment_type_id, size): {"loans": n, "qty_out": q, ...}} aux agrégats du jour."""
+    today = datetime.utcnow().date()
+    rows = [
+        {"day": today, "antenna_id": a, "garment_type_id": t, "size": size or "",
+         "loans": 0, "qty_out": 0, "returns": 0, "qty_in": 0, "duration_days": 0, **d}
+        for (a, t, size), d in sorted(deltas.items(), key=lambda kv: (kv[0][0], kv[0][1], kv[0][2] or ""))
+    ]
+    if rows:
+        stmt = dialect_insert(LoanDaily).values(rows)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["day", "antenna_id", "garment_type_id", "size"],
+            set_={c: getattr(LoanDaily, c) + getattr(stmt.excluded, c) for c in ("loans", "qty_out", "returns", "qty_in", "duration_days")},
+        ))
+
+def refresh_alerts(*where):
+    """Réévalue les alertes stock bas des articles désignés (ex. StockItem.id.in_(ids)) sans toucher aux autres.
+
+    Les alertes toujours actives gardent leur date d'apparition (since).
+    """
+    db.session.execute(delete(StockAlert).where(StockAlert.stock_item_id.in_(
+        select(StockItem.id).join(Antenna, Antenna.id == StockItem.antenna_id)
+        .where(StockItem.quantity > low_stock_threshold(), *where)
+    )))
+    stmt = dialect_insert(StockAlert).from_select(["stock_item_id", "antenna_id", "quantity", "threshold"], low_stock_select(*where))
+    db.session.execute(stmt.on_conflict_do_update(index_elements=["stock_item_id"], set_={
+        "antenna_id": stmt.excluded.antenna_id, "quantity": stmt.excluded.quantity, "threshold": stmt.excluded.threshold,
+    }))
+
+# ---------------------------------------------------------------------
+# Pagination par clé (?after=<curseur>&limit=) et flux JSON (?stream=1)
+# ---------------------------------------------------------------------
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor, keys):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+    values = json.loads(raw)
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise ValueError("curseur invalide")
+    return [datetime.fromisoformat(v) if isinstance(k.type, db.DateTime) else v for k, v in zip(keys, values)]
+
+def stream_json(qry, to_dict):
+    """Écrit le tableau JSON au fil de l'eau depuis un curseur serveur ou un itérable (mémoire constante)."""
+    batch_size = current_app.config["STREAM_BATCH_SIZE"]
+    def generate():
+        yield "["
+        sep, chunk = "", []
+        for r in (qry.yield_per(batch_size) if hasattr(qry, "yield_per") else qry):
+            chunk.append(sep + json.dumps(to_dict(r), ensure_ascii=False))
+            sep = ","
+            if len(chunk) >= batch_size:
+                yield "".join(chunk); chunk = []
+        yield "".join(chunk) + "]"
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+def keyset_response(qry, keys, to_dict, descending=False, default_limit=None):
+    """Liste paginée par clé sur `keys` (colonnes indexées, la dernière unique).
+
+    Le corps reste un tableau JSON ; le curseur de la page suivante est renvoyé
+    dans l'en-tête `X-Next-Cursor`. Sans `limit`, page de `default_limit` lignes
+    (PAGE_DEFAULT_LIMIT) ; la liste complète n'est servie qu'en flux (`?stream=1`).
+    """
+    after = request.args.get("after")
+    if after:
+        try:
+            values = decode_cursor(after, keys)
+        except (ValueError, TypeError):
+            return jsonify({"ok": False, "error": "Curseur invalide"}), 400
+        qry = qry.filter(tuple_(*keys) < tuple(values) if descending else tuple_(*keys) > tuple(values))
+    qry = qry.order_by(*[k.desc() for k in keys] if descending else keys)
+    if request.args.get("stream", type=int):
+        return stream_json(qry, to_dict)
+    limit = request.args.get("limit", type=int) or default_limit or current_app.config["PAGE_DEFAULT_LIMIT"]
+    limit = max(1, min(limit, current_app.config["PAGE_MAX_LIMIT"]))
+    rows = qry.limit(limit + 1).all()
+    resp = jsonify([to_dict(r) for r in rows[:limit]])
+    if len(rows) > limit:
+        resp.headers["X-Next-Cursor"] = encode_cursor([rows[limit - 1]._mapping[k] for k in keys])
+    return resp
+
+def stream_csv(filename: str, header, qry, to_row):
+    """Export CSV (UTF-8 avec BOM, séparateur ;) écrit au fil de l'eau depuis un curseur serveur."""
+    batch_size = current_app.config["STREAM_BATCH_SIZE"]
+    def generate():
+        buf = StringIO()
+        w = csv.writer(buf, delimiter=";")
+        buf.write("\ufeff")
+        w.writerow(header)
+        for i, r in enumerate(qry.yield_per(batch_size), 1):
+            w.writerow(to_row(r))
+            if i % batch_size == 0:
+                yield buf.getvalue()
+                buf.seek(0); buf.truncate()
+        yield buf.getvalue()
+    return Response(
+        stream_with_context(generate()), content_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+def fmt_dt(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S") if value else ""
+
+# ---------------------------------------------------------------------
+# Métriques : durée par route, requêtes SQL, requêtes lentes (/metrics)
+# ---------------------------------------------------------------------
+class Metrics:
+    """Histogrammes en mémoire (taille fixe) par route, exposés au format texte Prometheus.
+
+    Compteurs propres au processus : avec plusieurs workers gunicorn, chaque
+    scrape ne voit que celui qui répond.
+    """
+    DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # secondes
+    STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+    def __init__(self):
+        self.slow_ms, self.sql_max = 200.0, 1000
+        self.logger = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._requests = {}    # (endpoint, méthode, statut) -> nombre
+        self._durations = {}   # endpoint -> [compteurs par seuil..., somme, nombre]
+        self._statements = {}  # endpoint -> idem, requêtes SQL par requête HTTP
+        self._db = {}          # endpoint -> [requêtes SQL, secondes]
+        self._slow_total = 0
+        self.slow = deque(maxlen=100)
+
+    def init_app(self, app: Flask):
+        self.slow_ms, self.logger = app.config["SLOW_QUERY_MS"], app.logger
+        self.slow = deque(maxlen=app.config["SLOW_QUERY_LOG_SIZE"])
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        with app.app_context():
+            event.listen(db.engine, "before_cursor_execute", self._before_execute)
+            event.listen(db.engine, "after_cursor_execute", self._after_execute)
+
+    # --- requêtes HTTP (teardown : après la fin des réponses en flux)
+    def _before_request(self):
+        self._local.request = {"start": time.perf_counter(), "status": 500, "statements": 0, "db": 0.0,
+                               "endpoint": request.endpoint or "inconnu"}
+
+    def _after_request(self, response):
+        state = getattr(self._local, "request", None)
+        if state is not None:
+            state["status"] = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        state = self._local.__dict__.pop("request", None)
+        if state is None:
+            return
+        elapsed = time.perf_counter() - state["start"]
+        endpoint = state["endpoint"]
+        with self._lock:
+            key = (endpoint, request.method, state["status"])
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._observe(self._durations, endpoint, self.DURATION_BUCKETS, elapsed)
+            self._observe(self._statements, endpoint, self.STATEMENT_BUCKETS, state["statements"])
+
+    @staticmethod
+    def _observe(store, key, buckets, value):
+        h = store.get(key)
+        if h is None:
+            h = store[key] = [0] * len(buckets) + [0.0, 0]
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+    # --- requêtes SQL (hors requête HTTP : commandes CLI, threads de fond)
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # sur le contexte d'exécution (une requête SQL) : rien ne reste si elle échoue
+        context._metrics_start = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_start
+        state = getattr(self._local, "request", None)
+        endpoint = state["endpoint"] if state else "hors_requete"
+        if state:
+            state["statements"] += 1
+            state["db"] += elapsed
+        slow = self.slow_ms and elapsed * 1000 >= self.slow_ms
+        sql = " ".join(statement.split())[:self.sql_max] if slow else None
+        with self._lock:
+            d = self._db.setdefault(endpoint, [0, 0.0])
+            d[0] += 1
+            d[1] += elapsed
+            if slow:
+                self._slow_total += 1
+                self.slow.append({
+                    "at": datetime.utcnow().isoformat(timespec="seconds"), "ms": round(elapsed * 1000, 1),
+                    "endpoint": endpoint, "sql": sql,
+                })
+        if slow:
+            self.logger.warning("Requête SQL lente (%.0f ms, %s) : %s", elapsed * 1000, endpoint, sql)
+
+    def slow_queries(self):
+        with self._lock:
+            return list(reversed(self.slow))
+
+    def render(self) -> str:
+        """Format texte Prometheus (version 0.0.4)."""
+        lines = []
+        def family(name, kind, doc):
+            lines.append(f"# HELP {name} {doc}")
+            lines.append(f"# TYPE {name} {kind}")
+        def histogram(name, store, buckets):
+            for endpoint, h in sorted(store.items()):
+                for bound, count in zip(buckets, h):
+                    lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {h[-1]}')
+                lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {h[-2]:.6f}')
+                lines.append(f'{name}_count{{endpoint="{endpoint}"}} {h[-1]}')
+        with self._lock:
+            family("habillement_http_requests_total", "counter", "Requêtes HTTP par route, méthode et statut.")
+            for (endpoint, method, status), n in sorted(self._requests.items()):
+                lines.append(f'habillement_http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {n}')
+            family("habillement_http_request_duration_seconds", "histogram", "Durée des requêtes HTTP par route.")
+            histogram("habillement_http_request_duration_seconds", self._durations, self.DURATION_BUCKETS)
+            family("habillement_http_request_statements", "histogram", "Requêtes SQL par requête HTTP.")
+            histogram("habillement_http_request_statements", self._statements, self.STATEMENT_BUCKETS)
+            family("habillement_db_statements_total", "counter", "Requêtes SQL exécutées par route.")
+            for endpoint, (n, _) in sorted(self._db.items()):
+                lines.append(f'habillement_db_statements_total{{endpoint="{endpoint}"}} {n}')
+            family("habillement_db_duration_seconds_total", "counter", "Temps passé en base par route.")
+            for endpoint, (_, seconds) in sorted(self._db.items()):
+                lines.append(f'habillement_db_duration_seconds_total{{endpoint="{endpoint}"}} {seconds:.6f}')
+            family("habillement_db_slow_statements_total", "counter", "Requêtes SQL au-delà de SLOW_QUERY_MS.")
+            lines.append(f"habillement_db_slow_statements_total {self._slow_total}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+# ---------------------------------------------------------------------
+# Ressources statiques : empreintes, variantes précompressées, gzip du JSON
+# ---------------------------------------------------------------------
+COMPRESSIBLE_SUFFIXES = (".js", ".css", ".svg", ".json", ".html", ".txt")
+COMPRESS_MIMETYPES = {"application/json", "text/html"}
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+def build_assets(static_dir: str, out_dir: str) -> dict:
+    """Copie chaque fichier de static/ sous un nom à empreinte (nom.<sha256>.ext) avec ses variantes .gz/.br.
+
+    Écrit manifest.json ({nom: nom à empreinte}) en dernier et supprime les
+    fichiers des versions précédentes ; renvoie le manifeste.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest, keep = {}, {"manifest.json"}
+    for name in sorted(os.listdir(static_dir)):
+        path = os.path.join(static_dir, name)
+        if not os.path.isfile(path) or name.startswith("."):
+            continue
+        with open(path, "rb") as fh:
+            data = fh.read()
+        stem, ext = os.path.splitext(name)
+        hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+        variants = {hashed: lambda: data}
+        if ext in COMPRESSIBLE_SUFFIXES:
+            variants[hashed + ".gz"] = lambda: gzip.compress(data, compresslevel=9, mtime=0)
+            if brotli:
+                variants[hashed + ".br"] = lambda: brotli.compress(data, quality=11)
+        for filename, make in variants.items():
+            keep.add(filename)
+            target = os.path.join(out_dir, filename)
+            if os.path.exists(target):
+                continue  # même nom, même contenu (empreinte du source)
+            content = make()
+            if filename != hashed and len(content) >= len(data):
+                continue  # compression sans gain
+            with open(target + ".tmp", "wb") as fh:
+                fh.write(content)
+            os.replace(target + ".tmp", target)
+        manifest[name] = hashed
+    with open(os.path.join(out_dir, "manifest.json.tmp"), "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=1, sort_keys=True)
+    os.replace(os.path.join(out_dir, "manifest.json.tmp"), os.path.join(out_dir, "manifest.json"))
+    for filename in os.listdir(out_dir):
+        if filename not in keep:
+            os.remove(os.path.join(out_dir, filename))
+    return manifest
+
+_assets = {"mtime": None, "manifest": {}}
+
+def asset_manifest() -> dict:
+    """Manifeste de build-assets, relu quand le fichier change ({} si les ressources ne sont pas construites)."""
+    path = os.path.join(current_app.config["ASSETS_DIR"], "manifest.json")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    if _assets["mtime"] != mtime:
+        with open(path, encoding="utf-8") as fh:
+            _assets.update(manifest=json.load(fh), mtime=mtime)
+    return _assets["manifest"]
+
+@bp.app_template_global()
+def asset_url(name: str) -> str:
+    """URL à empreinte (cache immuable) si construite, sinon /static/<name>."""
+    hashed = asset_manifest().get(name)
+    return f"/assets/{hashed}" if hashed else f"/static/{name}"
+
+@bp.cli.command("build-assets")
+def build_assets_command():
+    """Construit static/dist : noms à empreinte et variantes gzip/brotli (à relancer après modification)."""
+    manifest = build_assets(current_app.static_folder, current_app.config["ASSETS_DIR"])
+    for name, hashed in manifest.items():
+        print(f"{name} -> {hashed}")
+    if not brotli:
+        print("module brotli absent : variantes .gz seulement")
+
+@bp.get("/assets/<filename>")
+def asset(filename):
+    """Ressource à empreinte : jamais revalidée ; variante .br ou .gz selon Accept-Encoding."""
+    if filename not in asset_manifest().values():
+        return jsonify({"ok": False}), 404
+    directory = current_app.config["ASSETS_DIR"]
+    chosen, encoding = filename, None
+    for suffix, enc in ((".br", "br"), (".gz", "gzip")):
+        if request.accept_encodings[enc] and os.path.exists(os.path.join(directory, filename + suffix)):
+            chosen, encoding = filename + suffix, enc
+            break
+    resp = send_from_directory(directory, chosen, mimetype=mimetypes.guess_type(filename)[0], max_age=ASSET_MAX_AGE)
+    resp.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    resp.vary.add("Accept-Encoding")
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    return resp
+
+@bp.after_app_request
+def compress_response(resp):
+    """Gzip à la volée des réponses JSON/HTML au-delà de COMPRESS_MIN_SIZE (hors flux et 304)."""
+    min_size = current_app.config["COMPRESS_MIN_SIZE"]
+    if (
+        min_size <= 0 or resp.mimetype not in COMPRESS_MIMETYPES or resp.status_code != 200
+        or resp.direct_passthrough or resp.is_streamed or "Content-Encoding" in resp.headers
+    ):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    if not request.accept_encodings["gzip"] or resp.content_length is None or resp.content_length < min_size:
+        return resp
+    resp.set_data(gzip.compress(resp.get_data(), compresslevel=current_app.config["COMPRESS_LEVEL"], mtime=0))
+    resp.headers["Content-Encoding"] = "gzip"
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        resp.set_etag(etag, weak=True)  # même contenu, autre encodage
+    return resp
 
 # ---------------------------------------------------------------------
 # Routes de base
 # ---------------------------------------------------------------------
-@app.route("/")
-@app.route("/a/<int:antenna_id>")
+@bp.route("/")
+@bp.route("/a/<int:antenna_id>")
 def index(antenna_id=None):
-    return render_template("index.html")
+    """Page unique : revalidée à chaque visite (ETag), les ressources à empreinte restent en cache."""
+    resp = Response(render_template("index.html"), mimetype="text/html")
+    resp.add_etag()
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
 
-@app.get("/healthz")
+@bp.get("/healthz")
 def healthz():
     try:
         db.session.execute(text("SELECT 1"))
@@ -191,27 +1451,153 @@ def healthz():
     except Exception as e:
         return f"db error: {e}", 500
 
+@bp.get("/metrics")
+def metrics_export():
+    token = current_app.config["METRICS_TOKEN"]
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return "forbidden", 403
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+@bp.get("/api/metrics/slow")
+@login_required
+def metrics_slow():
+    """Dernières requêtes SQL lentes de ce processus (les plus récentes d'abord)."""
+    return jsonify({"threshold_ms": metrics.slow_ms, "items": metrics.slow_queries()})
+
+# ---------------------------------------------------------------------
+# Mots de passe : bcrypt hors du thread de requête, tentatives limitées
+# ---------------------------------------------------------------------
+class HasherBusy(Exception):
+    pass
+
+class PasswordHasher:
+    """bcrypt dans un pool borné : `workers` hachages simultanés, `backlog` en attente, au-delà HasherBusy.
+
+    Le coût (BCRYPT_ROUNDS) s'applique aux nouveaux hachages ; les anciens sont
+    refaits à la connexion suivante (needs_update).
+    """
+
+    def __init__(self):
+        self.scheme = bcrypt
+        self.workers, self.backlog = 1, 8
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = self._slots = None
+
+    def init_app(self, app: Flask):
+        self.scheme = bcrypt.using(rounds=app.config["BCRYPT_ROUNDS"])
+        self.workers, self.backlog = app.config["BCRYPT_WORKERS"], app.config["BCRYPT_BACKLOG"]
+        self._pid = None
+
+    def _run(self, fn, *args):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="bcrypt")
+                    self._slots = threading.BoundedSemaphore(self.workers + self.backlog)
+                    self._pid = os.getpid()
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password: str) -> str:
+        return self._run(self.scheme.hash, password)
+
+    def verify(self, password: str, pwd_hash: str) -> bool:
+        return self._run(self.scheme.verify, password, pwd_hash)
+
+    def needs_update(self, pwd_hash: str) -> bool:
+        return self.scheme.needs_update(pwd_hash)
+
+class LoginThrottle:
+    """Fenêtre glissante en mémoire (par processus) : échecs par IP et par (compte, IP)."""
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._hits = OrderedDict()  # clé -> instants, de la moins récemment touchée à la plus récente
+        self._lock = threading.Lock()
+
+    def retry_after(self, key: str, limit: int, window: int) -> int:
+        """Secondes avant la prochaine tentative autorisée (0 : autorisée)."""
+        if limit <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            while hits and hits[0] <= now - window:
+                hits.popleft()
+            if not hits or len(hits) < limit:
+                return 0
+            return int(hits[0] + window - now) + 1
+
+    def hit(self, key: str, window: int):
+        now = time.monotonic()
+        with self._lock:
+            hits = self._hits.get(key)
+            if hits is None:
+                # mémoire bornée face aux IP/comptes aléatoires : éviction LRU (les clés expirées partent en premier)
+                while len(self._hits) >= self.max_keys:
+                    self._hits.popitem(last=False)
+                hits = self._hits[key] = deque()
+            else:
+                self._hits.move_to_end(key)
+            hits.append(now)
+
+    def reset(self, key: str):
+        with self._lock:
+            self._hits.pop(key, None)
+
+passwords = PasswordHasher()
+login_throttle = LoginThrottle()
+
+@bp.errorhandler(HasherBusy)
+def hasher_busy(e):
+    resp = jsonify({"ok": False, "error": "Serveur occupé, réessayez dans un instant"})
+    resp.headers["Retry-After"] = "1"
+    return resp, 503
+
 # ---------------------------------------------------------------------
 # Auth
 # ---------------------------------------------------------------------
-@app.post("/api/login")
+@bp.post("/api/login")
 def login_api():
     d = request.get_json() or {}
     email = (d.get("email") or "").strip().lower()
     password = d.get("password") or ""
+    cfg = current_app.config
+    # compte limité par IP : un tiers ne peut pas bloquer l'admin depuis une autre adresse
+    ip_key, account_key = f"ip:{request.remote_addr}", f"account:{email}|{request.remote_addr}"
+    wait = max(
+        login_throttle.retry_after(ip_key, cfg["LOGIN_IP_LIMIT"], cfg["LOGIN_WINDOW"]),
+        login_throttle.retry_after(account_key, cfg["LOGIN_ACCOUNT_LIMIT"], cfg["LOGIN_WINDOW"]),
+    )
+    if wait:
+        resp = jsonify({"ok": False, "error": f"Trop de tentatives, réessayez dans {wait} s"})
+        resp.headers["Retry-After"] = str(wait)
+        return resp, 429
     u = User.query.filter_by(email=email).first()
-    if not u or not bcrypt.verify(password, u.pwd_hash):
+    if not u or not passwords.verify(password, u.pwd_hash):
+        # seuls les échecs comptent : les connexions réussies derrière un même NAT ne bloquent personne
+        login_throttle.hit(ip_key, cfg["LOGIN_WINDOW"])
+        login_throttle.hit(account_key, cfg["LOGIN_WINDOW"])
         return jsonify({"ok": False, "error": "Identifiants invalides"}), 401
+    login_throttle.reset(account_key)
+    if passwords.needs_update(u.pwd_hash):
+        u.pwd_hash = passwords.hash(password)
+        db.session.commit()
     login_user(u)
     return jsonify({"ok": True, "user": {"id": u.id, "email": u.email, "name": u.name, "role": u.role}})
 
-@app.post("/api/logout")
+@bp.post("/api/logout")
 @login_required
 def logout_api():
     logout_user()
     return jsonify({"ok": True})
 
-@app.get("/api/me")
+@bp.get("/api/me")
 def me():
     if current_user.is_authenticated:
         return jsonify(
@@ -222,24 +1608,145 @@ def me():
 # ---------------------------------------------------------------------
 # Stats
 # ---------------------------------------------------------------------
-@app.get("/api/stats")
+@bp.get("/api/stats")
 @login_required
 def stats():
-    stock_total = db.session.query(db.func.coalesce(db.func.sum(StockItem.quantity), 0)).scalar()
-    loans_open = Loan.query.filter(Loan.returned_at.is_(None)).count()
-    volunteers = Volunteer.query.count()
-    return jsonify({"stock_total": stock_total, "prets_ouverts": loans_open, "benevoles": volunteers})
+    """Lit les agrégats maintenus (counters, stock_totals) au lieu de balayer stock, prêts et bénévoles."""
+    counters = dict(db.session.query(Counter.name, Counter.value).all())
+    per_antenna = (
+        db.session.query(Antenna.id, Antenna.name, db.func.coalesce(db.func.sum(StockTotal.quantity), 0))
+        .outerjoin(StockTotal, StockTotal.antenna_id == Antenna.id)
+        .group_by(Antenna.id, Antenna.name).order_by(Antenna.name).all()
+    )
+    per_type = (
+        db.session.query(GarmentType.id, GarmentType.label, db.func.coalesce(db.func.sum(StockTotal.quantity), 0))
+        .outerjoin(StockTotal, StockTotal.garment_type_id == GarmentType.id)
+        .group_by(GarmentType.id, GarmentType.label).order_by(GarmentType.label).all()
+    )
+    return jsonify({
+        "stock_total": sum(int(q) for _, _, q in per_antenna),
+        "prets_ouverts": counters.get("loans_open", 0),
+        "benevoles": counters.get("volunteers", 0),
+        "par_antenne": [{"antenna_id": i, "antenna": n, "stock": int(q)} for i, n, q in per_antenna],
+        "par_type": [{"garment_type_id": i, "type": n, "stock": int(q)} for i, n, q in per_type],
+    })
+
+# ---------------------------------------------------------------------
+# Analyses de consommation (agrégats journaliers loan_daily)
+# ---------------------------------------------------------------------
+ANALYTICS_GROUPS = {"antenna": LoanDaily.antenna_id, "type": LoanDaily.garment_type_id, "size": LoanDaily.size}
+
+def bucket_start(bucket: str):
+    """Premier jour de la période (jour, semaine commençant le lundi, mois) de LoanDaily.day."""
+    if bucket == "day":
+        return LoanDaily.day
+    if db.engine.dialect.name == "sqlite":
+        modifiers = ("weekday 0", "-6 days") if bucket == "week" else ("start of month",)
+        return type_coerce(db.func.date(LoanDaily.day, *modifiers), db.Date)
+    return cast(db.func.date_trunc(bucket, LoanDaily.day), db.Date)
+
+def analytics_filters():
+    """Filtres communs : antenna_id, garment_type_id, size ; renvoie les conditions sur LoanDaily."""
+    a = request.args
+    where = []
+    if a.get("antenna_id", type=int): where.append(LoanDaily.antenna_id == a.get("antenna_id", type=int))
+    if a.get("garment_type_id", type=int): where.append(LoanDaily.garment_type_id == a.get("garment_type_id", type=int))
+    if "size" in a: where.append(LoanDaily.size == a["size"])
+    return where
+
+@bp.get("/api/analytics/loans")
+@login_required
+def analytics_loans():
+    """Prêts, quantités sorties/rentrées, sortie nette et durée moyenne par période.
+
+    ?bucket=day|week|month (défaut week), from/to (dates ISO, to exclu ; défaut :
+    les 365 derniers jours), group=antenna,type,size (dimensions conservées).
+    """
+    a = request.args
+    bucket = a.get("bucket", "week")
+    if bucket not in ("day", "week", "month"):
+        return jsonify({"ok": False, "error": "bucket : day, week ou month"}), 400
+    groups = [g.strip() for g in a.get("group", "antenna,type,size").split(",") if g.strip()]
+    if any(g not in ANALYTICS_GROUPS for g in groups):
+        return jsonify({"ok": False, "error": "group : antenna, type et/ou size"}), 400
+    to = a.get("to", type=date.fromisoformat) or datetime.utcnow().date() + timedelta(days=1)
+    start = a.get("from", type=date.fromisoformat) or to - timedelta(days=366)
+    period = bucket_start(bucket).label("period")
+    dims = [ANALYTICS_GROUPS[g] for g in groups]
+    qty_out, qty_in = db.func.sum(LoanDaily.qty_out), db.func.sum(LoanDaily.qty_in)
+    rows = db.session.execute(
+        select(
+            period, *dims, db.func.sum(LoanDaily.loans), qty_out, db.func.sum(LoanDaily.returns), qty_in,
+            qty_out - qty_in, db.func.sum(LoanDaily.duration_days),
+        )
+        .where(LoanDaily.day >= start, LoanDaily.day < to, *analytics_filters())
+        .group_by(period, *dims)
+        .order_by(period, *dims)
+    ).all()
+    keys = ["period", *(d.key for d in dims), "loans", "qty_out", "returns", "qty_in", "net_out"]
+    out = []
+    for r in rows:
+        row = dict(zip(keys, r))
+        row["period"] = r[0].isoformat()
+        row["avg_duration_days"] = round(r[-1] / row["returns"], 1) if row["returns"] else None
+        out.append(row)
+    return jsonify({"bucket": bucket, "from": start.isoformat(), "to": to.isoformat(), "rows": out})
+
+@bp.get("/api/analytics/forecast")
+@login_required
+def analytics_forecast():
+    """Demande prévue par antenne, type et taille sur ?horizon= jours (défaut 30).
+
+    Moyenne mobile des ?history= derniers jours (défaut 90) : sorties par jour
+    et sortie nette (sorties - retours), comparée au stock actuel de l'article.
+    """
+    a = request.args
+    horizon = max(1, min(a.get("horizon", 30, type=int), 365))
+    history = max(7, min(a.get("history", 90, type=int), 730))
+    today = datetime.utcnow().date()
+    agg = (
+        select(
+            LoanDaily.antenna_id, LoanDaily.garment_type_id, LoanDaily.size,
+            db.func.sum(LoanDaily.qty_out).label("qty_out"), db.func.sum(LoanDaily.qty_in).label("qty_in"),
+        )
+        .where(LoanDaily.day > today - timedelta(days=history), LoanDaily.day <= today, *analytics_filters())
+        .group_by(LoanDaily.antenna_id, LoanDaily.garment_type_id, LoanDaily.size)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(agg, Antenna.name, GarmentType.label, StockItem.id, StockItem.quantity)
+        .join(Antenna, Antenna.id == agg.c.antenna_id)
+        .join(GarmentType, GarmentType.id == agg.c.garment_type_id)
+        .outerjoin(StockItem, (StockItem.antenna_id == agg.c.antenna_id)
+                   & (StockItem.garment_type_id == agg.c.garment_type_id) & (STOCK_ITEM_KEY[2] == agg.c.size))
+    ).all()
+    out = []
+    for r in rows:
+        out_per_day = int(r.qty_out) / history
+        net_per_day = (int(r.qty_out) - int(r.qty_in)) / history
+        stock = r.quantity or 0
+        need = max(0, math.ceil(net_per_day * horizon) - stock)
+        out.append({
+            "antenna_id": r.antenna_id, "antenna": r.name, "garment_type_id": r.garment_type_id, "type": r.label,
+            "size": r.size or None, "stock_item_id": r.id, "stock": stock,
+            "out_per_day": round(out_per_day, 3), "net_out_per_day": round(net_per_day, 3),
+            "forecast_out": round(out_per_day * horizon, 1), "forecast_net_out": round(net_per_day * horizon, 1),
+            "days_of_cover": round(stock / net_per_day, 1) if net_per_day > 0 else None,
+            "restock": need,
+        })
+    out.sort(key=lambda x: (-x["restock"], x["days_of_cover"] if x["days_of_cover"] is not None else float("inf"), x["antenna"], x["type"]))
+    return jsonify({"horizon": horizon, "history": history, "rows": out})
 
 # ---------------------------------------------------------------------
 # Antennas
 # ---------------------------------------------------------------------
-@app.get("/api/antennas")
+@bp.get("/api/antennas")
 @login_required
 def antennas_list():
     items = Antenna.query.order_by(Antenna.name).all()
     return jsonify([{"id": a.id, "name": a.name, "address": a.address, "low_stock_threshold": a.low_stock_threshold, "lat": a.lat, "lng": a.lng} for a in items])
 
-@app.post("/api/antennas")
+@bp.post("/api/antennas")
 @login_required
 def antennas_add():
     d = request.get_json() or {}
@@ -253,7 +1760,7 @@ def antennas_add():
     db.session.commit()
     return jsonify({"ok": True, "id": a.id})
 
-@app.put("/api/antennas/<int:ant_id>")
+@bp.put("/api/antennas/<int:ant_id>")
 @login_required
 def antennas_update(ant_id):
     d = request.get_json() or {}
@@ -268,10 +1775,14 @@ def antennas_update(ant_id):
     a.low_stock_threshold = d.get("low_stock_threshold") if "low_stock_threshold" in d else a.low_stock_threshold
     a.lat = d.get("lat") if "lat" in d else a.lat
     a.lng = d.get("lng") if "lng" in d else a.lng
+    if "low_stock_threshold" in d:
+        db.session.flush()
+        refresh_alerts(StockItem.antenna_id == a.id)
+    bump_stock_version(a.id)
     db.session.commit()
     return jsonify({"ok": True})
 
-@app.delete("/api/antennas/<int:ant_id>")
+@bp.delete("/api/antennas/<int:ant_id>")
 @login_required
 def antennas_delete(ant_id):
     a: Antenna = db.session.get(Antenna, ant_id)
@@ -290,13 +1801,13 @@ def antennas_delete(ant_id):
 # ---------------------------------------------------------------------
 # Users
 # ---------------------------------------------------------------------
-@app.get("/api/users")
+@bp.get("/api/users")
 @login_required
 def users_list():
     users = User.query.order_by(User.email).all()
     return jsonify([{"id": u.id, "email": u.email, "name": u.name, "role": u.role} for u in users])
 
-@app.post("/api/users")
+@bp.post("/api/users")
 @login_required
 def users_add():
     d = request.get_json() or {}
@@ -308,14 +1819,14 @@ def users_add():
     u = User(
         email=email,
         name=d.get("name", "").strip() or email,
-        pwd_hash=bcrypt.hash(d.get("password")),
+        pwd_hash=passwords.hash(d.get("password")),
         role=d.get("role", "admin"),
     )
     db.session.add(u)
     db.session.commit()
     return jsonify({"ok": True, "id": u.id})
 
-@app.put("/api/users/<int:user_id>")
+@bp.put("/api/users/<int:user_id>")
 @login_required
 def users_update(user_id):
     d = request.get_json() or {}
@@ -325,11 +1836,13 @@ def users_update(user_id):
     u.name = d.get("name", u.name)
     u.role = d.get("role", u.role)
     if d.get("password"):
-        u.pwd_hash = bcrypt.hash(d["password"])
+        u.pwd_hash = passwords.hash(d["password"])
+    bump_versions("users")
     db.session.commit()
+    user_cache.invalidate(user_id)
     return jsonify({"ok": True})
 
-@app.delete("/api/users/<int:user_id>")
+@bp.delete("/api/users/<int:user_id>")
 @login_required
 def users_delete(user_id):
     u = db.session.get(User, user_id)
@@ -342,22 +1855,24 @@ def users_delete(user_id):
         return jsonify({"ok": False, "error": "Impossible : l'utilisateur est lié à des inventaires."}), 400
     try:
         db.session.delete(u)
+        bump_versions("users")
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
         return jsonify({"ok": False, "error": "Suppression refusée (contraintes liées)."}), 400
+    user_cache.invalidate(user_id)
     return jsonify({"ok": True})
 
 # ---------------------------------------------------------------------
 # Garment Types (CRUD + suppression)
 # ---------------------------------------------------------------------
-@app.get("/api/types")
+@bp.get("/api/types")
 @login_required
 def types_list():
     items = GarmentType.query.order_by(GarmentType.label).all()
     return jsonify([{"id": t.id, "label": t.label, "has_size": t.has_size} for t in items])
 
-@app.post("/api/types")
+@bp.post("/api/types")
 @login_required
 def types_add():
     d = request.get_json() or {}
@@ -371,7 +1886,7 @@ def types_add():
     db.session.commit()
     return jsonify({"id": t.id})
 
-@app.delete("/api/types/<int:type_id>")
+@bp.delete("/api/types/<int:type_id>")
 @login_required
 def types_delete(type_id):
     t = db.session.get(GarmentType, type_id)
@@ -390,33 +1905,39 @@ def types_delete(type_id):
 # ---------------------------------------------------------------------
 # Stock (tags)
 # ---------------------------------------------------------------------
-@app.get("/api/stock")
+@bp.get("/api/stock")
 @login_required
 def stock_list():
-    out = []
-    qry = StockItem.query
+    qry = (
+        db.session.query(
+            StockItem.id, StockItem.garment_type_id, GarmentType.label, StockItem.antenna_id, Antenna.name,
+            StockItem.size, StockItem.quantity, tags_column(),
+        )
+        .join(GarmentType, StockItem.garment_type_id == GarmentType.id)
+        .join(Antenna, StockItem.antenna_id == Antenna.id)
+    )
     t = request.args.get("type_id", type=int)
     a = request.args.get("antenna_id", type=int)
     if t:
         qry = qry.filter(StockItem.garment_type_id == t)
     if a:
         qry = qry.filter(StockItem.antenna_id == a)
-    for s in qry.all():
-        out.append(
-            {
-                "id": s.id,
-                "garment_type_id": s.garment_type_id,
-                "garment_type": s.garment_type.label,
-                "antenna_id": s.antenna_id,
-                "antenna": s.antenna.name,
-                "size": s.size,
-                "quantity": s.quantity,
-                "tags": text_to_tags(s.tags_text),
-            }
-        )
-    return jsonify(out)
-
-@app.post("/api/stock")
+    qry = filter_by_tags(qry)
+    return keyset_response(qry, [StockItem.id], stock_row)
+
+def stock_row(s):
+    return {
+        "id": s.id,
+        "garment_type_id": s.garment_type_id,
+        "garment_type": s.label,
+        "antenna_id": s.antenna_id,
+        "antenna": s.name,
+        "size": s.size,
+        "quantity": s.quantity,
+        "tags": sorted(s.tags.split(",")) if s.tags else [],
+    }
+
+@bp.post("/api/stock")
 @login_required
 def stock_add():
     d = request.get_json() or {}
@@ -424,91 +1945,338 @@ def stock_add():
     a = int(d.get("antenna_id"))
     size = d.get("size")
     qty = int(d.get("quantity") or 0)
-    tags = tags_to_text(d.get("tags"))
+    tags = parse_tags(d.get("tags"))
     if qty <= 0:
         return jsonify({"ok": False, "error": "quantité > 0 requise"}), 400
-    item = StockItem.query.filter_by(garment_type_id=t, antenna_id=a, size=size).first()
-    if item:
-        item.quantity += qty
-        # fusion des tags
-        merged = set(text_to_tags(item.tags_text)) | set(text_to_tags(tags))
-        item.tags_text = tags_to_text(list(merged))
-    else:
-        item = StockItem(garment_type_id=t, antenna_id=a, size=size, quantity=qty, tags_text=tags)
-        db.session.add(item)
-    log_action("stock.add", "stock", getattr(item, "id", None), f"+{qty} type={t} ant={a} size={size}")
+    # création ou ajout en une requête atomique (index unique type/antenne/taille)
+    stmt = dialect_insert(StockItem).values(garment_type_id=t, antenna_id=a, size=size, quantity=qty)
+    item_id = db.session.execute(
+        stmt.on_conflict_do_update(index_elements=list(STOCK_ITEM_KEY), set_={"quantity": StockItem.quantity + qty})
+        .returning(StockItem.id)
+    ).scalar()
+    # fusion des tags (ON CONFLICT DO NOTHING)
+    add_tags(item_id, tags)
+    adjust_stock_totals({(a, t): qty})
+    refresh_alerts(StockItem.id == item_id)
+    bump_stock_version(a)
+    stock_changed([(a, item_id)])
+    log_action("stock.add", "stock", item_id, f"+{qty} type={t} ant={a} size={size}")
     db.session.commit()
-    return jsonify({"id": item.id})
+    return jsonify({"id": item_id})
 
-@app.put("/api/stock/<int:item_id>")
+@bp.put("/api/stock/<int:item_id>")
 @login_required
 def stock_update(item_id):
     d = request.get_json() or {}
-    s = db.session.get(StockItem, item_id)
+    s = db.session.get(StockItem, item_id, with_for_update=True)
     if not s:
         return jsonify({"ok": False}), 404
     before = s.quantity
+    old_antenna, old_type = s.antenna_id, s.garment_type_id
     s.garment_type_id = int(d.get("garment_type_id", s.garment_type_id))
     s.antenna_id = int(d.get("antenna_id", s.antenna_id))
     s.size = d.get("size", s.size)
     if "quantity" in d:
         s.quantity = int(d["quantity"])
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"ok": False, "error": "Cet article existe déjà pour ce type, cette antenne et cette taille."}), 409
     if "tags" in d:
-        s.tags_text = tags_to_text(d.get("tags"))
-    db.session.commit()
+        set_tags(item_id, parse_tags(d.get("tags")))
+    totals = {(old_antenna, old_type): -before}
+    key = (s.antenna_id, s.garment_type_id)
+    totals[key] = totals.get(key, 0) + s.quantity
+    adjust_stock_totals(totals)
+    db.session.flush()
+    refresh_alerts(StockItem.id == item_id)
+    bump_stock_version(old_antenna, s.antenna_id)
+    stock_changed([(old_antenna, item_id), (s.antenna_id, item_id)])
     log_action("stock.update", "stock", item_id, f"{before}->{s.quantity}")
+    db.session.commit()
     return jsonify({"ok": True})
 
-@app.delete("/api/stock/<int:item_id>")
+@bp.delete("/api/stock/<int:item_id>")
 @login_required
 def stock_delete(item_id):
-    s = db.session.get(StockItem, item_id)
+    s = db.session.get(StockItem, item_id, with_for_update=True)
     if not s:
         return jsonify({"ok": False}), 404
     # Bloque si des prêts existent (ouverts ou historiques)
     if Loan.query.filter_by(stock_item_id=item_id).first():
         return jsonify({"ok": False, "error": "Impossible : cet article a des prêts associés."}), 400
     try:
+        bump_stock_version(s.antenna_id)
+        stock_changed([(s.antenna_id, item_id)])
+        adjust_stock_totals({(s.antenna_id, s.garment_type_id): -(s.quantity or 0)})
+        db.session.execute(delete(StockItemTag).where(StockItemTag.stock_item_id == item_id))
+        db.session.execute(delete(StockAlert).where(StockAlert.stock_item_id == item_id))
         db.session.delete(s)
+        log_action("stock.delete", "stock", item_id, "delete")
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
         return jsonify({"ok": False, "error": "Suppression refusée (contraintes liées)."}), 400
-    log_action("stock.delete", "stock", item_id, "delete")
     return jsonify({"ok": True})
 
+@bp.get("/api/stock/low")
+@login_required
+def stock_low():
+    """Manques par (antenne, type, taille) en une requête groupée ; ?default= remplace le seuil par défaut."""
+    default = request.args.get("default", current_app.config["LOW_STOCK_THRESHOLD"], type=int)
+    threshold = db.func.coalesce(Antenna.low_stock_threshold, default)
+    quantity = db.func.coalesce(db.func.sum(StockItem.quantity), 0)
+    qry = (
+        db.session.query(
+            StockItem.antenna_id, Antenna.name, StockItem.garment_type_id, GarmentType.label, StockItem.size,
+            quantity.label("quantity"), threshold.label("threshold"),
+        )
+        .join(Antenna, Antenna.id == StockItem.antenna_id)
+        .join(GarmentType, GarmentType.id == StockItem.garment_type_id)
+        .group_by(StockItem.antenna_id, Antenna.name, Antenna.low_stock_threshold,
+                  StockItem.garment_type_id, GarmentType.label, StockItem.size)
+        .having(quantity <= threshold)
+        .order_by(Antenna.name, GarmentType.label, StockItem.size)
+    )
+    antenna_id = request.args.get("antenna_id", type=int)
+    if antenna_id:
+        qry = qry.filter(StockItem.antenna_id == antenna_id)
+    return jsonify([
+        {"antenna_id": r[0], "antenna": r[1], "garment_type_id": r[2], "garment_type": r[3], "size": r[4],
+         "quantity": int(r.quantity), "threshold": r.threshold}
+        for r in qry
+    ])
+
+@bp.get("/api/stock/alerts")
+@login_required
+def stock_alerts():
+    """Liste d'alertes précalculée (seuil de l'antenne ou LOW_STOCK_THRESHOLD)."""
+    qry = (
+        db.session.query(
+            StockAlert.stock_item_id, StockAlert.antenna_id, Antenna.name, GarmentType.label, StockItem.size,
+            StockAlert.quantity, StockAlert.threshold, StockAlert.since,
+        )
+        .join(StockItem, StockItem.id == StockAlert.stock_item_id)
+        .join(Antenna, Antenna.id == StockAlert.antenna_id)
+        .join(GarmentType, GarmentType.id == StockItem.garment_type_id)
+        .order_by(Antenna.name, GarmentType.label, StockItem.size)
+    )
+    antenna_id = request.args.get("antenna_id", type=int)
+    if antenna_id:
+        qry = qry.filter(StockAlert.antenna_id == antenna_id)
+    return jsonify([
+        {"stock_item_id": r[0], "antenna_id": r[1], "antenna": r[2], "garment_type": r[3], "size": r[4],
+         "quantity": r.quantity, "threshold": r.threshold, "since": r.since.isoformat() if r.since else None}
+        for r in qry
+    ])
+
+# ---------------------------------------------------------------------
+# Transferts entre antennes (tout ou rien, une ligne de mouvement par article)
+# ---------------------------------------------------------------------
+def parse_transfer_lines(raw):
+    """{(garment_type_id, taille ou ""): qty} depuis [{garment_type_id, size, qty}] ; ValueError si invalide."""
+    lines = {}
+    for it in raw or []:
+        try:
+            key = (int(it.get("garment_type_id")), str(it.get("size") or "").strip())
+            qty = int(it.get("qty") or 0)
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError("Ligne invalide : garment_type_id et qty entiers requis")
+        if qty <= 0:
+            raise ValueError("quantité > 0 requise")
+        lines[key] = lines.get(key, 0) + qty
+    if not lines:
+        raise ValueError("Aucune ligne")
+    return lines
+
+@bp.post("/api/stock/transfer")
+@login_required
+def stock_transfer():
+    """Déplace plusieurs (type, taille, qty) d'une antenne à une autre en une transaction.
+
+    Les articles concernés des deux antennes sont verrouillés dans l'ordre des id
+    (pas d'interblocage entre transferts croisés) ; les articles absents de
+    l'antenne de destination sont créés avec les tags de l'article source.
+    """
+    d = request.get_json() or {}
+    src, dst = int(d.get("from_antenna_id") or 0), int(d.get("to_antenna_id") or 0)
+    if not src or not dst or src == dst:
+        return jsonify({"ok": False, "error": "Antennes de départ et d'arrivée distinctes requises"}), 400
+    try:
+        lines = parse_transfer_lines(d.get("lines"))
+    except ValueError as e:
+        return jsonify({"ok": False, "error": str(e)}), 400
+    if db.session.scalar(select(db.func.count()).select_from(Antenna).where(Antenna.id.in_([src, dst]))) != 2:
+        return jsonify({"ok": False, "error": "Antenne inconnue"}), 404
+    size_key = STOCK_ITEM_KEY[2]
+    locked = db.session.execute(
+        select(StockItem.id, StockItem.antenna_id, StockItem.garment_type_id, StockItem.size, StockItem.quantity)
+        .where(StockItem.antenna_id.in_([src, dst]), tuple_(StockItem.garment_type_id, size_key).in_(list(lines)))
+        .order_by(StockItem.id)
+        .with_for_update()
+    ).all()
+    sources = {(r.garment_type_id, r.size or ""): r for r in locked if r.antenna_id == src}
+    missing = [
+        {"garment_type_id": t, "size": size or None, "qty": qty, "available": sources[(t, size)].quantity if (t, size) in sources else 0}
+        for (t, size), qty in sorted(lines.items()) if (t, size) not in sources or sources[(t, size)].quantity < qty
+    ]
+    if missing:
+        db.session.rollback()
+        return jsonify({"ok": False, "error": "Stock insuffisant", "lines": missing}), 400
+    taken = {sources[key].id: qty for key, qty in lines.items()}
+    db.session.execute(
+        update(StockItem)
+        .where(StockItem.id.in_(taken))
+        .values(quantity=StockItem.quantity - case(taken, value=StockItem.id))
+        .execution_options(synchronize_session=False)
+    )
+    stmt = dialect_insert(StockItem).values([
+        {"garment_type_id": t, "antenna_id": dst, "size": sources[(t, size)].size, "quantity": qty}
+        for (t, size), qty in sorted(lines.items())
+    ])
+    dest = {
+        (r.garment_type_id, r.size or ""): r.id
+        for r in db.session.execute(
+            stmt.on_conflict_do_update(index_elements=list(STOCK_ITEM_KEY), set_={"quantity": StockItem.quantity + stmt.excluded.quantity})
+            .returning(StockItem.id, StockItem.garment_type_id, StockItem.size)
+        )
+    }
+    pairs = [(sources[key].id, dest[key]) for key in sorted(lines)]
+    tags = db.session.execute(select(StockItemTag.stock_item_id, StockItemTag.tag).where(StockItemTag.stock_item_id.in_(taken))).all()
+    if tags:
+        to_item = dict(pairs)
+        db.session.execute(dialect_insert(StockItemTag).values([
+            {"stock_item_id": to_item[item_id], "tag": tag} for item_id, tag in tags
+        ]).on_conflict_do_nothing())
+    totals = {}
+    for (t, _), qty in lines.items():
+        totals[(src, t)] = totals.get((src, t), 0) - qty
+        totals[(dst, t)] = totals.get((dst, t), 0) + qty
+    adjust_stock_totals(totals)
+    refresh_alerts(StockItem.id.in_([i for pair in pairs for i in pair]))
+    bump_stock_version(src, dst)
+    stock_changed([(src, a) for a, _ in pairs] + [(dst, b) for _, b in pairs])
+    transfer_id, now = uuid.uuid4().hex, datetime.utcnow()
+    db.session.execute(insert(StockMovement), [
+        {"transfer_id": transfer_id, "at": now, "user_id": current_user.id,
+         "from_antenna_id": src, "to_antenna_id": dst, "garment_type_id": t, "size": sources[(t, size)].size,
+         "qty": lines[(t, size)], "from_stock_item_id": sources[(t, size)].id, "to_stock_item_id": dest[(t, size)]}
+        for t, size in sorted(lines)
+    ])
+    log_action("stock.transfer", "antenna", dst,
+               f"{sum(lines.values())} articles ({len(lines)} lignes) depuis ant={src} transfert={transfer_id}")
+    db.session.commit()
+    return jsonify({"ok": True, "transfer_id": transfer_id, "lines": [
+        {"garment_type_id": t, "size": size or None, "qty": lines[(t, size)],
+         "from_stock_item_id": sources[(t, size)].id, "to_stock_item_id": dest[(t, size)]}
+        for t, size in sorted(lines)
+    ]})
+
+@bp.get("/api/stock/movements")
+@login_required
+def stock_movements():
+    """Mouvements récents d'abord ; filtres ?antenna_id= (départ ou arrivée) et ?transfer_id=."""
+    qry = (
+        db.session.query(
+            StockMovement.id, StockMovement.transfer_id, StockMovement.at, User.email,
+            StockMovement.from_antenna_id, StockMovement.to_antenna_id, StockMovement.garment_type_id,
+            GarmentType.label, StockMovement.size, StockMovement.qty,
+            StockMovement.from_stock_item_id, StockMovement.to_stock_item_id,
+        )
+        .join(GarmentType, GarmentType.id == StockMovement.garment_type_id)
+        .outerjoin(User, User.id == StockMovement.user_id)
+    )
+    antenna_id = request.args.get("antenna_id", type=int)
+    if antenna_id:
+        qry = qry.filter(or_(StockMovement.from_antenna_id == antenna_id, StockMovement.to_antenna_id == antenna_id))
+    if request.args.get("transfer_id"):
+        qry = qry.filter(StockMovement.transfer_id == request.args["transfer_id"])
+    return keyset_response(qry, [StockMovement.id], lambda r: {
+        "id": r.id, "transfer_id": r.transfer_id, "at": r.at.isoformat() if r.at else None, "user": r.email,
+        "from_antenna_id": r.from_antenna_id, "to_antenna_id": r.to_antenna_id,
+        "garment_type_id": r.garment_type_id, "garment_type": r.label, "size": r.size, "qty": r.qty,
+        "from_stock_item_id": r.from_stock_item_id, "to_stock_item_id": r.to_stock_item_id,
+    }, descending=True, default_limit=100)
+
 # ---------------------------------------------------------------------
 # Volunteers (liste + recherche + import CSV + CRUD)
 # ---------------------------------------------------------------------
-@app.get("/api/volunteers")
+@bp.get("/api/volunteers")
 @login_required
 def volunteers_list():
+    """Liste par nom ; `q` filtre sur nom, prénom (sous-chaîne, sans accents) et note (index trigrammes sur PostgreSQL)."""
+    qry = db.session.query(Volunteer.id, Volunteer.first_name, Volunteer.last_name, Volunteer.note)
     q = request.args.get("q", "").strip()
-    qry = Volunteer.query
-    if q:
-        q_lower = f"%{q.lower()}%"
-        qry = qry.filter(
-            or_(
-                db.func.lower(Volunteer.last_name).like(q_lower),
-                db.func.lower(Volunteer.first_name).like(q_lower),
-                db.func.lower(Volunteer.note).like(q_lower),
-            )
-        )
-    items = qry.order_by(Volunteer.last_name, Volunteer.first_name).all()
-    return jsonify([{"id": v.id, "first_name": v.first_name, "last_name": v.last_name, "note": v.note} for v in items])
+    tokens = search_key(q).split()
+    if tokens:
+        key = " ".join(tokens)
+        qry = qry.filter(or_(
+            volunteer_match(tokens)[0],  # « nom prénom » dans les deux ordres
+            Volunteer.last_key.contains(key, autoescape=True),
+            Volunteer.first_key.contains(key, autoescape=True),
+            db.func.lower(Volunteer.note).contains(q.lower(), autoescape=True),
+        ))
+    return keyset_response(qry, [Volunteer.last_name, Volunteer.first_name, Volunteer.id], volunteer_row)
+
+def volunteer_row(v):
+    return {"id": v.id, "first_name": v.first_name, "last_name": v.last_name, "note": v.note}
+
+def volunteer_match(tokens):
+    """(filtre, rang) sur les clés normalisées : préfixes seulement (LIKE 'x%'), servis par index."""
+    full = " ".join(tokens)
+    conds = [Volunteer.last_key.startswith(full, autoescape=True), Volunteer.first_key.startswith(full, autoescape=True)]
+    if len(tokens) > 1:
+        head, rest = tokens[0], " ".join(tokens[1:])
+        conds += [
+            Volunteer.last_key.startswith(head, autoescape=True) & Volunteer.first_key.startswith(rest, autoescape=True),
+            Volunteer.first_key.startswith(head, autoescape=True) & Volunteer.last_key.startswith(rest, autoescape=True),
+        ]
+    rank = case(
+        (Volunteer.last_key == full, 0),
+        (Volunteer.first_key == full, 1),
+        (Volunteer.last_key.startswith(full, autoescape=True), 2),
+        (Volunteer.first_key.startswith(full, autoescape=True), 3),
+        else_=4,
+    )
+    return or_(*conds), rank
+
+@bp.get("/api/volunteers/search")
+@login_required
+def volunteers_search():
+    """Autocomplétion classée : préfixes de nom/prénom sans accents, servie par index."""
+    tokens = search_key(request.args.get("q", "")).split()
+    if not tokens:
+        return jsonify([])
+    limit = max(1, min(request.args.get("limit", 10, type=int), 50))
+    match, rank = volunteer_match(tokens)
+    rows = (
+        db.session.query(Volunteer.id, Volunteer.first_name, Volunteer.last_name, Volunteer.note)
+        .filter(match)
+        .order_by(rank, Volunteer.last_key, Volunteer.first_key, Volunteer.id)
+        .limit(limit)
+        .all()
+    )
+    return jsonify([volunteer_row(v) for v in rows])
 
-@app.post("/api/volunteers")
+@bp.post("/api/volunteers")
 @login_required
 def volunteers_add():
     d = request.get_json() or {}
     v = Volunteer(first_name=d.get("first_name", "").strip(), last_name=d.get("last_name", "").strip(), note=d.get("note", "").strip())
     if not v.first_name or not v.last_name:
         return jsonify({"ok": False, "error": "Prénom et nom requis"}), 400
-    db.session.add(v)
+    try:
+        db.session.add(v)
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"ok": False, "error": "Ce bénévole existe déjà"}), 409
+    adjust_counters(volunteers=1)
     db.session.commit()
     return jsonify({"id": v.id})
 
-@app.put("/api/volunteers/<int:vol_id>")
+@bp.put("/api/volunteers/<int:vol_id>")
 @login_required
 def volunteers_update(vol_id):
     d = request.get_json() or {}
@@ -518,10 +2286,14 @@ def volunteers_update(vol_id):
     v.first_name = d.get("first_name", v.first_name).strip()
     v.last_name = d.get("last_name", v.last_name).strip()
     v.note = d.get("note", v.note).strip()
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"ok": False, "error": "Ce bénévole existe déjà"}), 409
     return jsonify({"ok": True})
 
-@app.delete("/api/volunteers/<int:vol_id>")
+@bp.delete("/api/volunteers/<int:vol_id>")
 @login_required
 def volunteers_delete(vol_id):
     v = db.session.get(Volunteer, vol_id)
@@ -532,6 +2304,7 @@ def volunteers_delete(vol_id):
         return jsonify({"ok": False, "error": "Impossible : ce bénévole a des prêts associés."}), 400
     try:
         db.session.delete(v)
+        adjust_counters(volunteers=-1)
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
@@ -539,7 +2312,7 @@ def volunteers_delete(vol_id):
     return jsonify({"ok": True})
 
 # Import CSV
-@app.get("/api/volunteers/template.csv")
+@bp.get("/api/volunteers/template.csv")
 @login_required
 def volunteers_template_csv():
     si = StringIO()
@@ -553,32 +2326,19 @@ def volunteers_template_csv():
         headers={"Content-Disposition": 'attachment; filename="benevoles_modele.csv"'}
     )
 
-@app.post("/api/volunteers/import")
+@bp.post("/api/volunteers/import")
 @login_required
 def volunteers_import_csv():
     if "file" not in request.files:
         return jsonify({"ok": False, "error": "Aucun fichier fourni"}), 400
     f = request.files["file"]
     filename = secure_filename(f.filename or "import.csv")
-    raw = f.read()
-    try:
-        text_data = raw.decode("utf-8-sig")
-    except UnicodeDecodeError:
-        text_data = raw.decode("latin-1")
-
-    try:
-        from csv import Sniffer
-        dialect = Sniffer().sniff(text_data.splitlines()[0])
-        delim = dialect.delimiter
-    except Exception:
-        delim = ";" if text_data.count(";") >= text_data.count(",") else ","
-
-    reader = csv.reader(StringIO(text_data), delimiter=delim)
-    rows = list(reader)
-    if not rows:
+    reader = open_csv_upload(f)
+    header = next(reader, None)
+    if header is None:
         return jsonify({"ok": False, "error": "Fichier vide"}), 400
 
-    header = [h.strip().lower() for h in rows[0]]
+    header = [h.strip().lower() for h in header]
 
     def _col(*names):
         for n in names:
@@ -592,10 +2352,12 @@ def volunteers_import_csv():
     if idx_nom is None or idx_pren is None:
         return jsonify({"ok": False, "error": "Colonnes requises: Nom, Prénom"}), 400
 
-    existing = set((v.last_name.strip().lower(), v.first_name.strip().lower()) for v in Volunteer.query.all())
+    # Lecture par lots ; le dédoublonnage (base + fichier) est fait par l'index unique name_key
+    chunk_rows = current_app.config["IMPORT_CHUNK_ROWS"]
     added = 0
-    skipped = 0
-    for r in rows[1:]:
+    total = 0
+    chunk = []
+    for r in reader:
         if not r or all(not c.strip() for c in r):
             continue
         try:
@@ -605,100 +2367,293 @@ def volunteers_import_csv():
             continue
         if not ln or not fn:
             continue
-        key = (ln.lower(), fn.lower())
-        if key in existing:
-            skipped += 1
-            continue
         note = ""
         if idx_note is not None and idx_note < len(r):
             note = (r[idx_note] or "").strip()
-        db.session.add(Volunteer(first_name=fn, last_name=ln, note=note))
-        existing.add(key)
-        added += 1
-
+        chunk.append({
+            "first_name": fn, "last_name": ln, "note": note,
+            "first_key": search_key(fn), "last_key": search_key(ln), "name_key": volunteer_name_key(ln, fn),
+        })
+        if len(chunk) >= chunk_rows:
+            added += insert_volunteers(chunk); total += len(chunk); chunk = []
+    if chunk:
+        added += insert_volunteers(chunk); total += len(chunk)
+
+    adjust_counters(volunteers=added)
     db.session.commit()
-    return jsonify({"ok": True, "filename": filename, "added": added, "skipped": skipped, "total": added + skipped})
+    return jsonify({"ok": True, "filename": filename, "added": added, "skipped": total - added, "total": total})
+
+def open_csv_upload(f, sample_size: int = 65536):
+    """Lecteur CSV en flux sur le fichier envoyé ; encodage et séparateur déduits d'un extrait."""
+    stream = f.stream
+    sample = stream.read(sample_size)
+    stream.seek(0)
+    try:
+        codecs.getincrementaldecoder("utf-8-sig")().decode(sample, final=False)
+        encoding = "utf-8-sig"
+    except UnicodeDecodeError:
+        encoding = "latin-1"
+    text_sample = sample.decode(encoding, errors="ignore")
+    try:
+        delim = csv.Sniffer().sniff(text_sample.splitlines()[0]).delimiter
+    except Exception:
+        delim = ";" if text_sample.count(";") >= text_sample.count(",") else ","
+    return csv.reader(TextIOWrapper(stream, encoding=encoding, errors="replace", newline=""), delimiter=delim)
+
+def insert_volunteers(rows) -> int:
+    """INSERT multi-lignes ... ON CONFLICT DO NOTHING ; renvoie le nombre de bénévoles ajoutés."""
+    stmt = (
+        dialect_insert(Volunteer).values(rows)
+        .on_conflict_do_nothing(index_elements=["name_key"])
+        .returning(Volunteer.id)
+    )
+    return len(db.session.execute(stmt).all())
+
+# ---------------------------------------------------------------------
+# Mouvements de stock atomiques (UPDATE conditionnel, sans SELECT préalable)
+# ---------------------------------------------------------------------
+def take_stock(stock_item_id: int, qty: int):
+    """Décrémente le stock si la quantité suffit ; renvoie l'antenne ou None si insuffisant."""
+    return take_stock_many({stock_item_id: qty}).get(stock_item_id)
+
+def take_stock_many(lines: dict):
+    """Décrémente plusieurs articles ({stock_item_id: qty}) en une requête.
+
+    Renvoie {stock_item_id: antenna_id} des lignes servies ; l'appelant annule
+    la transaction si une ligne manque (stock insuffisant ou article inconnu).
+    Chaque ligne compte pour un prêt dans les agrégats journaliers.
+    """
+    qty = case(lines, value=StockItem.id)
+    rows = db.session.execute(
+        update(StockItem)
+        .where(StockItem.id.in_(lines), StockItem.quantity >= qty)
+        .values(quantity=StockItem.quantity - qty)
+        .returning(StockItem.id, StockItem.antenna_id, StockItem.garment_type_id, StockItem.size)
+        .execution_options(synchronize_session=False)
+    ).all()
+    totals, daily = {}, {}
+    for r in rows:
+        totals[(r.antenna_id, r.garment_type_id)] = totals.get((r.antenna_id, r.garment_type_id), 0) - lines[r.id]
+        d = daily.setdefault((r.antenna_id, r.garment_type_id, r.size), {"loans": 0, "qty_out": 0})
+        d["loans"] += 1
+        d["qty_out"] += lines[r.id]
+    adjust_stock_totals(totals)
+    adjust_loan_daily(daily)
+    if rows:
+        refresh_alerts(StockItem.id.in_([r.id for r in rows]))
+    stock_changed((r.antenna_id, r.id) for r in rows)
+    return {r.id: r.antenna_id for r in rows}
+
+def close_loans(loan_ids):
+    """Marque les prêts ouverts rendus et remet les quantités en stock (deux requêtes en tout).
+
+    Renvoie les lignes (id, stock_item_id, qty, created_at) des prêts effectivement clos.
+    """
+    now = datetime.utcnow()
+    loans = db.session.execute(
+        update(Loan)
+        .where(Loan.id.in_(loan_ids), Loan.returned_at.is_(None))
+        .values(returned_at=now)
+        .returning(Loan.id, Loan.stock_item_id, Loan.qty, Loan.created_at)
+        .execution_options(synchronize_session=False)
+    ).all()
+    if not loans:
+        return []
+    per_item = {}
+    for l in loans:
+        per_item[l.stock_item_id] = per_item.get(l.stock_item_id, 0) + l.qty
+    items = db.session.execute(
+        update(StockItem)
+        .where(StockItem.id.in_(per_item))
+        .values(quantity=StockItem.quantity + case(per_item, value=StockItem.id))
+        .returning(StockItem.id, StockItem.antenna_id, StockItem.garment_type_id, StockItem.size)
+        .execution_options(synchronize_session=False)
+    ).all()
+    totals, keys, daily = {}, {}, {}
+    for r in items:
+        totals[(r.antenna_id, r.garment_type_id)] = totals.get((r.antenna_id, r.garment_type_id), 0) + per_item[r.id]
+        keys[r.id] = (r.antenna_id, r.garment_type_id, r.size)
+    for l in loans:
+        d = daily.setdefault(keys[l.stock_item_id], {"returns": 0, "qty_in": 0, "duration_days": 0.0})
+        d["returns"] += 1
+        d["qty_in"] += l.qty
+        d["duration_days"] += (now - l.created_at).total_seconds() / 86400 if l.created_at else 0
+    adjust_stock_totals(totals)
+    adjust_loan_daily(daily)
+    refresh_alerts(StockItem.id.in_(per_item))
+    adjust_counters(loans_open=-len(loans))
+    bump_stock_version(*[r.antenna_id for r in items])
+    stock_changed((r.antenna_id, r.id) for r in items)
+    return loans
+
+def close_loan(loan_id: int):
+    """Marque le prêt rendu et remet la quantité en stock ; renvoie la ligne du prêt ou None."""
+    loans = close_loans([loan_id])
+    return loans[0] if loans else None
 
 # ---------------------------------------------------------------------
 # Loans
 # ---------------------------------------------------------------------
-@app.get("/api/volunteers/<int:vol_id>/loans")
+@bp.get("/api/volunteers/<int:vol_id>/loans")
 @login_required
 def volunteers_loans(vol_id):
-    res = []
-    for l in Loan.query.filter(Loan.volunteer_id == vol_id, Loan.returned_at.is_(None)).all():
-        res.append(
-            {
-                "id": l.id,
-                "qty": l.qty,
-                "since": l.created_at.isoformat(),
-                "type": l.stock_item.garment_type.label,
-                "size": l.stock_item.size,
-                "antenna": l.stock_item.antenna.name,
-            }
-        )
-    return jsonify(res)
+    rows = open_loans_query().filter(Loan.volunteer_id == vol_id).all()
+    return jsonify([loan_row(r) for r in rows])
 
-@app.get("/api/loans/open")
+@bp.get("/api/loans/open")
 @login_required
 def loans_open():
-    res = []
-    for l in Loan.query.filter(Loan.returned_at.is_(None)).all():
-        res.append(
-            {
-                "id": l.id,
-                "qty": l.qty,
-                "since": l.created_at.isoformat(),
-                "volunteer": f"{l.volunteer.last_name} {l.volunteer.first_name}",
-                "type": l.stock_item.garment_type.label,
-                "size": l.stock_item.size,
-                "antenna": l.stock_item.antenna.name,
-            }
-        )
-    return jsonify(res)
+    qry = (
+        open_loans_query(Volunteer.last_name, Volunteer.first_name)
+        .join(Volunteer, Loan.volunteer_id == Volunteer.id)
+    )
+    return keyset_response(qry, [Loan.id], lambda r: {**loan_row(r), "volunteer": f"{r.last_name} {r.first_name}"})
 
-@app.post("/api/loans/return/<int:loan_id>")
+@bp.post("/api/loans/return/<int:loan_id>")
 @login_required
 def loan_return(loan_id):
-    l = db.session.get(Loan, loan_id)
-    if not l or l.returned_at:
+    l = close_loan(loan_id)
+    if not l:
         return jsonify({"ok": False}), 404
-    l.returned_at = datetime.utcnow()
-    item = db.session.get(StockItem, l.stock_item_id)
-    item.quantity += l.qty
-    db.session.commit()
     log_action("loan.return", "loan", loan_id, f"+{l.qty} to stock_item={l.stock_item_id}")
+    db.session.commit()
     return jsonify({"ok": True})
 
+# ---------------------------------------------------------------------
+# Idempotence : retries et files hors ligne des kiosques
+# ---------------------------------------------------------------------
+SYNC_ENDPOINTS = {"loan": "main.public_loan", "loan_batch": "main.public_loan_batch", "return": "main.public_return"}
+
+def valid_idempotency_key(key) -> bool:
+    return isinstance(key, str) and 0 < len(key.strip()) <= 100
+
+def claim_idempotency_key(key: str, endpoint: str):
+    """Réserve la clé dans la transaction en cours ; renvoie la ligne déjà enregistrée, sinon None.
+
+    Sur PostgreSQL, une requête concurrente portant la même clé attend le commit
+    (ou l'annulation) de la première au lieu d'appliquer l'opération deux fois.
+    """
+    stmt = (
+        dialect_insert(IdempotencyKey)
+        .values(key=key, endpoint=endpoint, created_at=datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=["key"])
+        .returning(IdempotencyKey.key)
+    )
+    if db.session.execute(stmt).first():
+        return None
+    return db.session.execute(
+        select(IdempotencyKey.endpoint, IdempotencyKey.status_code, IdempotencyKey.response).where(IdempotencyKey.key == key)
+    ).first()
+
+def remember_response(key: str, body: dict, status: int = 200):
+    db.session.execute(
+        update(IdempotencyKey).where(IdempotencyKey.key == key).values(status_code=status, response=json.dumps(body))
+    )
+
+def release_idempotency_key(key: str):
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+
+def stored_result(stored, endpoint: str):
+    """(corps + statut) d'une clé déjà traitée, ou 422 si elle a servi à une autre opération."""
+    if stored.endpoint != endpoint:
+        return {"status": 422, "ok": False, "error": "Clé déjà utilisée pour une autre opération"}
+    return {"status": stored.status_code, **json.loads(stored.response)}
+
+def stored_loan_id(loan_key):
+    """Prêt créé par une opération d'emprunt déjà appliquée (retour d'un prêt fait hors ligne)."""
+    if not valid_idempotency_key(loan_key):
+        return None
+    response = db.session.scalar(select(IdempotencyKey.response).where(
+        IdempotencyKey.key == loan_key, IdempotencyKey.endpoint == SYNC_ENDPOINTS["loan"]
+    ))
+    return json.loads(response).get("loan_id") if response else None
+
+def idempotent(view):
+    """En-tête Idempotency-Key : la réponse de la première exécution validée est rejouée à l'identique.
+
+    La vue termine par commit_json() pour enregistrer sa réponse dans la même
+    transaction ; un échec (rollback) libère la clé.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return view(*args, **kwargs)
+        if not valid_idempotency_key(key):
+            return jsonify({"ok": False, "error": "Clé d'idempotence invalide"}), 400
+        stored = claim_idempotency_key(key, request.endpoint)
+        if stored:
+            db.session.rollback()
+            result = stored_result(stored, request.endpoint)
+            status = result.pop("status")
+            return jsonify(result), status, {"Idempotent-Replayed": "true"}
+        g.idempotency_key = key
+        return view(*args, **kwargs)
+    return wrapper
+
+def commit_json(body: dict, status: int = 200):
+    """Valide la transaction et répond ; enregistre la réponse si la requête porte une clé d'idempotence."""
+    key = g.get("idempotency_key")
+    if key:
+        remember_response(key, body, status)
+    db.session.commit()
+    return jsonify(body), status
+
+def purge_idempotency_keys(older_than_days: int | None = None) -> int:
+    days = current_app.config["IDEMPOTENCY_TTL_DAYS"] if older_than_days is None else older_than_days
+    n = db.session.execute(
+        delete(IdempotencyKey).where(IdempotencyKey.created_at < datetime.utcnow() - timedelta(days=days))
+    ).rowcount
+    db.session.commit()
+    return n
+
+@bp.cli.command("purge-idempotency-keys")
+def purge_idempotency_keys_command():
+    """Supprime les clés plus anciennes que IDEMPOTENCY_TTL_DAYS (à lancer par cron)."""
+    print(purge_idempotency_keys())
+
 # ---------------------------------------------------------------------
 # Public (QR) + filtres
 # ---------------------------------------------------------------------
-@app.get("/api/public/volunteer")
+@bp.get("/api/public/volunteer")
 def public_find():
     fn = (request.args.get("first_name", "")).strip()
     ln = (request.args.get("last_name", "")).strip()
-    v = Volunteer.query.filter(
-        db.func.lower(Volunteer.first_name) == fn.lower(),
-        db.func.lower(Volunteer.last_name) == ln.lower()
-    ).first()
+    v = (
+        db.session.query(Volunteer.id, Volunteer.first_name, Volunteer.last_name)
+        .filter(Volunteer.last_key == search_key(ln), Volunteer.first_key == search_key(fn))
+        .order_by(Volunteer.id)
+        .first()
+    )
     if not v: return jsonify({"ok": False}), 404
     return jsonify({"ok": True, "id": v.id, "first_name": v.first_name, "last_name": v.last_name})
 
-@app.get("/api/public/stock")
+@bp.get("/api/public/stock")
+@stock_cached
 def public_stock():
     antenna_id = request.args.get("antenna_id", type=int)
     type_id = request.args.get("type_id", type=int)
     size = request.args.get("size", type=str)
-    q = StockItem.query.filter(StockItem.quantity > 0)
+    q = (
+        db.session.query(
+            StockItem.id, GarmentType.label, StockItem.garment_type_id, StockItem.size,
+            Antenna.name, StockItem.antenna_id, StockItem.quantity,
+        )
+        .join(GarmentType, StockItem.garment_type_id == GarmentType.id)
+        .join(Antenna, StockItem.antenna_id == Antenna.id)
+        .filter(StockItem.quantity > 0)
+    )
     if antenna_id: q = q.filter(StockItem.antenna_id == antenna_id)
     if type_id: q = q.filter(StockItem.garment_type_id == type_id)
     if size: q = q.filter(db.func.coalesce(StockItem.size, "") == size.strip())
+    q = filter_by_tags(q)
     res = []
     for s in q.all():
-        res.append({"id": s.id, "type": s.garment_type.label, "type_id": s.garment_type_id, "size": s.size, "antenna": s.antenna.name, "antenna_id": s.antenna_id, "quantity": s.quantity})
+        res.append({"id": s.id, "type": s.label, "type_id": s.garment_type_id, "size": s.size, "antenna": s.name, "antenna_id": s.antenna_id, "quantity": s.quantity})
     return jsonify(res)
 
-@app.get("/api/public/types")
+@bp.get("/api/public/types")
+@stock_cached
 def public_types():
     """Liste des types disponibles (option antenne) pour alimenter le filtre public."""
     antenna_id = request.args.get("antenna_id", type=int)
@@ -711,123 +2666,565 @@ def public_types():
     out = [{"id": tid, "label": label} for tid, label in sorted(seen.items(), key=lambda x: x[1].lower())]
     return jsonify(out)
 
-@app.get("/api/public/sizes")
+@bp.get("/api/public/sizes")
+@stock_cached
 def public_sizes():
     """Liste des tailles disponibles pour un type (et antenne optionnelle)."""
     type_id = request.args.get("type_id", type=int)
     antenna_id = request.args.get("antenna_id", type=int)
     if not type_id:
         return jsonify([])
-    q = StockItem.query.filter(StockItem.quantity > 0, StockItem.garment_type_id == type_id)
+    q = db.session.query(StockItem.size).filter(StockItem.quantity > 0, StockItem.garment_type_id == type_id, StockItem.size.isnot(None)).distinct()
     if antenna_id:
         q = q.filter(StockItem.antenna_id == antenna_id)
-    sizes = sorted({s.size for s in q.all() if s.size})
+    sizes = sorted({size for (size,) in q.all() if size})
     return jsonify(sizes)
 
-@app.get("/api/public/loans")
+@bp.get("/api/public/loans")
 def public_loans():
     vol_id = request.args.get("volunteer_id", type=int)
     if not vol_id: return jsonify([])
-    res = []
-    for l in Loan.query.filter(Loan.volunteer_id == vol_id, Loan.returned_at.is_(None)).all():
-        res.append({"id": l.id, "qty": l.qty, "since": l.created_at.isoformat(), "type": l.stock_item.garment_type.label, "size": l.stock_item.size, "antenna": l.stock_item.antenna.name})
-    return jsonify(res)
+    rows = open_loans_query().filter(Loan.volunteer_id == vol_id).all()
+    return jsonify([loan_row(r) for r in rows])
 
-@app.post("/api/public/return/<int:loan_id>")
-def public_return(loan_id):
-    l = db.session.get(Loan, loan_id)
-    if not l or l.returned_at: return jsonify({"ok": False}), 404
-    l.returned_at = datetime.utcnow()
-    item = db.session.get(StockItem, l.stock_item_id)
-    item.quantity += l.qty
-    db.session.commit()
+def apply_public_return(loan_id: int):
+    """Retour d'un prêt sans commit ; renvoie (corps, statut), sans effet en cas d'échec."""
+    l = close_loan(loan_id)
+    if not l: return {"ok": False}, 404
     log_action("loan.return.public", "loan", loan_id, f"+{l.qty} to stock_item={l.stock_item_id}")
-    return jsonify({"ok": True})
+    return {"ok": True}, 200
 
-@app.post("/api/public/loan")
-def public_loan():
-    d = request.get_json() or {}
-    v_id = int(d.get("volunteer_id"))
-    s_id = int(d.get("stock_item_id"))
-    qty = int(d.get("qty") or 1)
-    item = db.session.get(StockItem, s_id)
-    if not item or item.quantity < qty:
-        return jsonify({"ok": False, "error": "Stock insuffisant"}), 400
-    item.quantity -= qty
+def apply_public_loan(v_id: int, s_id: int, qty: int):
+    """Emprunt sans commit ; renvoie (corps, statut), sans effet en cas d'échec."""
+    if qty <= 0:
+        return {"ok": False, "error": "quantité > 0 requise"}, 400
+    antenna_id = take_stock(s_id, qty)
+    if antenna_id is None:
+        return {"ok": False, "error": "Stock insuffisant"}, 400
+    bump_stock_version(antenna_id)
     loan = Loan(volunteer_id=v_id, stock_item_id=s_id, qty=qty)
-    db.session.add(loan); db.session.commit()
+    db.session.add(loan)
+    db.session.flush()
+    adjust_counters(loans_open=1)
     log_action("loan.create", "loan", loan.id, f"-{qty} from stock_item={s_id} by volunteer={v_id}")
-    return jsonify({"ok": True})
+    return {"ok": True, "loan_id": loan.id}, 200
+
+@bp.post("/api/public/return/<int:loan_id>")
+@idempotent
+def public_return(loan_id):
+    body, status = apply_public_return(loan_id)
+    if status != 200:
+        db.session.rollback()
+        return jsonify(body), status
+    return commit_json(body)
+
+@bp.post("/api/public/loan")
+@idempotent
+def public_loan():
+    d = request.get_json() or {}
+    body, status = apply_public_loan(int(d.get("volunteer_id")), int(d.get("stock_item_id")), int(d.get("qty") or 1))
+    if status != 200:
+        db.session.rollback()
+        return jsonify(body), status
+    return commit_json(body)
+
+def parse_loan_lines(items) -> dict:
+    """[{stock_item_id, qty}] -> {stock_item_id: qty} ; ValueError (message affichable) si invalide."""
+    if not isinstance(items or [], list):
+        raise ValueError("items : liste d'articles attendue")
+    lines = {}
+    for it in items or []:
+        try:
+            s_id, qty = int(it.get("stock_item_id")), int(it.get("qty") or 1)
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError("Ligne invalide : stock_item_id et qty entiers requis")
+        if qty <= 0:
+            raise ValueError("quantité > 0 requise")
+        lines[s_id] = lines.get(s_id, 0) + qty
+    if not lines:
+        raise ValueError("Aucun article")
+    return lines
+
+def apply_public_loan_batch(v_id: int, lines: dict):
+    """Emprunt de plusieurs articles sans commit ; en cas d'échec, l'appelant annule (transaction ou savepoint)."""
+    served = take_stock_many(lines)
+    if len(served) != len(lines):
+        missing = sorted(set(lines) - set(served))
+        return {"ok": False, "error": "Stock insuffisant", "stock_item_ids": missing}, 400
+    bump_stock_version(*served.values())
+    loan_ids = db.session.execute(
+        insert(Loan).returning(Loan.id, sort_by_parameter_order=True),
+        [{"volunteer_id": v_id, "stock_item_id": s_id, "qty": qty} for s_id, qty in lines.items()],
+    ).scalars().all()
+    adjust_counters(loans_open=len(loan_ids))
+    log_actions([
+        ("loan.create", "loan", lid, f"-{qty} from stock_item={s_id} by volunteer={v_id}")
+        for lid, (s_id, qty) in zip(loan_ids, lines.items())
+    ])
+    return {"ok": True, "loan_ids": loan_ids}, 200
+
+@bp.post("/api/public/loan/batch")
+@idempotent
+def public_loan_batch():
+    """Emprunt d'une tenue complète : tous les articles ou aucun, en une transaction."""
+    d = request.get_json() or {}
+    try:
+        v_id = int(d.get("volunteer_id") or 0)
+    except (TypeError, ValueError):
+        v_id = 0
+    if not v_id:
+        return jsonify({"ok": False, "error": "volunteer_id requis"}), 400
+    try:
+        lines = parse_loan_lines(d.get("items"))
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"ok": False, "error": str(e)}), 400
+    body, status = apply_public_loan_batch(v_id, lines)
+    if status != 200:
+        db.session.rollback()
+        return jsonify(body), status
+    return commit_json(body)
+
+@bp.post("/api/public/return/batch")
+@idempotent
+def public_return_batch():
+    """Retour de plusieurs prêts d'un coup (tout ou rien)."""
+    d = request.get_json() or {}
+    ids = {int(i) for i in d.get("loan_ids") or []}
+    if not ids:
+        return jsonify({"ok": False, "error": "Aucun prêt"}), 400
+    closed = close_loans(ids)
+    if len(closed) != len(ids):
+        db.session.rollback()
+        missing = sorted(ids - {l.id for l in closed})
+        return jsonify({"ok": False, "error": "Prêt introuvable ou déjà rendu", "loan_ids": missing}), 404
+    log_actions([
+        ("loan.return.public", "loan", l.id, f"+{l.qty} to stock_item={l.stock_item_id}") for l in closed
+    ])
+    return commit_json({"ok": True, "returned": sorted(ids)})
+
+@bp.post("/api/public/sync")
+def public_sync():
+    """Rejoue dans l'ordre, en une transaction, la file hors ligne d'un kiosque.
+
+    operations = [{"key", "op": "loan", "volunteer_id", "stock_item_id", "qty"}
+                  | {"key", "op": "loan_batch", "volunteer_id", "items": [{"stock_item_id", "qty"}]}
+                  | {"key", "op": "return", "loan_id" ou "loan_key" (clé de l'emprunt)}]
+    Chaque clé n'est appliquée qu'une fois (mêmes clés que l'en-tête Idempotency-Key) ;
+    une opération refusée n'annule pas les suivantes. Réponse : un résultat par opération.
+    """
+    ops = (request.get_json() or {}).get("operations") or []
+    if not isinstance(ops, list) or not ops:
+        return jsonify({"ok": False, "error": "Aucune opération"}), 400
+    if len(ops) > current_app.config["SYNC_MAX_OPERATIONS"]:
+        return jsonify({"ok": False, "error": "Trop d'opérations, synchroniser en plusieurs fois"}), 400
+    if not all(isinstance(op, dict) and valid_idempotency_key(op.get("key")) for op in ops):
+        return jsonify({"ok": False, "error": "Clé d'opération manquante ou invalide"}), 400
+    vol_ids = {op.get("volunteer_id") for op in ops if op.get("op") in ("loan", "loan_batch")}
+    known_vols = set(db.session.scalars(select(Volunteer.id).where(Volunteer.id.in_(
+        [int(v) for v in vol_ids if str(v).isdigit()]
+    ))))
+    results = []
+    for op in ops:
+        key, kind = op["key"], op.get("op")
+        endpoint = SYNC_ENDPOINTS.get(kind)
+        if not endpoint:
+            results.append({"key": key, "status": 400, "ok": False, "error": "Opération inconnue"})
+            continue
+        stored = claim_idempotency_key(key, endpoint)
+        if stored:
+            results.append({"key": key, **stored_result(stored, endpoint), "replayed": True})
+            continue
+        try:
+            if kind == "loan":
+                v_id = int(op.get("volunteer_id"))
+                if v_id not in known_vols:
+                    body, status = {"ok": False, "error": "Bénévole inconnu"}, 404
+                else:
+                    body, status = apply_public_loan(v_id, int(op.get("stock_item_id")), int(op.get("qty") or 1))
+            elif kind == "loan_batch":
+                v_id, lines = int(op.get("volunteer_id")), parse_loan_lines(op.get("items"))
+                if v_id not in known_vols:
+                    body, status = {"ok": False, "error": "Bénévole inconnu"}, 404
+                else:
+                    savepoint = db.session.begin_nested()  # tout ou rien, sans annuler les opérations précédentes
+                    body, status = apply_public_loan_batch(v_id, lines)
+                    if status == 200:
+                        savepoint.commit()
+                    else:
+                        savepoint.rollback()
+            else:
+                loan_id = op.get("loan_id") or stored_loan_id(op.get("loan_key"))
+                body, status = apply_public_return(int(loan_id)) if loan_id else ({"ok": False, "error": "Prêt inconnu"}, 404)
+        except (AttributeError, TypeError, ValueError):
+            body, status = {"ok": False, "error": "Opération invalide"}, 400
+        if status == 200:
+            remember_response(key, body, status)
+        else:
+            release_idempotency_key(key)  # refusée : la clé reste rejouable
+        results.append({"key": key, "status": status, **body})
+    db.session.commit()
+    return jsonify({"ok": True, "results": results})
 
 # ---------------------------------------------------------------------
 # Inventaire
 # ---------------------------------------------------------------------
-@app.post("/api/inventory/start")
+@bp.post("/api/inventory/start")
 @login_required
 def inventory_start():
     d = request.get_json() or {}
     ant = int(d.get("antenna_id") or 0)
     if not ant: return jsonify({"ok": False, "error": "antenna_id requis"}), 400
     sess = InventorySession(antenna_id=ant, user_id=current_user.id)
-    db.session.add(sess); db.session.commit()
+    db.session.add(sess); db.session.flush()
     log_action("inventory.start", "inventory", sess.id, f"antenna={ant}")
+    db.session.commit()
     return jsonify({"id": sess.id})
 
-@app.get("/api/inventory/<int:sid>/items")
+@bp.get("/api/inventory/<int:sid>/items")
 @login_required
 def inventory_items(sid):
-    sess = db.session.get(InventorySession, sid)
+    sess = (
+        db.session.query(InventorySession.antenna_id, InventorySession.closed_at, Antenna.name)
+        .join(Antenna, InventorySession.antenna_id == Antenna.id)
+        .filter(InventorySession.id == sid)
+        .first()
+    )
     if not sess or sess.closed_at: return jsonify({"ok": False}), 404
+    q = (
+        db.session.query(StockItem.id, GarmentType.label, StockItem.size, StockItem.quantity)
+        .join(GarmentType, StockItem.garment_type_id == GarmentType.id)
+        .filter(StockItem.antenna_id == sess.antenna_id)
+    )
     rows = []
-    for s in StockItem.query.filter_by(antenna_id=sess.antenna_id).all():
-        rows.append({"stock_item_id": s.id, "type": s.garment_type.label, "size": s.size, "quantity": s.quantity})
-    return jsonify({"antenna": sess.antenna.name, "rows": rows})
+    for s in q.all():
+        rows.append({"stock_item_id": s.id, "type": s.label, "size": s.size, "quantity": s.quantity})
+    return jsonify({"antenna": sess.name, "rows": rows})
+
+def upsert_counts(sid: int, antenna_id: int, counts: dict):
+    """Enregistre les comptages {stock_item_id: counted_qty} en une seule requête.
+
+    La quantité de référence (previous_qty) est celle du stock au premier
+    comptage ; un recomptage ne met à jour que counted_qty et delta.
+    Renvoie les stock_item_id enregistrés (articles de l'antenne uniquement).
+    """
+    counted = case(counts, value=StockItem.id)
+    src = select(
+        literal(sid), StockItem.id, StockItem.quantity, counted, counted - StockItem.quantity
+    ).where(StockItem.id.in_(counts), StockItem.antenna_id == antenna_id)
+    stmt = dialect_insert(InventoryLine).from_select(
+        ["session_id", "stock_item_id", "previous_qty", "counted_qty", "delta"], src
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["session_id", "stock_item_id"],
+        set_={"counted_qty": stmt.excluded.counted_qty, "delta": stmt.excluded.counted_qty - InventoryLine.previous_qty},
+    ).returning(InventoryLine.stock_item_id)
+    return db.session.execute(stmt).scalars().all()
+
+def open_inventory(sid: int):
+    return (
+        db.session.query(InventorySession.antenna_id)
+        .filter(InventorySession.id == sid, InventorySession.closed_at.is_(None))
+        .scalar()
+    )
 
-@app.post("/api/inventory/<int:sid>/count")
+@bp.post("/api/inventory/<int:sid>/count")
 @login_required
 def inventory_count(sid):
     d = request.get_json() or {}
     stock_id = int(d.get("stock_item_id"))
     counted = int(d.get("counted_qty") or 0)
-    sess = db.session.get(InventorySession, sid)
-    s = db.session.get(StockItem, stock_id)
-    if not sess or not s or sess.closed_at: return jsonify({"ok": False}), 404
-    line = InventoryLine.query.filter_by(session_id=sid, stock_item_id=stock_id).first()
-    if not line:
-        line = InventoryLine(session_id=sid, stock_item_id=stock_id, previous_qty=s.quantity)
-        db.session.add(line)
-    line.counted_qty = counted; line.delta = counted - line.previous_qty
+    antenna_id = open_inventory(sid)
+    if not antenna_id or not upsert_counts(sid, antenna_id, {stock_id: counted}):
+        db.session.rollback()
+        return jsonify({"ok": False}), 404
     db.session.commit()
     return jsonify({"ok": True})
 
-@app.post("/api/inventory/<int:sid>/close")
+@bp.post("/api/inventory/<int:sid>/counts")
+@login_required
+def inventory_counts(sid):
+    """Comptage en masse : {"lines": [{"stock_item_id", "counted_qty"}, ...]}."""
+    d = request.get_json() or {}
+    counts = {int(ln.get("stock_item_id")): int(ln.get("counted_qty") or 0) for ln in d.get("lines") or []}
+    antenna_id = open_inventory(sid)
+    if not antenna_id: return jsonify({"ok": False}), 404
+    if not counts: return jsonify({"ok": True, "saved": 0, "unknown": []})
+    saved = upsert_counts(sid, antenna_id, counts)
+    db.session.commit()
+    return jsonify({"ok": True, "saved": len(saved), "unknown": sorted(set(counts) - set(saved))})
+
+@bp.post("/api/inventory/<int:sid>/close")
 @login_required
 def inventory_close(sid):
-    sess = db.session.get(InventorySession, sid)
-    if not sess or sess.closed_at: return jsonify({"ok": False}), 404
-    lines = InventoryLine.query.filter_by(session_id=sid).all()
-    for ln in lines:
-        item = db.session.get(StockItem, ln.stock_item_id)
-        if item:
-            item.quantity = ln.counted_qty
-    sess.closed_at = datetime.utcnow()
-    log_action("inventory.close", "inventory", sid, f"lines={len(lines)}")
+    antenna_id = db.session.execute(
+        update(InventorySession)
+        .where(InventorySession.id == sid, InventorySession.closed_at.is_(None))
+        .values(closed_at=datetime.utcnow())
+        .returning(InventorySession.antenna_id)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+    if not antenna_id: return jsonify({"ok": False}), 404
+    # écarts par type pour les agrégats, lignes de stock verrouillées jusqu'au commit
+    totals, counted_ids = {}, []
+    for r in (
+        db.session.query(StockItem.id, StockItem.antenna_id, StockItem.garment_type_id, StockItem.quantity, InventoryLine.counted_qty)
+        .join(InventoryLine, InventoryLine.stock_item_id == StockItem.id)
+        .filter(InventoryLine.session_id == sid)
+        .with_for_update(of=StockItem)
+    ):
+        key = (r.antenna_id, r.garment_type_id)
+        totals[key] = totals.get(key, 0) + r.counted_qty - r.quantity
+        counted_ids.append(r.id)
+    # UPDATE stock_items ... FROM inventory_lines : toutes les lignes en une requête
+    applied = db.session.execute(
+        update(StockItem)
+        .where(StockItem.id == InventoryLine.stock_item_id, InventoryLine.session_id == sid)
+        .values(quantity=InventoryLine.counted_qty)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    adjust_stock_totals(totals)
+    if counted_ids:
+        refresh_alerts(StockItem.id.in_(counted_ids))
+    bump_stock_version(antenna_id)
+    stock_changed((antenna_id, i) for i in counted_ids)
+    log_action("inventory.close", "inventory", sid, f"lines={applied}")
     db.session.commit()
     return jsonify({"ok": True})
 
 # ---------------------------------------------------------------------
 # Logs
 # ---------------------------------------------------------------------
-@app.get("/api/logs")
+@bp.get("/api/logs")
 @login_required
 def logs_list():
-    limit = min(int(request.args.get("limit", 100)), 1000)
-    items = Log.query.order_by(Log.at.desc()).limit(limit).all()
-    return jsonify([{
+    """Journaux récents d'abord ; filtres actor, action, entity, entity_id, from, to (index dédiés)."""
+    audit_writer().flush()
+    qry = db.session.query(Log.id, Log.at, Log.actor, Log.action, Log.entity, Log.entity_id, Log.details)
+    return keyset_response(filter_logs(qry), [Log.at, Log.id], log_row, descending=True, default_limit=100)
+
+def log_row(l):
+    return {
         "id": l.id, "at": l.at.isoformat(), "actor": l.actor, "action": l.action,
         "entity": l.entity, "entity_id": l.entity_id, "details": l.details
-    } for l in items])
+    }
+
+def log_filters():
+    a = request.args
+    return {
+        "actor": a.get("actor") or None, "action": a.get("action") or None,
+        "entity": a.get("entity") or None, "entity_id": a.get("entity_id", type=int),
+        "from": a.get("from", type=datetime.fromisoformat), "to": a.get("to", type=datetime.fromisoformat),
+    }
+
+def filter_logs(qry):
+    f = log_filters()
+    for col in ("actor", "action", "entity", "entity_id"):
+        if f[col] is not None:
+            qry = qry.filter(getattr(Log, col) == f[col])
+    if f["from"]: qry = qry.filter(Log.at >= f["from"])
+    if f["to"]: qry = qry.filter(Log.at < f["to"])
+    return qry
+
+# Archives : logs-<premier at>-<dernier at>-<dernier id>.jsonl.gz, une ligne JSON par journal
+ARCHIVE_TS = "%Y%m%dT%H%M%S"
+
+def log_cutoff(older_than_days: int | None = None) -> datetime:
+    days = current_app.config["LOG_RETENTION_DAYS"] if older_than_days is None else older_than_days
+    return datetime.utcnow() - timedelta(days=days)
+
+def archive_logs(older_than_days: int | None = None, batch_size: int = 5000, max_batches: int | None = None) -> list[str]:
+    """Déplace les journaux plus anciens que la rétention vers des archives gzip ; renvoie les fichiers créés.
+
+    Chaque lot est écrit (fichier temporaire puis renommage) avant d'être supprimé
+    de la table ; les lignes verrouillées par un autre archivage sont sautées.
+    `max_batches` borne le travail d'un appel (None : jusqu'au bout).
+    """
+    cutoff = log_cutoff(older_than_days)
+    folder = current_app.config["LOG_ARCHIVE_DIR"]
+    os.makedirs(folder, exist_ok=True)
+    files = []
+    while max_batches is None or len(files) < max_batches:
+        rows = (
+            db.session.query(Log.id, Log.at, Log.actor, Log.action, Log.entity, Log.entity_id, Log.details)
+            .filter(Log.at < cutoff).order_by(Log.at, Log.id).limit(batch_size)
+            .with_for_update(skip_locked=True).all()
+        )
+        if not rows:
+            break
+        name = f"logs-{rows[0].at:{ARCHIVE_TS}}-{rows[-1].at:{ARCHIVE_TS}}-{rows[-1].id}.jsonl.gz"
+        path = os.path.join(folder, name)
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as fh:
+            for r in rows:
+                fh.write(json.dumps(log_row(r), ensure_ascii=False) + "\n")
+        os.replace(path + ".tmp", path)
+        db.session.execute(delete(Log).where(Log.id.in_([r.id for r in rows])))
+        db.session.commit()
+        files.append(name)
+    return files
+
+def log_archives():
+    """[(nom, premier at, dernier at)] des archives, par ordre chronologique."""
+    out = []
+    folder = current_app.config["LOG_ARCHIVE_DIR"]
+    for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+        parts = name.removesuffix(".jsonl.gz").split("-")
+        if name.endswith(".jsonl.gz") and len(parts) == 4 and parts[0] == "logs":
+            out.append((name, datetime.strptime(parts[1], ARCHIVE_TS), datetime.strptime(parts[2], ARCHIVE_TS)))
+    return out
+
+def archived_logs(f):
+    """Lit à la demande les archives couvrant la période demandée et applique les filtres."""
+    for name, first, last in log_archives():
+        if (f["from"] and last < f["from"]) or (f["to"] and first >= f["to"]):
+            continue
+        with gzip.open(os.path.join(current_app.config["LOG_ARCHIVE_DIR"], name), "rt", encoding="utf-8") as fh:
+            for line in fh:
+                r = json.loads(line)
+                at = datetime.fromisoformat(r["at"])
+                if (f["from"] and at < f["from"]) or (f["to"] and at >= f["to"]):
+                    continue
+                if all(f[k] is None or r[k] == f[k] for k in ("actor", "action", "entity", "entity_id")):
+                    yield r
+
+@bp.get("/api/logs/archives")
+@login_required
+def logs_archives_list():
+    folder = current_app.config["LOG_ARCHIVE_DIR"]
+    return jsonify([
+        {"name": n, "from": a.isoformat(), "to": b.isoformat(), "size": os.path.getsize(os.path.join(folder, n))}
+        for n, a, b in log_archives()
+    ])
+
+@bp.get("/api/logs/archived")
+@login_required
+def logs_archived():
+    """Journaux archivés (ordre chronologique, flux JSON) ; mêmes filtres que /api/logs."""
+    return stream_json(archived_logs(log_filters()), lambda r: r)
+
+@bp.post("/api/logs/archive")
+@login_required
+def logs_archive():
+    d = request.get_json(silent=True) or {}
+    days = d.get("older_than_days")
+    if days is not None and int(days) < 1:
+        return jsonify({"ok": False, "error": "older_than_days >= 1 requis"}), 400
+    days = None if days is None else int(days)
+    # lots bornés par appel : le client rappelle tant que `remaining` > 0 (tout d'un coup : flask archive-logs)
+    cfg = current_app.config
+    files = archive_logs(days, batch_size=cfg["LOG_ARCHIVE_BATCH_SIZE"], max_batches=cfg["LOG_ARCHIVE_API_BATCHES"])
+    remaining = db.session.query(db.func.count(Log.id)).filter(Log.at < log_cutoff(days)).scalar()
+    return jsonify({"ok": True, "files": files, "remaining": remaining})
+
+@bp.cli.command("archive-logs")
+def archive_logs_command():
+    """Archive les journaux plus anciens que LOG_RETENTION_DAYS (à lancer par cron)."""
+    for name in archive_logs(batch_size=current_app.config["LOG_ARCHIVE_BATCH_SIZE"]):
+        print(name)
 
 # ---------------------------------------------------------------------
+# Exports CSV (flux, mémoire constante)
+# ---------------------------------------------------------------------
+@bp.get("/api/export/stock.csv")
+@login_required
+def export_stock():
+    antenna_id = request.args.get("antenna_id", type=int)
+    q = (
+        db.session.query(Antenna.name, GarmentType.label, StockItem.size, StockItem.quantity, tags_column())
+        .join(GarmentType, StockItem.garment_type_id == GarmentType.id)
+        .join(Antenna, StockItem.antenna_id == Antenna.id)
+        .order_by(Antenna.name, GarmentType.label, StockItem.size, StockItem.id)
+    )
+    if antenna_id: q = q.filter(StockItem.antenna_id == antenna_id)
+    return stream_csv(
+        "stock.csv", ["Antenne", "Type", "Taille", "Quantité", "Tags"], q,
+        lambda r: [r.name, r.label, r.size or "", r.quantity, ",".join(sorted(r.tags.split(","))) if r.tags else ""],
+    )
+
+@bp.get("/api/export/loans.csv")
+@login_required
+def export_loans():
+    """Historique des prêts (ouverts et rendus), filtrable par antenne et période de prêt."""
+    antenna_id = request.args.get("antenna_id", type=int)
+    since = request.args.get("from", type=datetime.fromisoformat)
+    until = request.args.get("to", type=datetime.fromisoformat)
+    q = (
+        db.session.query(
+            Loan.id, Volunteer.last_name, Volunteer.first_name, GarmentType.label, StockItem.size,
+            Antenna.name, Loan.qty, Loan.created_at, Loan.returned_at,
+        )
+        .join(Volunteer, Loan.volunteer_id == Volunteer.id)
+        .join(StockItem, Loan.stock_item_id == StockItem.id)
+        .join(GarmentType, StockItem.garment_type_id == GarmentType.id)
+        .join(Antenna, StockItem.antenna_id == Antenna.id)
+        .order_by(Loan.id)
+    )
+    if antenna_id: q = q.filter(StockItem.antenna_id == antenna_id)
+    if since: q = q.filter(Loan.created_at >= since)
+    if until: q = q.filter(Loan.created_at < until)
+    return stream_csv(
+        "prets.csv", ["Prêt", "Nom", "Prénom", "Type", "Taille", "Antenne", "Qté", "Prêté le", "Rendu le"], q,
+        lambda r: [r.id, r.last_name, r.first_name, r.label, r.size or "", r.name, r.qty, fmt_dt(r.created_at), fmt_dt(r.returned_at)],
+    )
+
+@bp.get("/api/export/logs.csv")
+@login_required
+def export_logs():
+    audit_writer().flush()
+    q = filter_logs(db.session.query(Log.at, Log.actor, Log.action, Log.entity, Log.entity_id, Log.details)).order_by(Log.at, Log.id)
+    return stream_csv(
+        "journaux.csv", ["Date", "Acteur", "Action", "Cible", "Id", "Détails"], q,
+        lambda r: [fmt_dt(r.at), r.actor or "", r.action, r.entity, r.entity_id or "", r.details or ""],
+    )
+
+@bp.get("/api/export/inventories.csv")
+@login_required
+def export_inventories():
+    """Inventaires clôturés avec leurs lignes (stock avant, compté, écart)."""
+    antenna_id = request.args.get("antenna_id", type=int)
+    session_id = request.args.get("session_id", type=int)
+    q = (
+        db.session.query(
+            InventorySession.id, Antenna.name, User.email, InventorySession.started_at, InventorySession.closed_at,
+            GarmentType.label, StockItem.size, InventoryLine.previous_qty, InventoryLine.counted_qty, InventoryLine.delta,
+        )
+        .join(InventoryLine, InventoryLine.session_id == InventorySession.id)
+        .join(Antenna, InventorySession.antenna_id == Antenna.id)
+        .join(User, InventorySession.user_id == User.id)
+        .join(StockItem, InventoryLine.stock_item_id == StockItem.id)
+        .join(GarmentType, StockItem.garment_type_id == GarmentType.id)
+        .filter(InventorySession.closed_at.isnot(None))
+        .order_by(InventorySession.id, InventoryLine.id)
+    )
+    if antenna_id: q = q.filter(InventorySession.antenna_id == antenna_id)
+    if session_id: q = q.filter(InventorySession.id == session_id)
+    return stream_csv(
+        "inventaires.csv",
+        ["Session", "Antenne", "Utilisateur", "Début", "Clôture", "Type", "Taille", "Avant", "Compté", "Écart"], q,
+        lambda r: [r.id, r.name, r.email, fmt_dt(r.started_at), fmt_dt(r.closed_at), r.label, r.size or "",
+                   r.previous_qty, r.counted_qty, r.delta],
+    )
+
+# ---------------------------------------------------------------------
+# Fabrique
+# ---------------------------------------------------------------------
+def create_app(config: dict | None = None) -> Flask:
+    """Construit l'application sans toucher à la base (schéma : flask --app app migrate).
+
+    `config` surcharge l'environnement, ex. create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://"}).
+    """
+    app = Flask(__name__, template_folder="templates", static_folder="static")
+    configure(app)
+    app.config.update(config or {})
+    if app.config["TRUST_PROXY"]:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
+    db.init_app(app)
+    login_manager.init_app(app)
+    passwords.init_app(app)
+    metrics.init_app(app)
+    AuditWriter(app)
+    app.register_blueprint(bp)
+    return app
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000, debug=True)
+    create_app().run(host="0.0.0.0", port=8000, debug=True)
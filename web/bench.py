@@ -0,0 +1,578 @@
+"""Banc de mesures reproductible (bibliothèque standard + dépendances de l'application).
+
+    python bench.py seed   --db sqlite:////tmp/bench.db --scale 1 --reset
+    python bench.py routes --db sqlite:////tmp/bench.db --baseline bench_baseline.json
+    python bench.py load   --db sqlite:////tmp/bench.db --threads 8 --duration 10
+    python bench.py login  --url http://localhost:8010 --logins 8 --duration 15
+
+seed   : jeu de données synthétique déterministe (antennes, types, stock avec
+         tailles et tags, bénévoles, prêts ouverts et rendus, journaux).
+routes : chaque route /api/* via le client de test Flask ; p50/p95/p99, débit
+         et requêtes SQL par appel. --save-baseline enregistre les résultats,
+         --baseline échoue (code 1) si une route émet plus de requêtes SQL ou
+         si son p95 dépasse la référence (× --tolerance + --slack ms).
+load   : mélange lectures/écritures depuis plusieurs threads (un client chacun).
+login  : pages publiques d'un serveur lancé pendant des connexions concurrentes
+         (serveur avec LOGIN_IP_LIMIT=0 et LOGIN_ACCOUNT_LIMIT=0 pour mesurer bcrypt).
+
+Le coût bcrypt est ramené à 4 et la limitation des connexions désactivée pour
+seed/routes/load (variables d'environnement prioritaires si définies).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+FIRST = ["Élodie", "Jean", "Marie", "Chloé", "Lucas", "Anaïs", "Hugo", "Léa", "Noé", "Inès", "Zoé", "Théo"]
+LAST = ["Dupont", "Martin", "Lefèvre", "Bernard", "Petit", "Durand", "Moreau", "Laurent", "Garçon", "Roux"]
+TYPES = ["Parka", "Polo", "Pantalon", "Veste", "Gilet HV", "Tee-shirt", "Casquette", "Chaussures", "Softshell", "Sweat"]
+SIZES = ["XS", "S", "M", "L", "XL", "XXL"]
+TAGS = ["hiver", "été", "neuf", "occasion", "réserve", "logo", "femme", "homme", "enfant", "haute-visibilité"]
+ACTIONS = ["stock.add", "stock.update", "loan.create", "loan.return", "loan.return.public", "inventory.close"]
+
+
+def load_app(db_url):
+    os.environ["DATABASE_URL"] = db_url
+    defaults = {
+        "BCRYPT_ROUNDS": "4", "LOGIN_IP_LIMIT": "0", "LOGIN_ACCOUNT_LIMIT": "0",
+        "LOG_ARCHIVE_DIR": os.path.join(tempfile.gettempdir(), "bench-archives"),
+        "STREAM_URL": "http://localhost:8011/api/public/stream",
+    }
+    for k, v in defaults.items():
+        os.environ.setdefault(k, v)
+    sys.path.insert(0, HERE)
+    import app as m
+    return m, m.create_app()
+
+
+def summary(samples):
+    if len(samples) < 2:
+        return {"n": len(samples), "p50": round(samples[0], 2) if samples else None}
+    q = statistics.quantiles(samples, n=100, method="inclusive")
+    return {"n": len(samples), "p50": round(q[49], 2), "p95": round(q[94], 2), "p99": round(q[98], 2)}
+
+
+# ---------------------------------------------------------------------
+# Jeu de données synthétique
+# ---------------------------------------------------------------------
+def seed_dataset(m, app, scale=1.0, seed=1, reset=False):
+    from sqlalchemy import insert
+
+    rng = random.Random(seed)
+    n = lambda base: max(1, int(base * scale))
+    now = datetime.utcnow()
+    with app.app_context():
+        db = m.db
+        if reset:
+            db.drop_all()
+        m.migrate()
+        m.ensure_admin()
+        if db.session.query(m.StockItem.id).first():
+            raise SystemExit("Base non vide : relancer avec --reset")
+
+        def bulk(model, rows):
+            ids = []
+            for i in range(0, len(rows), 5000):
+                stmt = insert(model).returning(model.id, sort_by_parameter_order=True)
+                ids += db.session.execute(stmt, rows[i:i + 5000]).scalars().all()
+            return ids
+
+        ant_ids = bulk(m.Antenna, [
+            {"name": f"Antenne {i + 1}", "address": "", "low_stock_threshold": rng.choice([None, 3, 5, 10])}
+            for i in range(n(10))
+        ])
+        type_ids = bulk(m.GarmentType, [
+            {"label": f"{TYPES[i % len(TYPES)]} {i // len(TYPES) + 1}", "has_size": True} for i in range(n(20))
+        ])
+        items = [(a, t, s) for a in ant_ids for t in type_ids for s in SIZES]
+        item_ids = bulk(m.StockItem, [
+            {"antenna_id": a, "garment_type_id": t, "size": s, "quantity": rng.randint(0, 50)} for a, t, s in items
+        ])
+        tag_rows = [{"stock_item_id": i, "tag": t} for i in item_ids for t in rng.sample(TAGS, rng.randint(0, 2))]
+        for i in range(0, len(tag_rows), 5000):
+            db.session.execute(insert(m.StockItemTag), tag_rows[i:i + 5000])
+        vols = []
+        for i in range(n(5000)):
+            first, last = rng.choice(FIRST), f"{rng.choice(LAST)} {i + 1}"
+            vols.append({
+                "first_name": first, "last_name": last, "note": "",
+                "first_key": m.search_key(first), "last_key": m.search_key(last),
+                "name_key": m.volunteer_name_key(last, first),
+            })
+        vol_ids = bulk(m.Volunteer, vols)
+        loans = []
+        for _ in range(n(20000)):
+            created = now - timedelta(days=rng.uniform(0, 365))
+            returned = None if rng.random() < 0.2 else created + timedelta(days=rng.uniform(0, 30))
+            loans.append({
+                "volunteer_id": rng.choice(vol_ids), "stock_item_id": rng.choice(item_ids), "qty": rng.randint(1, 2),
+                "created_at": created, "returned_at": returned if returned and returned < now else None,
+            })
+        bulk(m.Loan, loans)
+        bulk(m.Log, [
+            {"at": now - timedelta(days=rng.uniform(0, 365)), "actor": rng.choice(["admin@pc.fr", "public"]),
+             "action": rng.choice(ACTIONS), "entity": "stock", "entity_id": rng.choice(item_ids), "details": ""}
+            for _ in range(n(50000))
+        ])
+        admin_id = db.session.scalar(m.select(m.User.id).order_by(m.User.id))
+        items_by_antenna = {}
+        for item_id, (a, _, _) in zip(item_ids, items):
+            items_by_antenna.setdefault(a, []).append(item_id)
+        sessions = [
+            {"antenna_id": a, "user_id": admin_id, "started_at": started, "closed_at": started + timedelta(hours=1)}
+            for a in ant_ids for started in sorted(now - timedelta(days=rng.uniform(0, 365)) for _ in range(n(50)))
+        ]
+        session_ids = bulk(m.InventorySession, sessions)
+        lines = []
+        for sid, sess in zip(session_ids, sessions):
+            for item_id in rng.sample(items_by_antenna[sess["antenna_id"]], min(30, len(items_by_antenna[sess["antenna_id"]]))):
+                before, counted = rng.randint(0, 50), rng.randint(0, 50)
+                lines.append({"session_id": sid, "stock_item_id": item_id, "previous_qty": before,
+                              "counted_qty": counted, "delta": counted - before})
+        bulk(m.InventoryLine, lines)
+        db.session.commit()
+        m.rebuild_summaries()
+        m.rebuild_loan_daily()
+        if db.engine.dialect.name == "postgresql":
+            # statistiques à jour pour que les plans reflètent la volumétrie
+            with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                conn.exec_driver_sql("ANALYZE")
+        counts = {
+            "antennes": len(ant_ids), "types": len(type_ids), "articles": len(item_ids), "tags": len(tag_rows),
+            "bénévoles": len(vol_ids), "prêts": len(loans), "journaux": n(50000),
+            "inventaires": len(session_ids), "lignes d'inventaire": len(lines),
+        }
+    return counts
+
+
+# ---------------------------------------------------------------------
+# Mesure par route
+# ---------------------------------------------------------------------
+class StatementCounter:
+    """Compte les requêtes SQL émises par le thread mesuré (pas celles des autres threads)."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.thread, self.count = None, 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        if threading.get_ident() == self.thread:
+            self.count += 1
+
+
+def login_client(app, email="admin@pc.fr", password=None):
+    c = app.test_client()
+    r = c.post("/api/login", json={"email": email, "password": password or os.environ.get("ADMIN_PASSWORD", "admin123")})
+    assert r.status_code == 200, r.get_data(as_text=True)
+    return c
+
+
+class Fixtures:
+    """Objets jetables créés hors mesure (setup) via l'API, avec des noms uniques par exécution."""
+
+    def __init__(self, m, app, admin):
+        self.admin, self.run = admin, uuid.uuid4().hex[:6]
+        with app.app_context():
+            db = m.db
+            self.antenna_id = db.session.query(db.func.min(m.Antenna.id)).scalar()
+            self.type_id = db.session.query(db.func.min(m.GarmentType.id)).scalar()
+            self.item_ids = [i for (i,) in db.session.query(m.StockItem.id).filter(m.StockItem.antenna_id == self.antenna_id)
+                             .order_by(m.StockItem.id).limit(20)]
+            self.reserve_id = self.item_ids[0]
+            self.reserve_size = db.session.get(m.StockItem, self.reserve_id).size
+            self.other_antenna_id = db.session.query(db.func.max(m.Antenna.id)).scalar()
+            v = db.session.query(m.Volunteer.id, m.Volunteer.first_name, m.Volunteer.last_name).order_by(m.Volunteer.id).first()
+            self.vol_id, self.vol_first, self.vol_last = v
+            self.user_id = db.session.query(db.func.min(m.User.id)).scalar()
+        # article réserve : les emprunts mesurés ne tombent jamais en rupture
+        admin.put(f"/api/stock/{self.reserve_id}", json={"quantity": 1_000_000})
+
+    def name(self, kind, i):
+        return f"bench-{kind}-{self.run}-{i}"
+
+    def loans(self, k=1):
+        r = self.admin.post("/api/public/loan/batch", json={
+            "volunteer_id": self.vol_id, "items": [{"stock_item_id": self.reserve_id, "qty": q + 1} for q in range(k)],
+        })
+        return r.json["loan_ids"]
+
+    def created(self, path, body):
+        r = self.admin.post(path, json=body)
+        assert r.status_code == 200, r.get_data(as_text=True)
+        return r.json["id"]
+
+    def inventory(self):
+        sid = self.created("/api/inventory/start", {"antenna_id": self.antenna_id})
+        self.admin.post(f"/api/inventory/{sid}/counts", json={
+            "lines": [{"stock_item_id": i, "counted_qty": 10} for i in self.item_ids[1:]],
+        })
+        return sid
+
+
+def route_cases(fx):
+    """(nom, méthode, chemin(i, s), corps(i, s), setup(i), itérations relatives)."""
+    F = fx
+    none = lambda i: None
+    csv_body = lambda i, s: None
+    return [
+        ("me", "GET", lambda i, s: "/api/me", None, none, 1),
+        ("login", "POST", lambda i, s: "/api/login", lambda i, s: {"email": "admin@pc.fr", "password": "admin123"}, none, 1),
+        ("logout", "POST", lambda i, s: "/api/logout", None, none, 1),
+        ("stats", "GET", lambda i, s: "/api/stats", None, none, 1),
+        ("analytics day", "GET", lambda i, s: "/api/analytics/loans?bucket=day", None, none, 0.3),
+        ("analytics month type", "GET", lambda i, s: "/api/analytics/loans?bucket=month&group=type,size", None, none, 1),
+        ("analytics forecast", "GET", lambda i, s: "/api/analytics/forecast?horizon=30", None, none, 1),
+        ("metrics slow", "GET", lambda i, s: "/api/metrics/slow", None, none, 1),
+        ("antennas list", "GET", lambda i, s: "/api/antennas", None, none, 1),
+        ("antennas add", "POST", lambda i, s: "/api/antennas", lambda i, s: {"name": F.name("ant", i)}, none, 1),
+        ("antennas update", "PUT", lambda i, s: f"/api/antennas/{F.antenna_id}",
+         lambda i, s: {"low_stock_threshold": 3 + i % 3}, none, 1),
+        ("antennas delete", "DELETE", lambda i, s: f"/api/antennas/{s}", None,
+         lambda i: F.created("/api/antennas", {"name": F.name("antdel", i)}), 1),
+        ("users list", "GET", lambda i, s: "/api/users", None, none, 1),
+        ("users add", "POST", lambda i, s: "/api/users",
+         lambda i, s: {"email": F.name("user", i) + "@x", "password": "pw", "name": "Bench"}, none, 1),
+        ("users update", "PUT", lambda i, s: f"/api/users/{s}", lambda i, s: {"name": f"Bench {i}"},
+         lambda i: F.created("/api/users", {"email": F.name("userupd", i) + "@x", "password": "pw"}), 1),
+        ("users delete", "DELETE", lambda i, s: f"/api/users/{s}", None,
+         lambda i: F.created("/api/users", {"email": F.name("userdel", i) + "@x", "password": "pw"}), 1),
+        ("types list", "GET", lambda i, s: "/api/types", None, none, 1),
+        ("types add", "POST", lambda i, s: "/api/types", lambda i, s: {"label": F.name("type", i)}, none, 1),
+        ("types delete", "DELETE", lambda i, s: f"/api/types/{s}", None,
+         lambda i: F.created("/api/types", {"label": F.name("typedel", i)}), 1),
+        ("stock page", "GET", lambda i, s: "/api/stock?limit=100", None, none, 1),
+        ("stock all", "GET", lambda i, s: "/api/stock?stream=1", None, none, 0.3),
+        ("stock by tag", "GET", lambda i, s: "/api/stock?tag=hiver&limit=100", None, none, 1),
+        ("stock add", "POST", lambda i, s: "/api/stock", lambda i, s: {
+            "garment_type_id": F.type_id, "antenna_id": F.antenna_id, "size": "M", "quantity": 1, "tags": ["bench"]}, none, 1),
+        ("stock update", "PUT", lambda i, s: f"/api/stock/{F.item_ids[1]}", lambda i, s: {"quantity": 20 + i % 5}, none, 1),
+        ("stock delete", "DELETE", lambda i, s: f"/api/stock/{s}", None, lambda i: F.created("/api/stock", {
+            "garment_type_id": F.type_id, "antenna_id": F.antenna_id, "size": F.name("sz", i)[-12:], "quantity": 1}), 1),
+        ("stock transfer", "POST", lambda i, s: "/api/stock/transfer", lambda i, s: {
+            "from_antenna_id": F.antenna_id, "to_antenna_id": F.other_antenna_id,
+            "lines": [{"garment_type_id": F.type_id, "size": F.reserve_size, "qty": 1 + k} for k in range(3)]}, none, 1),
+        ("stock movements", "GET", lambda i, s: f"/api/stock/movements?antenna_id={F.antenna_id}&limit=100", None, none, 1),
+        ("stock low", "GET", lambda i, s: "/api/stock/low", None, none, 1),
+        ("stock alerts", "GET", lambda i, s: "/api/stock/alerts", None, none, 1),
+        ("volunteers page", "GET", lambda i, s: "/api/volunteers?limit=100", None, none, 1),
+        ("volunteers q", "GET", lambda i, s: "/api/volunteers?q=dupont&limit=100", None, none, 1),
+        ("volunteers search", "GET", lambda i, s: "/api/volunteers/search?q=lef", None, none, 1),
+        ("volunteers add", "POST", lambda i, s: "/api/volunteers",
+         lambda i, s: {"first_name": "Bench", "last_name": F.name("vol", i)}, none, 1),
+        ("volunteers update", "PUT", lambda i, s: f"/api/volunteers/{s}", lambda i, s: {"note": f"n{i}"},
+         lambda i: F.created("/api/volunteers", {"first_name": "Bench", "last_name": F.name("volupd", i)}), 1),
+        ("volunteers delete", "DELETE", lambda i, s: f"/api/volunteers/{s}", None,
+         lambda i: F.created("/api/volunteers", {"first_name": "Bench", "last_name": F.name("voldel", i)}), 1),
+        ("volunteers loans", "GET", lambda i, s: f"/api/volunteers/{F.vol_id}/loans", None, none, 1),
+        ("volunteers template", "GET", lambda i, s: "/api/volunteers/template.csv", None, none, 1),
+        ("volunteers import", "POST", lambda i, s: "/api/volunteers/import", "csv", none, 0.3),
+        ("loans open", "GET", lambda i, s: "/api/loans/open?limit=100", None, none, 1),
+        ("loan return", "POST", lambda i, s: f"/api/loans/return/{s[0]}", None, lambda i: F.loans(1), 1),
+        ("public volunteer", "GET",
+         lambda i, s: f"/api/public/volunteer?first_name={F.vol_first}&last_name={F.vol_last}", None, none, 1),
+        ("public stock", "GET", lambda i, s: f"/api/public/stock?antenna_id={F.antenna_id}", None, none, 1),
+        ("public types", "GET", lambda i, s: f"/api/public/types?antenna_id={F.antenna_id}", None, none, 1),
+        ("public sizes", "GET", lambda i, s: f"/api/public/sizes?type_id={F.type_id}&antenna_id={F.antenna_id}", None, none, 1),
+        ("public stream", "GET", lambda i, s: f"/api/public/stream?antenna_id={F.antenna_id}", None, none, 1),
+        ("public loans", "GET", lambda i, s: f"/api/public/loans?volunteer_id={F.vol_id}", None, none, 1),
+        ("public loan", "POST", lambda i, s: "/api/public/loan",
+         lambda i, s: {"volunteer_id": F.vol_id, "stock_item_id": F.reserve_id, "qty": 1}, none, 1),
+        ("public loan batch", "POST", lambda i, s: "/api/public/loan/batch", lambda i, s: {
+            "volunteer_id": F.vol_id, "items": [{"stock_item_id": F.reserve_id, "qty": 1}, {"stock_item_id": F.reserve_id, "qty": 2}]},
+         none, 1),
+        ("public return", "POST", lambda i, s: f"/api/public/return/{s[0]}", None, lambda i: F.loans(1), 1),
+        ("public loan idempotent", "POST", lambda i, s: "/api/public/loan",
+         lambda i, s: {"volunteer_id": F.vol_id, "stock_item_id": F.reserve_id, "qty": 1}, none, 1),
+        ("public sync", "POST", lambda i, s: "/api/public/sync", lambda i, s: {"operations": [
+            {"key": F.name("sync", i) + f"-{k}", "op": op, "volunteer_id": F.vol_id, "stock_item_id": F.reserve_id,
+             "loan_key": F.name("sync", i) + f"-{k - 1}"} for k, op in enumerate(["loan", "return"] * 5)]}, none, 1),
+        ("public return batch", "POST", lambda i, s: "/api/public/return/batch", lambda i, s: {"loan_ids": s},
+         lambda i: F.loans(3), 1),
+        ("inventory start", "POST", lambda i, s: "/api/inventory/start", lambda i, s: {"antenna_id": F.antenna_id}, none, 1),
+        ("inventory items", "GET", lambda i, s: f"/api/inventory/{s}/items", None, lambda i: F.inventory(), 0.5),
+        ("inventory count", "POST", lambda i, s: f"/api/inventory/{s}/count",
+         lambda i, s: {"stock_item_id": F.item_ids[1], "counted_qty": 7}, lambda i: F.inventory(), 0.5),
+        ("inventory counts", "POST", lambda i, s: f"/api/inventory/{s}/counts",
+         lambda i, s: {"lines": [{"stock_item_id": x, "counted_qty": 9} for x in F.item_ids[1:]]}, lambda i: F.inventory(), 0.5),
+        ("inventory close", "POST", lambda i, s: f"/api/inventory/{s}/close", None, lambda i: F.inventory(), 0.5),
+        ("logs page", "GET", lambda i, s: "/api/logs?limit=100", None, none, 1),
+        ("logs filtered", "GET", lambda i, s: "/api/logs?action=stock.update&limit=100", None, none, 1),
+        ("logs archive", "POST", lambda i, s: "/api/logs/archive", lambda i, s: {"older_than_days": 100000}, none, 1),
+        ("logs archives", "GET", lambda i, s: "/api/logs/archives", None, none, 1),
+        ("logs archived", "GET", lambda i, s: "/api/logs/archived?action=loan.create", None, none, 1),
+        ("export stock", "GET", lambda i, s: "/api/export/stock.csv", None, none, 0.2),
+        ("export loans", "GET", lambda i, s: "/api/export/loans.csv", None, none, 0.1),
+        ("export logs", "GET", lambda i, s: "/api/export/logs.csv", None, none, 0.1),
+        ("export inventories", "GET", lambda i, s: "/api/export/inventories.csv", None, none, 0.2),
+    ]
+
+
+def import_csv(fx, i, rows=200):
+    lines = ["nom;prenom"] + [f"{fx.name('imp', i)}-{k};Bench" for k in range(rows)]
+    return {"file": (io.BytesIO("\n".join(lines).encode()), "benevoles.csv")}
+
+
+# en-têtes par cas (nom -> fonction(fixtures, i))
+CASE_HEADERS = {
+    "public loan idempotent": lambda fx, i: {"Idempotency-Key": fx.name("idem", i)},
+}
+
+
+def call(client, method, path, body, headers=None):
+    if isinstance(body, dict) and "file" in body:
+        resp = client.open(path, method=method, data=body, content_type="multipart/form-data", headers=headers)
+    else:
+        resp = client.open(path, method=method, json=body, headers=headers)
+    resp.get_data()  # consomme les réponses en flux
+    return resp
+
+
+def run_routes(m, app, iterations=30, only=None):
+    with app.app_context():
+        counter = StatementCounter(m.db.engine)
+    admin = login_client(app)
+    fx = Fixtures(m, app, admin)
+    results, errors, covered = {}, [], set()
+    adapter = app.url_map.bind("localhost")
+    for name, method, path_fn, body_fn, setup, weight in route_cases(fx):
+        if only and only not in name:
+            continue
+        client = login_client(app)
+        times, stmts = [], []
+        runs = max(3, int(iterations * weight))
+        for i in range(runs + 1):  # le premier appel chauffe les caches
+            s = setup(i)
+            if name == "logout":
+                client = login_client(app)
+            path = path_fn(i, s)
+            body = import_csv(fx, i) if body_fn == "csv" else (body_fn(i, s) if body_fn else None)
+            counter.thread, counter.count = threading.get_ident(), 0
+            t = time.perf_counter()
+            headers = CASE_HEADERS[name](fx, i) if name in CASE_HEADERS else None
+            resp = call(client, method, path, body, headers)
+            elapsed = (time.perf_counter() - t) * 1000
+            counter.thread = None
+            if resp.status_code >= 400:
+                errors.append(f"{name}: {resp.status_code} {resp.get_data(as_text=True)[:120]}")
+            if i:
+                times.append(elapsed)
+                stmts.append(counter.count)
+        covered.add(adapter.match(path.split("?")[0], method=method)[0])
+        results[name] = {**summary(times), "rps": round(len(times) / (sum(times) / 1000), 1),
+                         "statements": int(statistics.median(stmts))}
+    api = {r.endpoint for r in app.url_map.iter_rules() if r.rule.startswith("/api/")}
+    missing = sorted(api - covered) if not only else []
+    return results, errors, missing
+
+
+def compare(results, baseline, tolerance, slack):
+    failures = []
+    for name, ref in baseline.items():
+        cur = results.get(name)
+        if not cur:
+            continue
+        if cur["statements"] > ref["statements"]:
+            failures.append(f"{name}: {cur['statements']} requêtes SQL (référence {ref['statements']})")
+        if ref.get("p95") and cur.get("p95") and cur["p95"] > ref["p95"] * tolerance + slack:
+            failures.append(f"{name}: p95 {cur['p95']} ms (référence {ref['p95']} ms)")
+    return failures
+
+
+def print_table(results):
+    print(f"{'route':<22}{'n':>5}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'sql':>5}")
+    for name, r in results.items():
+        print(f"{name:<22}{r['n']:>5}{r['p50']:>9}{r.get('p95', ''):>9}{r.get('p99', ''):>9}{r['rps']:>9}{r['statements']:>5}")
+
+
+def bench_seed(args):
+    m, app = load_app(args.db)
+    t = time.perf_counter()
+    counts = seed_dataset(m, app, scale=args.scale, seed=args.seed, reset=args.reset)
+    print(json.dumps(counts, ensure_ascii=False), f"{time.perf_counter() - t:.1f} s")
+
+
+def bench_routes(args):
+    m, app = load_app(args.db)
+    results, errors, missing = run_routes(m, app, iterations=args.iterations, only=args.only)
+    print_table(results)
+    dialect = args.db.split(":")[0].split("+")[0]
+    status = 0
+    for e in errors:
+        print("ERREUR", e)
+        status = 1
+    if missing:
+        print("Routes non couvertes :", ", ".join(missing))
+        status = 1
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as fh:
+            ref = json.load(fh).get(dialect, {})
+        failures = compare(results, ref, args.tolerance, args.slack)
+        for f in failures:
+            print("RÉGRESSION", f)
+        status = status or (1 if failures else 0)
+    if args.save_baseline:
+        data = {}
+        if os.path.exists(args.save_baseline):
+            with open(args.save_baseline, encoding="utf-8") as fh:
+                data = json.load(fh)
+        data[dialect] = {k: {"statements": v["statements"], "p95": v.get("p95")} for k, v in results.items()}
+        with open(args.save_baseline, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False, indent=1, sort_keys=True)
+    sys.exit(status)
+
+
+LOAD_MIX = [
+    ("public stock", 30), ("public volunteer", 20), ("stats", 10), ("stock page", 10), ("loans open", 10),
+    ("volunteers search", 10), ("public loan", 5), ("public return", 5),
+]
+
+
+def bench_load(args):
+    m, app = load_app(args.db)
+    admin = login_client(app)
+    fx = Fixtures(m, app, admin)
+    cases = {c[0]: c for c in route_cases(fx)}
+    names = [n for n, w in LOAD_MIX for _ in range(w)]
+    samples, statuses, lock, stop = {}, {}, threading.Lock(), threading.Event()
+
+    def worker(k):
+        rng, client = random.Random(k), login_client(app)
+        i = 0
+        while not stop.is_set():
+            name = rng.choice(names)
+            _, method, path_fn, body_fn, setup, _ = cases[name]
+            s = setup(i)
+            body = body_fn(i, s) if body_fn else None
+            t = time.perf_counter()
+            resp = call(client, method, path_fn(i, s), body)
+            ms = (time.perf_counter() - t) * 1000
+            with lock:
+                samples.setdefault(name, []).append(ms)
+                statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+            i += 1
+
+    threads = [threading.Thread(target=worker, args=(k,), daemon=True) for k in range(args.threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    total = sum(len(v) for v in samples.values())
+    for name, v in sorted(samples.items()):
+        print(f"{name:<20}", summary(v))
+    print(f"{total} requêtes en {elapsed:.1f} s : {total / elapsed:.0f} req/s avec {args.threads} threads ; statuts {statuses}")
+
+
+# ---------------------------------------------------------------------
+# Serveur lancé : pages publiques pendant des connexions
+# ---------------------------------------------------------------------
+PUBLIC_PATHS = ["/api/public/stock?antenna_id=1", "/api/public/volunteer?first_name=x&last_name=y"]
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    t = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=60) as r:
+            r.read()
+            status = r.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return (time.perf_counter() - t) * 1000, status
+
+
+def public_latency(base, duration):
+    samples, end, i = [], time.monotonic() + duration, 0
+    while time.monotonic() < end:
+        ms, _ = request(base + PUBLIC_PATHS[i % len(PUBLIC_PATHS)])
+        samples.append(ms)
+        i += 1
+    return samples
+
+
+def bench_login(args):
+    base = args.url.rstrip("/")
+    print("public seul          ", summary(public_latency(base, args.duration)))
+    stop, statuses, lock = threading.Event(), {}, threading.Lock()
+
+    def login_loop(n):
+        while not stop.is_set():
+            # un mot de passe faux sur deux : vérification bcrypt complète dans les deux cas
+            body = {"email": args.email, "password": args.password if n % 2 else "mauvais"}
+            _, status = request(base + "/api/login", body)
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    threads = [threading.Thread(target=login_loop, args=(n,), daemon=True) for n in range(args.logins)]
+    for t in threads:
+        t.start()
+    try:
+        print(f"public + {args.logins} connexions", summary(public_latency(base, args.duration)))
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    print("réponses /api/login  ", dict(sorted(statuses.items())))
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = p.add_subparsers(dest="scenario", required=True)
+    default_db = os.environ.get("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "bench.db"))
+
+    seed = sub.add_parser("seed", help="jeu de données synthétique")
+    seed.add_argument("--db", default=default_db)
+    seed.add_argument("--scale", type=float, default=1.0, help="1 : 10 antennes, 5000 bénévoles, 20000 prêts, 50000 journaux")
+    seed.add_argument("--seed", type=int, default=1)
+    seed.add_argument("--reset", action="store_true", help="supprime les tables de l'application avant")
+    seed.set_defaults(run=bench_seed)
+
+    routes = sub.add_parser("routes", help="chaque route /api/* via le client de test")
+    routes.add_argument("--db", default=default_db)
+    routes.add_argument("--iterations", type=int, default=30)
+    routes.add_argument("--only", help="routes dont le nom contient ce texte")
+    routes.add_argument("--baseline", help="fichier de référence à comparer")
+    routes.add_argument("--save-baseline", help="enregistre les résultats comme référence")
+    routes.add_argument("--tolerance", type=float, default=2.0, help="p95 autorisé : référence × tolérance + slack")
+    routes.add_argument("--slack", type=float, default=5.0, help="marge absolue en ms")
+    routes.set_defaults(run=bench_routes)
+
+    load = sub.add_parser("load", help="charge concurrente (mélange lectures/écritures)")
+    load.add_argument("--db", default=default_db)
+    load.add_argument("--threads", type=int, default=8)
+    load.add_argument("--duration", type=float, default=10.0)
+    load.set_defaults(run=bench_load)
+
+
+    login = sub.add_parser("login", help="pages publiques pendant des connexions concurrentes")
+    login.add_argument("--url", default="http://localhost:8010")
+    login.add_argument("--logins", type=int, default=8, help="clients de connexion simultanés")
+    login.add_argument("--duration", type=float, default=15.0, help="secondes par mesure")
+    login.add_argument("--email", default="admin@pc.fr")
+    login.add_argument("--password", default="admin123")
+    login.set_defaults(run=bench_login)
+
+    args = p.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,9 @@
 const App = {
   user: null,
   publicAntennaId: null,
+  pubStock: [],
+  pubPicked: new Set(),
+  pubStream: null,
   nav: [
     { id: "dashboard", label: "Dashboard", auth: true },
     { id: "antennes", label: "Antennes", auth: true },
@@ -72,6 +75,9 @@ const App = {
     if (m) this.publicAntennaId = Number(m[1]);
     if (this.publicAntennaId) { // page publique
       document.getElementById("loginView").classList.add("hidden");
+      window.addEventListener("online", () => this.syncOffline());
+      setInterval(() => this.syncOffline(), 30000);
+      this.syncOffline();
       this.renderNav(); this.show("pretPublic"); return;
     }
     try { const me = await this.fetchJSON("/api/me"); if (me.ok) { this.user = me.user; this.renderNav(); this.qs("#loginView").classList.add("hidden"); this.show("dashboard"); return; } } catch {}
@@ -111,19 +117,15 @@ const App = {
 
   // ------------------------------ Dashboard (abrégé) ------------------------------
   async renderDashboard() {
-    const [stats, ants, stock, openLoans] = await Promise.all([
+    const defThreshold = this.getSetting("default_threshold", 5);
+    const [stats, lowStock, openLoans] = await Promise.all([
       this.fetchJSON("/api/stats").catch(() => ({ stock_total: 0, prets_ouverts: 0, benevoles: 0 })),
-      this.fetchJSON("/api/antennas").catch(() => []),
-      this.fetchJSON("/api/stock").catch(() => []),
-      this.fetchJSON("/api/loans/open").catch(() => []),
+      this.fetchJSON("/api/stock/low?default=" + encodeURIComponent(defThreshold)).catch(() => []),
+      this.fetchJSON("/api/loans/open?stream=1").catch(() => []),
     ]);
     const overdueDays = this.getSetting("overdue_days", 30);
     const now = Date.now();
     const overdue = openLoans.map(l => ({ ...l, days: this.daysBetween(new Date(l.since).getTime(), now) })).filter(l => l.days > overdueDays);
-    const antThreshold = Object.fromEntries(ants.map(a => [a.id, (a.low_stock_threshold ?? this.getSetting("default_threshold", 5))]));
-    const lowStock = stock.filter(s => s.quantity <= (antThreshold[s.antenna_id] ?? 5));
-    const byAntenna = {}, byType = {};
-    stock.forEach(s => { byAntenna[s.antenna] = (byAntenna[s.antenna] || 0) + s.quantity; byType[s.garment_type] = (byType[s.garment_type] || 0) + s.quantity; });
 
     const el=this.qs('#dashboard'); el.innerHTML=`
       <div class="card">
@@ -177,15 +179,17 @@ const App = {
     el.innerHTML=`<div class="card">
       <div class="chips" style="justify-content:space-between"><h2>Stock</h2>
         <div class="chips">
+          <a class="btn btn-ghost" href="/api/export/stock.csv">⬇️ Export CSV</a>
           <button class="btn btn-ghost" onclick="App.modalAddType()">+ Type</button>
+          <button class="btn btn-ghost" onclick="App.modalTransfer()">⇄ Transfert</button>
           <button class="btn btn-primary" onclick="App.modalAddStock()">+ Article</button>
         </div>
       </div>
-      <div class="grid-3 mt"><select id="f_type">${optType('')}</select><select id="f_ant">${optAnt('')}</select><button class="btn btn-ghost" onclick="App.loadStock()">Filtrer</button></div>
+      <div class="grid-4 mt"><select id="f_type">${optType('')}</select><select id="f_ant">${optAnt('')}</select><input id="f_tag" class="input" placeholder="Tags (a,b)"><button class="btn btn-ghost" onclick="App.loadStock()">Filtrer</button></div>
       <div id="stockTable" class="mt"></div>
     </div>`;
     this._optType=optType; this._optAnt=optAnt; await this.loadStock(); },
-  async loadStock(){ const t=this.qs('#f_type')?.value||''; const a=this.qs('#f_ant')?.value||''; const qs=[]; if(t) qs.push(`type_id=${t}`); if(a) qs.push(`antenna_id=${a}`); const stock=await this.fetchJSON('/api/stock'+(qs.length?`?${qs.join('&')}`:'')); this.qs('#stockTable').innerHTML=`<table class="table"><thead><tr><th>Type</th><th>Taille</th><th>Antenne</th><th>Qté</th><th>Tags</th><th></th></tr></thead><tbody>${stock.map(s=>`<tr><td>${s.garment_type}</td><td>${s.size||'—'}</td><td>${s.antenna}</td><td>${s.quantity}</td><td>${this.renderTagsInline(s.tags||[])}</td><td class="chips"><button class="btn btn-ghost" onclick='App.modalEditStock(${s.id}, ${JSON.stringify({id:s.id,type_id:s.garment_type_id,ant_id:s.antenna_id,size:s.size||"",qty:s.quantity,tags:s.tags||[]}).replaceAll("'","&apos;")})'>Modifier</button><button class="btn btn-ghost" onclick="App.deleteStock(${s.id})">Supprimer</button></td></tr>`).join('')}</tbody></table>`; },
+  async loadStock(){ const t=this.qs('#f_type')?.value||''; const a=this.qs('#f_ant')?.value||''; const qs=['stream=1']; if(t) qs.push(`type_id=${t}`); if(a) qs.push(`antenna_id=${a}`); const tg=this.qs('#f_tag')?.value.trim()||''; if(tg) qs.push(`tag=${encodeURIComponent(tg)}`); const stock=await this.fetchJSON('/api/stock?'+qs.join('&')); this.qs('#stockTable').innerHTML=`<table class="table"><thead><tr><th>Type</th><th>Taille</th><th>Antenne</th><th>Qté</th><th>Tags</th><th></th></tr></thead><tbody>${stock.map(s=>`<tr><td>${s.garment_type}</td><td>${s.size||'—'}</td><td>${s.antenna}</td><td>${s.quantity}</td><td>${this.renderTagsInline(s.tags||[])}</td><td class="chips"><button class="btn btn-ghost" onclick='App.modalEditStock(${s.id}, ${JSON.stringify({id:s.id,type_id:s.garment_type_id,ant_id:s.antenna_id,size:s.size||"",qty:s.quantity,tags:s.tags||[]}).replaceAll("'","&apos;")})'>Modifier</button><button class="btn btn-ghost" onclick="App.deleteStock(${s.id})">Supprimer</button></td></tr>`).join('')}</tbody></table>`; },
   renderTagsInline(tags){ tags=Array.isArray(tags)? tags: String(tags||'').split(',').map(x=>x.trim()).filter(Boolean); if(!tags.length) return `<span class="muted">—</span>`; return `<div class="chips">${tags.map(t=>`<span class="badge">${t}</span>`).join('')}</div>`; },
   modalAddType(){ this.openModal('Ajouter un type', `<div class="grid-2"><input id="new_type" class="input" placeholder="Libellé (ex: Parka)"><label><input id="new_has_size" type="checkbox" checked> Avec taille</label></div><div class="chips" style="justify-content:flex-end"><button class="btn btn-primary" onclick="App.saveType()">Enregistrer</button></div><div class="mt"><button class="btn btn-ghost" onclick="App.manageTypes()">Gérer / Supprimer</button></div>`); },
   async manageTypes(){ const types=await this.fetchJSON('/api/types'); const body=`<table class="table"><thead><tr><th>Type</th><th>Taille ?</th><th></th></tr></thead><tbody>${types.map(t=>`<tr><td>${t.label}</td><td>${t.has_size?'Oui':'Non'}</td><td><button class="btn btn-ghost" onclick="App.deleteType(${t.id})">Supprimer</button></td></tr>`).join('')}</tbody></table>`; this.openModal('Types existants', body); },
@@ -193,13 +197,16 @@ const App = {
   async saveType(){ const label=this.qs('#new_type').value.trim(); const has_size=this.qs('#new_has_size').checked; if(!label) return this.flash('Libellé requis',false); try{ await this.fetchJSON('/api/types',{method:'POST', body: JSON.stringify({label,has_size})}); this.closeModal(); this.renderStock(); this.flash('Type ajouté'); }catch(e){ this.flash(e.message||'Création refusée'); }},
   modalAddStock(){ this.openModal('Ajouter au stock', `<div class="grid-4"><select id="s_type">${this._optType('')}</select><select id="s_ant">${this._optAnt('')}</select><input id="s_size" class="input" placeholder="Taille (optionnel)"><input id="s_qty" class="input" type="number" value="1" min="1" placeholder="Quantité"></div><div class="mt"><input id="s_tags" class="input" placeholder="Tags séparés par des virgules (ex: Hiver, EPS)"></div><div class="chips" style="justify-content:flex-end"><button class="btn btn-primary" onclick="App.saveStock()">Enregistrer</button></div>`); },
   async saveStock(){ const t=Number(this.qs('#s_type').value); const a=Number(this.qs('#s_ant').value); const size=this.qs('#s_size').value.trim()||null; const qty=Number(this.qs('#s_qty').value||0); const tags=this.qs('#s_tags').value.split(',').map(x=>x.trim()).filter(Boolean); if(!t||!a||qty<=0) return this.flash('Type, antenne et quantité requis',false); try{ await this.fetchJSON('/api/stock',{method:'POST', body: JSON.stringify({garment_type_id:t, antenna_id:a, size, quantity:qty, tags})}); this.closeModal(); this.loadStock(); this.flash('Stock ajouté'); }catch(e){ this.flash(e.message||'Erreur ajout stock'); } },
+  transferLine(){ return `<div class="grid-3 mt tr_line"><select class="tr_type">${this._optType('')}</select><input class="input tr_size" placeholder="Taille (optionnel)"><input class="input tr_qty" type="number" value="1" min="1"></div>`; },
+  modalTransfer(){ this.openModal('Transfert entre antennes', `<div class="grid-2"><select id="tr_from">${this._optAnt('')}</select><select id="tr_to">${this._optAnt('')}</select></div><div id="tr_lines">${this.transferLine()}</div><div class="chips mt" style="justify-content:space-between"><button class="btn btn-ghost" onclick="App.qs('#tr_lines').insertAdjacentHTML('beforeend', App.transferLine())">+ Ligne</button><button class="btn btn-primary" onclick="App.saveTransfer()">Transférer</button></div>`); },
+  async saveTransfer(){ const from=Number(this.qs('#tr_from').value), to=Number(this.qs('#tr_to').value); const lines=[...document.querySelectorAll('#tr_lines .tr_line')].map(l=>({garment_type_id:Number(l.querySelector('.tr_type').value), size:l.querySelector('.tr_size').value.trim()||null, qty:Number(l.querySelector('.tr_qty').value||0)})).filter(l=>l.garment_type_id&&l.qty>0); if(!from||!to||from===to||!lines.length) return this.flash('Deux antennes différentes et au moins une ligne requises',false); try{ const r=await this.fetchJSON('/api/stock/transfer',{method:'POST', body: JSON.stringify({from_antenna_id:from, to_antenna_id:to, lines})}); this.closeModal(); this.loadStock(); this.flash(`${r.lines.reduce((n,l)=>n+l.qty,0)} article(s) transféré(s)`); }catch(e){ this.flash(e.message||'Transfert refusé'); } },
   modalEditStock(id,s){ this.openModal('Modifier un article de stock', `<div class="grid-4"><select id="es_type">${this._optType(s.type_id)}</select><select id="es_ant">${this._optAnt(s.ant_id)}</select><input id="es_size" class="input" value="${s.size||''}" placeholder="Taille"><input id="es_qty" class="input" type="number" value="${s.qty}" min="0"></div><div class="mt"><input id="es_tags" class="input" value="${(s.tags||[]).join(', ')}" placeholder="Tags séparés par des virgules"></div><div class="chips" style="justify-content:flex-end"><button class="btn btn-primary" onclick="App.saveEditStock(${id})">Enregistrer</button></div>`); },
   async saveEditStock(id){ const body={ garment_type_id:Number(this.qs('#es_type').value), antenna_id:Number(this.qs('#es_ant').value), size:this.qs('#es_size').value.trim()||null, quantity:Number(this.qs('#es_qty').value||0), tags:this.qs('#es_tags').value.split(',').map(x=>x.trim()).filter(Boolean) }; try{ await this.fetchJSON('/api/stock/'+id,{method:'PUT', body: JSON.stringify(body)}); this.closeModal(); this.loadStock(); this.flash('Article mis à jour'); }catch(e){ this.flash(e.message||'Mise à jour refusée'); } },
   async deleteStock(id){ if(!confirm('Supprimer cet article ?')) return; try{ await this.fetchJSON('/api/stock/'+id,{method:'DELETE'}); await this.loadStock(); this.flash('Article supprimé'); } catch(e){ this.flash(e.message||'Suppression impossible'); } },
 
   // ------------------------------ Bénévoles (CRUD + recherche + import) ------------------------------
   _volLocal: [],
-  async renderBenevoles(){ const el=this.qs('#benevoles'); const data=await this.fetchJSON('/api/volunteers'); this._volLocal=data;
+  async renderBenevoles(){ const el=this.qs('#benevoles'); const data=await this.fetchJSON('/api/volunteers?stream=1'); this._volLocal=data;
     el.innerHTML=`<div class="card">
       <div class="chips" style="justify-content:space-between">
         <h2>Bénévoles</h2>
@@ -216,7 +223,8 @@ const App = {
     </div>`;
     this.drawVolTable(this._volLocal);
     const fileInput=document.getElementById('volImportFile'); fileInput.onchange=async()=>{ const file=fileInput.files[0]; if(!file) return; await this.importVolunteersCSV(file); fileInput.value=""; };
-    const search=this.qs('#volSearch'); search.oninput=()=>{ const q=search.value.trim().toLowerCase(); if(!q) return this.drawVolTable(this._volLocal); const f=this._volLocal.filter(v=> (v.last_name||'').toLowerCase().includes(q) || (v.first_name||'').toLowerCase().includes(q) || (v.note||'').toLowerCase().includes(q) ); this.drawVolTable(f); };
+    // filtre côté serveur (nom, prénom, note ; sans accents), dernière frappe seulement
+    const search=this.qs('#volSearch'); let timer=null, seq=0; search.oninput=()=>{ clearTimeout(timer); timer=setTimeout(async()=>{ const q=search.value.trim(); const n=++seq; if(!q) return this.drawVolTable(this._volLocal); const found=await this.fetchJSON(`/api/volunteers?q=${encodeURIComponent(q)}&limit=50`).catch(()=>[]); if(n===seq) this.drawVolTable(found); }, 200); };
   },
   drawVolTable(list){ this.qs('#volTable').innerHTML=`<table class="table"><thead><tr><th>Nom</th><th>Prénom</th><th>Notes</th><th></th></tr></thead><tbody>${(list||[]).map(v=>`<tr><td>${v.last_name}</td><td>${v.first_name}</td><td class="muted">${v.note||''}</td><td class="chips"><button class="btn btn-ghost" onclick='App.modalEditVol(${v.id}, ${JSON.stringify(v).replaceAll("'","&apos;")})'>Modifier</button><button class="btn btn-ghost" onclick='App.deleteVol(${v.id})'>Supprimer</button><button class="btn btn-ghost" onclick='App.viewVol(${v.id}, ${JSON.stringify(v).replaceAll("'","&apos;")})'>Voir</button></td></tr>`).join('')}</tbody></table>`; },
   modalAddVol(){ this.openModal('Nouveau bénévole', `<div class="grid-3"><input id="v_first" class="input" placeholder="Prénom"><input id="v_last" class="input" placeholder="Nom"><input id="v_note" class="input" placeholder="Infos"></div><div class="chips" style="justify-content:flex-end"><button class="btn btn-primary" onclick="App.addVol()">Enregistrer</button></div>`); },
@@ -228,7 +236,7 @@ const App = {
   async importVolunteersCSV(file){ try{ const fd=new FormData(); fd.append('file', file, file.name); const res=await fetch('/api/volunteers/import',{method:'POST', body: fd}); const data=await res.json(); if(!res.ok) throw new Error((data&&(data.error||data.message))||'Import refusé'); this.flash(`Import: +${data.added} ajoutés, ${data.skipped} ignorés (${data.total} lignes)`); await this.renderBenevoles(); } catch(e){ this.flash(e.message||'Erreur import CSV'); } },
 
   // ------------------------------ Prêts ------------------------------
-  async renderPrets(){ const el=this.qs('#prets'); const r=await this.fetchJSON('/api/loans/open'); el.innerHTML=`<div class="card"><h2>Prêts en cours</h2><table class="table"><thead><tr><th>Bénévole</th><th>Article</th><th>Qté</th><th>Depuis</th><th></th></tr></thead><tbody>${r.map(l=>`<tr><td>${l.volunteer}</td><td>${l.type} / ${l.size||'—'} @ ${l.antenna}</td><td>${l.qty}</td><td>${new Date(l.since).toLocaleString()}</td><td><button class="btn btn-ghost" onclick="App.returnLoan(${l.id})">Marquer rendu</button></td></tr>`).join('')}</tbody></table></div>`; },
+  async renderPrets(){ const el=this.qs('#prets'); const r=await this.fetchJSON('/api/loans/open?stream=1'); el.innerHTML=`<div class="card"><h2>Prêts en cours</h2><table class="table"><thead><tr><th>Bénévole</th><th>Article</th><th>Qté</th><th>Depuis</th><th></th></tr></thead><tbody>${r.map(l=>`<tr><td>${l.volunteer}</td><td>${l.type} / ${l.size||'—'} @ ${l.antenna}</td><td>${l.qty}</td><td>${new Date(l.since).toLocaleString()}</td><td><button class="btn btn-ghost" onclick="App.returnLoan(${l.id})">Marquer rendu</button></td></tr>`).join('')}</tbody></table></div>`; },
   async returnLoan(id){ try{ await this.fetchJSON('/api/loans/return/'+id,{method:'POST'}); this.renderPrets(); this.flash('Prêt rendu'); }catch(e){ this.flash(e.message||'Action refusée'); } },
 
   // ------------------------------ Inventaire ------------------------------
@@ -238,9 +246,10 @@ const App = {
   async closeInventory(sid){ try{ await this.fetchJSON(`/api/inventory/${sid}/close`,{method:'POST'}); this.flash('Inventaire clôturé ✅'); this.renderInventaire(); }catch(e){ this.flash(e.message||'Clôture refusée'); } },
 
   // ------------------------------ Administration ------------------------------
-  async renderAdmin(){ const el=this.qs('#admin'); const users=await this.fetchJSON('/api/users'); const overdue=this.getSetting('overdue_days',30); const defThr=this.getSetting('default_threshold',5); el.innerHTML=`<div class="card"><div class="chips" style="justify-content:space-between"><h2>Administration</h2><div class="chips"><button class="btn btn-ghost" onclick="App.viewLogs()">Journaux</button><button class="btn btn-primary" onclick="App.modalAddUser()">+ Utilisateur</button></div></div><div class="grid-3 mt"><div><label class="muted">Jours avant retard</label><input id="set_overdue" class="input" type="number" min="1" value="${overdue}" onblur="App.saveAdminSettings()"></div><div><label class="muted">Seuil stock bas par défaut</label><input id="set_threshold" class="input" type="number" min="0" value="${defThr}" onblur="App.saveAdminSettings()"></div><div class="muted" style="display:flex;align-items:flex-end">Réglages locaux appliqués immédiatement.</div></div><h3 class="mt">Utilisateurs</h3><table class="table"><thead><tr><th>Nom</th><th>Email</th><th>Rôle</th><th></th></tr></thead><tbody>${users.map(u=>`<tr><td>${u.name}</td><td>${u.email}</td><td><span class="badge">${u.role}</span></td><td class="chips"><button class="btn btn-ghost" onclick='App.modalEditUser(${u.id}, ${JSON.stringify(u).replaceAll("'","&apos;")})'>Modifier</button><button class="btn btn-ghost" onclick='App.deleteUser(${u.id})'>Supprimer</button></td></tr>`).join('')}</tbody></table></div>`; },
+  async renderAdmin(){ const el=this.qs('#admin'); const users=await this.fetchJSON('/api/users'); const overdue=this.getSetting('overdue_days',30); const defThr=this.getSetting('default_threshold',5); el.innerHTML=`<div class="card"><div class="chips" style="justify-content:space-between"><h2>Administration</h2><div class="chips"><a class="btn btn-ghost" href="/api/export/loans.csv">⬇️ Prêts CSV</a><a class="btn btn-ghost" href="/api/export/inventories.csv">⬇️ Inventaires CSV</a><a class="btn btn-ghost" href="/api/export/logs.csv">⬇️ Journaux CSV</a><button class="btn btn-ghost" onclick="App.viewLogs()">Journaux</button><button class="btn btn-primary" onclick="App.modalAddUser()">+ Utilisateur</button></div></div><div class="grid-3 mt"><div><label class="muted">Jours avant retard</label><input id="set_overdue" class="input" type="number" min="1" value="${overdue}" onblur="App.saveAdminSettings()"></div><div><label class="muted">Seuil stock bas par défaut</label><input id="set_threshold" class="input" type="number" min="0" value="${defThr}" onblur="App.saveAdminSettings()"></div><div class="muted" style="display:flex;align-items:flex-end">Réglages locaux appliqués immédiatement.</div></div><h3 class="mt">Utilisateurs</h3><table class="table"><thead><tr><th>Nom</th><th>Email</th><th>Rôle</th><th></th></tr></thead><tbody>${users.map(u=>`<tr><td>${u.name}</td><td>${u.email}</td><td><span class="badge">${u.role}</span></td><td class="chips"><button class="btn btn-ghost" onclick='App.modalEditUser(${u.id}, ${JSON.stringify(u).replaceAll("'","&apos;")})'>Modifier</button><button class="btn btn-ghost" onclick='App.deleteUser(${u.id})'>Supprimer</button></td></tr>`).join('')}</tbody></table></div>`; },
   saveAdminSettings(){ const od=Math.max(1, Number(this.qs('#set_overdue').value)||30); const thr=Math.max(0, Number(this.qs('#set_threshold').value)||5); this.setSetting('overdue_days', od); this.setSetting('default_threshold', thr); this.flash('Réglages enregistrés'); },
-  async viewLogs(){ const logs=await this.fetchJSON('/api/logs?limit=200'); this.openModal('Journaux récents', `<div style="max-height:55vh;overflow:auto"><table class="table"><thead><tr><th>Date</th><th>Acteur</th><th>Action</th><th>Cible</th><th>Détails</th></tr></thead><tbody>${logs.map(l=>`<tr><td>${new Date(l.at).toLocaleString()}</td><td>${l.actor||'public'}</td><td>${l.action}</td><td>${l.entity}#${l.entity_id||''}</td><td class="muted">${l.details||''}</td></tr>`).join('')}</tbody></table></div>`); },
+  async viewLogs(f={}){ const qs=new URLSearchParams(Object.entries(f).filter(([k,v])=>v && k!=='archived')); if(!f.archived) qs.set('limit','200'); const logs=await this.fetchJSON((f.archived?'/api/logs/archived?':'/api/logs?')+qs); this.openModal('Journaux', `<div class="grid-4"><input id="lf_actor" class="input" placeholder="Acteur" value="${f.actor||''}"><input id="lf_action" class="input" placeholder="Action (ex: stock.update)" value="${f.action||''}"><input id="lf_from" class="input" type="date" value="${f.from||''}"><input id="lf_to" class="input" type="date" value="${f.to||''}"></div><div class="chips" style="justify-content:space-between"><label class="muted"><input id="lf_archived" type="checkbox" ${f.archived?'checked':''}> Archives</label><button class="btn btn-primary" onclick="App.filterLogs()">Filtrer</button></div><div style="max-height:55vh;overflow:auto"><table class="table"><thead><tr><th>Date</th><th>Acteur</th><th>Action</th><th>Cible</th><th>Détails</th></tr></thead><tbody>${logs.map(l=>`<tr><td>${new Date(l.at).toLocaleString()}</td><td>${l.actor||'public'}</td><td>${l.action}</td><td>${l.entity}#${l.entity_id||''}</td><td class="muted">${l.details||''}</td></tr>`).join('')}</tbody></table></div>`); },
+  filterLogs(){ this.viewLogs({ actor:this.qs('#lf_actor').value.trim(), action:this.qs('#lf_action').value.trim(), from:this.qs('#lf_from').value, to:this.qs('#lf_to').value, archived:this.qs('#lf_archived').checked }); },
   modalAddUser(){ this.openModal('Créer un utilisateur', `<div class="grid-3"><input id="u_name" class="input" placeholder="Nom"><input id="u_email" class="input" placeholder="Email"><input id="u_pass" class="input" type="password" placeholder="Mot de passe"></div><div class="chips" style="justify-content:flex-end"><button class="btn btn-primary" onclick="App.addUser()">Enregistrer</button></div>`); },
   async addUser(){ const name=this.qs('#u_name').value.trim(), email=this.qs('#u_email').value.trim(), password=this.qs('#u_pass').value; if(!name||!email||!password) return this.flash('Tous les champs sont requis',false); try{ await this.fetchJSON('/api/users',{method:'POST', body: JSON.stringify({name,email,password,role:'admin'})}); this.closeModal(); this.renderAdmin(); this.flash('Compte admin créé'); } catch(e){ this.flash(e.message||'Création refusée'); } },
   modalEditUser(id,u){ this.openModal('Modifier utilisateur', `<div class="grid-3"><input id="eu_name" class="input" value="${u.name}"><input id="eu_role" class="input" value="${u.role}"><input id="eu_pass" class="input" type="password" placeholder="Nouveau mot de passe (optionnel)"></div><div class="chips" style="justify-content:flex-end"><button class="btn btn-primary" onclick="App.saveUser(${id})">Enregistrer</button></div>`); },
@@ -266,6 +275,7 @@ const App = {
       </div>
       <div id='pubResult' class="mt"></div>
     </div>`;
+    this.watchPublicStock();
 
     // Gestion dynamique des tailles en fonction du type
     const typeSel = this.qs('#pubType');
@@ -304,19 +314,47 @@ const App = {
   },
   async reloadPublicStock(volId){
     const q = await this.buildPublicStockQuery();
-    const stock = await this.fetchJSON(`/api/public/stock${q?`?${q}`:''}`);
+    this.pubStock = await this.fetchJSON(`/api/public/stock${q?`?${q}`:''}`);
     const loans = await this.fetchJSON(`/api/public/loans?volunteer_id=${volId}`);
     const elList = this.qs('#pubLists');
     elList.innerHTML = `
       <h4>Prêts en cours</h4>
       <ul>${loans.map(l=>`<li>${l.type} ${l.size||''} depuis ${new Date(l.since).toLocaleDateString()} <button class='btn btn-ghost' onclick='App.returnLoanPublic(${l.id})'>Rendre</button></li>`).join('')}</ul>
       <h4>Stock disponible</h4>
-      <ul>${stock.map(s=>`<li>${s.type} ${s.size||''} (${s.quantity}) <button class='btn btn-ghost' onclick='App.borrow(${volId},${s.id})'>Emprunter</button></li>`).join('')}</ul>
+      <ul id="pubStockList"></ul>
+      <button class='btn btn-primary' onclick='App.borrowPicked(${volId})'>Emprunter la sélection</button>
     `;
+    this.renderPublicStock(volId);
+  },
+  renderPublicStock(volId){
+    const ul = this.qs('#pubStockList'); if(!ul) return;
+    ul.innerHTML = this.pubStock.map(s=>`<li><label><input type='checkbox' ${this.pubPicked.has(s.id)?'checked':''} onchange='App.pickPublic(${s.id},this.checked)'> ${s.type} ${s.size||''} (${s.quantity})</label> <button class='btn btn-ghost' onclick='App.borrow(${volId},[${s.id}])'>Emprunter</button></li>`).join('');
+  },
+  // Flux SSE de l'antenne : quantités poussées à chaque mouvement (sans flux : rechargement manuel comme avant)
+  watchPublicStock(){
+    if(this.pubStream || !this.publicAntennaId || !window.EventSource) return;
+    const volId = () => Number(this.qs('#pubResult')?.dataset.volId || 0);
+    let pending = null;
+    const reload = () => { clearTimeout(pending); pending = setTimeout(() => { if(volId()) this.reloadPublicStock(volId()); }, 300); };
+    const es = this.pubStream = new EventSource(`/api/public/stream?antenna_id=${this.publicAntennaId}`);
+    es.addEventListener('open', reload);   // (re)connexion : des changements ont pu être manqués
+    es.addEventListener('reset', reload);
+    es.addEventListener('stock', (e) => {
+      if(!volId()) return;
+      const { items } = JSON.parse(e.data);
+      let unknown = false;
+      for(const [id, qty] of items){
+        const row = this.pubStock.find(s=>s.id===id);
+        if(!row){ if(qty>0) unknown = true; continue; }   // nouvel article ou hors filtre : le serveur tranche
+        if(qty>0) row.quantity = qty; else this.pubStock = this.pubStock.filter(s=>s.id!==id);
+      }
+      if(unknown) reload(); else this.renderPublicStock(volId());
+    });
   },
   async showVolPublic(v){
     const el = this.qs('#pubResult');
     el.dataset.volId = v.id;
+    this.pubPicked = new Set();
     el.innerHTML = `
       <div class="card">
         <h3>${v.first_name} ${v.last_name}</h3>
@@ -324,8 +362,29 @@ const App = {
       </div>`;
     await this.reloadPublicStock(v.id);
   },
-  async borrow(volId, stockId){ try{ await this.fetchJSON('/api/public/loan',{method:'POST', body: JSON.stringify({volunteer_id:volId, stock_item_id:stockId, qty:1})}); this.flash('Tenue empruntée'); await this.reloadPublicStock(volId); }catch(e){ this.flash(e.message||'Emprunt refusé'); } },
-  async returnLoanPublic(id){ try{ await this.fetchJSON('/api/public/return/'+id,{method:'POST'}); this.flash('Tenue rendue'); const box=this.qs('#pubResult'); if(box.dataset.volId){ await this.reloadPublicStock(Number(box.dataset.volId)); } }catch(e){ this.flash(e.message||'Retour refusé'); } },
+  // Tenue complète : un seul appel (tout ou rien) et une seule clé, réutilisée telle quelle par la file hors ligne
+  pickPublic(id, on){ if(on) this.pubPicked.add(id); else this.pubPicked.delete(id); },
+  borrowPicked(volId){ const ids=[...this.pubPicked]; if(!ids.length) return this.flash('Coche les articles à emprunter.'); return this.borrow(volId, ids); },
+  async borrow(volId, stockIds){ const op={key:this.opKey(), op:'loan_batch', volunteer_id:volId, items:stockIds.map(id=>({stock_item_id:id, qty:1}))}; try{ await this.fetchJSON('/api/public/loan/batch',{method:'POST', headers:{'Idempotency-Key':op.key}, body: JSON.stringify(op)}); this.pubPicked.clear(); this.flash(stockIds.length>1 ? `${stockIds.length} articles empruntés` : 'Tenue empruntée'); await this.reloadPublicStock(volId); }catch(e){ if(!e.status){ this.pubPicked.clear(); return this.queueOffline(op, 'Hors ligne : emprunt enregistré, envoyé au retour du réseau'); } this.flash(e.message||'Emprunt refusé'); } },
+  async returnLoanPublic(id){ const op={key:this.opKey(), op:'return', loan_id:id}; try{ await this.fetchJSON('/api/public/return/'+id,{method:'POST', headers:{'Idempotency-Key':op.key}}); this.flash('Tenue rendue'); const box=this.qs('#pubResult'); if(box.dataset.volId){ await this.reloadPublicStock(Number(box.dataset.volId)); } }catch(e){ if(!e.status) return this.queueOffline(op, 'Hors ligne : retour enregistré, envoyé au retour du réseau'); this.flash(e.message||'Retour refusé'); } },
+
+  // File hors ligne du kiosque : chaque action porte une clé, rejouée sans doublon par /api/public/sync
+  opKey(){ return window.crypto?.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`; },
+  offlineOps(){ try { return JSON.parse(localStorage.getItem('pc_offline_ops')||'[]'); } catch { return []; } },
+  queueOffline(op, msg){ localStorage.setItem('pc_offline_ops', JSON.stringify([...this.offlineOps(), op])); this.flash(msg); },
+  async syncOffline(){
+    const ops=this.offlineOps(); if(!ops.length || this.syncing) return;
+    this.syncing=true;
+    try{
+      const res=await this.fetchJSON('/api/public/sync',{method:'POST', body: JSON.stringify({operations:ops})});
+      const sent=new Set(ops.map(o=>o.key));
+      localStorage.setItem('pc_offline_ops', JSON.stringify(this.offlineOps().filter(o=>!sent.has(o.key))));
+      const refused=res.results.filter(r=>!r.ok).length;
+      this.flash(refused ? `${ops.length-refused} opération(s) synchronisée(s), ${refused} refusée(s)` : `${ops.length} opération(s) hors ligne synchronisée(s)`);
+      const box=this.qs('#pubResult'); if(box?.dataset.volId) await this.reloadPublicStock(Number(box.dataset.volId));
+    }catch{ /* toujours hors ligne : nouvel essai plus tard */ }
+    finally{ this.syncing=false; }
+  },
 };
 
 window.App = App;
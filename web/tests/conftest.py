@@ -0,0 +1,88 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as m  # noqa: E402
+
+TEST_CONFIG = {
+    "SECRET_KEY": "test",
+    "BCRYPT_ROUNDS": 4,
+    "LOGIN_IP_LIMIT": 0,
+    "LOGIN_ACCOUNT_LIMIT": 0,
+    "COMPRESS_MIN_SIZE": 0,
+}
+
+def make_app(uri: str, **config):
+    app = m.create_app({**TEST_CONFIG, **config, "SQLALCHEMY_DATABASE_URI": uri})
+    with app.app_context():
+        if m.db.engine.dialect.name == "postgresql":
+            # base dédiée aux tests : repartir d'un schéma vide
+            m.db.session.execute(text("DROP SCHEMA public CASCADE; CREATE SCHEMA public"))
+            m.db.session.commit()
+        m.migrate()
+        m.ensure_admin()
+    return app
+
+def dispose(app):
+    """Vide le journal d'audit en file puis ferme les connexions de l'application."""
+    app.extensions["audit"].close()
+    with app.app_context():
+        m.db.session.remove()
+        m.db.engine.dispose()
+
+@pytest.fixture
+def app():
+    """Application sur une base SQLite en mémoire, schéma migré."""
+    app = make_app("sqlite://")
+    yield app
+    dispose(app)
+
+@pytest.fixture
+def pg_app():
+    """Application sur TEST_DATABASE_URL (PostgreSQL dédié aux tests, vidé à chaque test)."""
+    uri = os.environ.get("TEST_DATABASE_URL", "")
+    if not uri.startswith("postgresql"):
+        pytest.skip("TEST_DATABASE_URL (PostgreSQL) non défini")
+    app = make_app(uri)
+    yield app
+    dispose(app)
+
+def login(client):
+    r = client.post("/api/login", json={"email": "admin@pc.fr", "password": "admin123"})
+    assert r.status_code == 200 and r.json["ok"], r.json
+    return client
+
+@pytest.fixture
+def client(app):
+    return login(app.test_client())
+
+def seed(app, antennas=2, types=3, sizes=("S", "M", "L"), quantity=10, volunteers=3, loans=3):
+    """Jeu de données minimal ; renvoie les identifiants créés."""
+    with app.app_context():
+        ants = [m.Antenna(name=f"Antenne {i}") for i in range(antennas)]
+        kinds = [m.GarmentType(label=f"Type {i}") for i in range(types)]
+        m.db.session.add_all(ants + kinds)
+        m.db.session.flush()
+        items = [
+            m.StockItem(garment_type_id=t.id, antenna_id=a.id, size=sz, quantity=quantity)
+            for a in ants for t in kinds for sz in sizes
+        ]
+        vols = [m.Volunteer(first_name=f"Prénom{i}", last_name=f"Nom{i}") for i in range(volunteers)]
+        m.db.session.add_all(items + vols)
+        m.db.session.flush()
+        m.db.session.add_all(m.StockItemTag(stock_item_id=it.id, tag="hiver") for it in items)
+        for i in range(loans):
+            m.db.session.add(m.Loan(volunteer_id=vols[i % len(vols)].id, stock_item_id=items[i % len(items)].id, qty=1))
+        m.db.session.commit()
+        m.rebuild_stats()
+        m.rebuild_alerts()
+        return {
+            "antennas": [a.id for a in ants],
+            "types": [t.id for t in kinds],
+            "items": [it.id for it in items],
+            "volunteers": [v.id for v in vols],
+        }
@@ -0,0 +1,97 @@
+"""Journal d'audit : écrit après le commit (thread de fond) ou dans la transaction (SQLite en mémoire)."""
+import threading
+
+import pytest
+from sqlalchemy import event
+
+from conftest import dispose, login, m, make_app, seed
+
+@pytest.fixture(params=["transaction", "thread"])
+def audit_app(request, tmp_path):
+    if request.param == "transaction":
+        yield request.getfixturevalue("app")
+        return
+    app = make_app(f"sqlite:///{tmp_path / 'audit.db'}", AUDIT_FLUSH_INTERVAL=0.05)
+    yield app
+    dispose(app)
+
+def actions(app):
+    app.extensions["audit"].flush()
+    with app.app_context():
+        return [a for (a,) in m.db.session.query(m.Log.action).order_by(m.Log.id)]
+
+def log_inserts(engine):
+    """Threads ayant exécuté un INSERT INTO logs."""
+    threads = []
+    def on_execute(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO logs"):
+            threads.append(threading.current_thread().name)
+    event.listen(engine, "before_cursor_execute", on_execute)
+    return threads
+
+def test_logged_with_the_action(audit_app):
+    d = seed(audit_app, loans=0)
+    client = login(audit_app.test_client())
+    client.put(f"/api/stock/{d['items'][0]}", json={"quantity": 4})
+    client.post("/api/public/loan", json={"volunteer_id": d["volunteers"][0], "stock_item_id": d["items"][1]})
+    assert [l["action"] for l in client.get("/api/logs").json] == ["loan.create", "stock.update"]
+    assert actions(audit_app) == ["stock.update", "loan.create"]
+
+def test_refused_action_logs_nothing(audit_app):
+    d = seed(audit_app, quantity=1, loans=0)
+    r = audit_app.test_client().post(
+        "/api/public/loan", json={"volunteer_id": d["volunteers"][0], "stock_item_id": d["items"][0], "qty": 5})
+    assert r.status_code == 400
+    assert actions(audit_app) == []
+
+def test_audit_failure_cancels_the_action(app, client):
+    d = seed(app, loans=0)
+    with app.app_context():
+        engine = m.db.engine
+    def fail_on_logs(conn, cursor, statement, *args):
+        if statement.startswith("INSERT INTO logs"):
+            raise RuntimeError("journal indisponible")
+    event.listen(engine, "before_cursor_execute", fail_on_logs)
+    app.config["PROPAGATE_EXCEPTIONS"] = False
+    try:
+        r = client.put(f"/api/stock/{d['items'][0]}", json={"quantity": 4})
+    finally:
+        event.remove(engine, "before_cursor_execute", fail_on_logs)
+    assert r.status_code == 500
+    with app.app_context():
+        assert m.db.session.get(m.StockItem, d["items"][0]).quantity == 10
+    assert actions(app) == []
+
+def test_request_thread_does_not_insert_logs(tmp_path):
+    app = make_app(f"sqlite:///{tmp_path / 'audit.db'}", AUDIT_FLUSH_INTERVAL=0.05)
+    d = seed(app, loans=0)
+    client = login(app.test_client())
+    with app.app_context():
+        threads = log_inserts(m.db.engine)
+    for q in range(5):
+        client.put(f"/api/stock/{d['items'][0]}", json={"quantity": q})
+    assert actions(app) == ["stock.update"] * 5
+    assert set(threads) == {"audit-writer"}
+    dispose(app)
+
+def test_full_queue_falls_back_to_caller(tmp_path):
+    app = make_app(f"sqlite:///{tmp_path / 'audit.db'}", AUDIT_QUEUE_SIZE=1)
+    writer = app.extensions["audit"]
+    with app.app_context():
+        threads = log_inserts(m.db.engine)
+        writer.submit([{"actor": "test", "action": "stock.update", "entity": "stock", "entity_id": i, "details": ""}
+                       for i in range(50)])
+    assert threading.current_thread().name in threads
+    assert actions(app) == ["stock.update"] * 50
+    dispose(app)
+
+def test_shutdown_writes_queued_logs(tmp_path):
+    app = make_app(f"sqlite:///{tmp_path / 'audit.db'}", AUDIT_FLUSH_INTERVAL=30)  # lot pas encore écrit
+    d = seed(app, loans=0)
+    client = login(app.test_client())
+    for q in range(20):
+        client.put(f"/api/stock/{d['items'][0]}", json={"quantity": q})
+    app.extensions["audit"].close()
+    with app.app_context():
+        assert m.db.session.query(m.Log).filter(m.Log.action == "stock.update").count() == 20
+    dispose(app)
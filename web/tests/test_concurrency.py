@@ -0,0 +1,105 @@
+"""Stress : prêts et retours concurrents sur un même article (pas de survente, stock conservé)."""
+import random
+import threading
+import uuid
+
+import pytest
+from sqlalchemy import text
+
+from conftest import dispose, login, m, make_app, seed
+
+THREADS = 8
+ROUNDS = 30
+INITIAL = 40
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def shared_app(request, tmp_path):
+    """Base partagée entre threads : fichier SQLite, ou TEST_DATABASE_URL (PostgreSQL)."""
+    if request.param == "postgresql":
+        yield request.getfixturevalue("pg_app")
+        return
+    app = make_app(f"sqlite:///{tmp_path / 'stress.db'}")
+    yield app
+    dispose(app)
+
+def stock_state(app, item_id):
+    """(quantité en stock, quantité en prêt ouvert) lues hors ORM."""
+    with app.app_context(), m.db.engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT quantity, (SELECT COALESCE(SUM(qty), 0) FROM loans WHERE stock_item_id = :i AND returned_at IS NULL) "
+            "FROM stock_items WHERE id = :i"
+        ), {"i": item_id}).one()
+
+def test_concurrent_loans_and_returns(shared_app):
+    app = shared_app
+    data = seed(app, antennas=1, types=1, sizes=("M",), quantity=INITIAL, volunteers=THREADS, loans=0)
+    item_id = data["items"][0]
+    clients = [login(app.test_client()) for _ in range(THREADS)]  # bcrypt avant la course
+    open_loans, lock = [], threading.Lock()
+    errors, served = [], [0]
+    stop = threading.Event()
+
+    def take(loan_ids):
+        with lock:
+            open_loans.extend(loan_ids)
+            served[0] += len(loan_ids)
+
+    def pick():
+        # pas de retrait de la liste : deux threads peuvent rendre le même prêt en même temps
+        with lock:
+            return random.choice(open_loans) if open_loans else None
+
+    def worker(n):
+        client, rnd = clients[n], random.Random(n)
+        vol = data["volunteers"][n]
+        for _ in range(ROUNDS):
+            op = rnd.choice(["loan", "loan", "batch", "return", "public_return"])
+            if op == "loan":
+                r = client.post("/api/public/loan", json={"volunteer_id": vol, "stock_item_id": item_id, "qty": rnd.randint(1, 3)})
+                ok = r.status_code in (200, 400)
+                if r.status_code == 200:
+                    take([r.json["loan_id"]])
+            elif op == "batch":
+                r = client.post(
+                    "/api/public/loan/batch", json={"volunteer_id": vol, "items": [{"stock_item_id": item_id, "qty": 2}]},
+                    headers={"Idempotency-Key": str(uuid.uuid4())},
+                )
+                ok = r.status_code in (200, 400)
+                if r.status_code == 200:
+                    take(r.json["loan_ids"])
+            else:
+                loan_id = pick()
+                if loan_id is None:
+                    continue
+                url = f"/api/loans/return/{loan_id}" if op == "return" else f"/api/public/return/{loan_id}"
+                r = client.post(url)
+                ok = r.status_code in (200, 404)
+            if not ok:
+                errors.append(f"{op}: {r.status_code} {r.get_data(as_text=True)[:200]}")
+
+    def monitor():
+        while not stop.is_set():
+            quantity, lent = stock_state(app, item_id)
+            if quantity < 0 or quantity + lent != INITIAL:
+                errors.append(f"état incohérent pendant la course : stock={quantity}, en prêt={lent}")
+
+    watcher = threading.Thread(target=monitor)
+    watcher.start()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stop.set()
+    watcher.join()
+
+    assert not errors, "\n".join(errors[:10])
+    quantity, lent = stock_state(app, item_id)
+    assert quantity >= 0
+    assert quantity + lent == INITIAL
+    assert served[0] > 0
+    with app.app_context():
+        assert m.db.session.query(m.StockTotal.quantity).scalar() == quantity
+        assert m.db.session.query(m.Counter.value).filter(m.Counter.name == "loans_open").scalar() == (
+            m.Loan.query.filter(m.Loan.returned_at.is_(None)).count()
+        )
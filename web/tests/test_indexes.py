@@ -0,0 +1,99 @@
+"""Plans EXPLAIN des requêtes chaudes : aucune ne doit parcourir séquentiellement sa table (PostgreSQL).
+
+La base est peuplée par le jeu synthétique du banc (`bench.seed_dataset`) puis
+analysée (échelle 1 : 5000 bénévoles, 20000 prêts, 50000 journaux) : le planificateur
+choisit librement ses plans, et un index manquant se traduit par un parcours séquentiel.
+"""
+import os
+import re
+
+import pytest
+from sqlalchemy import literal_column, or_, select, text
+
+import bench
+from conftest import dispose, m, make_app
+
+SCALE = 1
+
+def explain(stmt):
+    """Plan d'exécution de `stmt` sur PostgreSQL, une ligne par nœud."""
+    conn = m.db.session.connection()
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={"render_postcompile": True})
+    return [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {compiled}", compiled.params)]
+
+def assert_uses_index(stmt, *tables):
+    """Échoue si le plan de `stmt` parcourt séquentiellement une des tables citées."""
+    plan = explain(stmt)
+    for table in tables:
+        if any(re.search(rf"Seq Scan on {table}\b", line) for line in plan):
+            raise AssertionError(f"parcours séquentiel de {table} :\n" + "\n".join(plan))
+    return plan
+
+CASES = {
+    "prêts ouverts (page)": (lambda d: m.open_loans_query(m.Volunteer.last_name, m.Volunteer.first_name)
+        .join(m.Volunteer, m.Loan.volunteer_id == m.Volunteer.id).order_by(m.Loan.id).limit(50).statement, ["loans"]),
+    "prêts ouverts d'un bénévole": (lambda d: m.open_loans_query()
+        .filter(m.Loan.volunteer_id == d.volunteer_id).statement, ["loans"]),
+    "garde suppression article": (lambda d: select(m.Loan.id)
+        .where(m.Loan.stock_item_id == d.stock_item_id).limit(1), ["loans"]),
+    "garde suppression bénévole": (lambda d: select(m.Loan.id)
+        .where(m.Loan.volunteer_id == d.volunteer_id).limit(1), ["loans"]),
+    "article type/antenne/taille": (lambda d: select(m.StockItem.id).where(
+        m.StockItem.garment_type_id == d.garment_type_id, m.StockItem.antenna_id == d.antenna_id,
+        m.db.func.coalesce(m.StockItem.size, literal_column("''")) == d.size), ["stock_items"]),
+    "tailles publiques d'un type": (lambda d: select(m.StockItem.size).where(
+        m.StockItem.quantity > 0, m.StockItem.garment_type_id == d.garment_type_id, m.StockItem.size.isnot(None)
+    ).distinct(), ["stock_items"]),
+    "lignes d'inventaire d'un article": (lambda d: select(m.InventoryLine.id)
+        .where(m.InventoryLine.stock_item_id == d.stock_item_id), ["inventory_lines"]),
+    "lignes d'une session": (lambda d: select(m.InventoryLine.id)
+        .where(m.InventoryLine.session_id == d.session_id), ["inventory_lines"]),
+    "sessions d'une antenne": (lambda d: select(m.InventorySession.id)
+        .where(m.InventorySession.antenna_id == d.antenna_id)
+        .order_by(m.InventorySession.started_at.desc()).limit(20), ["inventory_sessions"]),
+    "journaux récents": (lambda d: select(m.Log.id)
+        .order_by(m.Log.at.desc(), m.Log.id.desc()).limit(100), ["logs"]),
+    "recherche de bénévoles (préfixe)": (lambda d: select(m.Volunteer.id)
+        .where(m.Volunteer.last_key.startswith(d.last_key[:-1], autoescape=True)).limit(50), ["volunteers"]),
+    "bénévole de la page QR": (lambda d: select(m.Volunteer.id)
+        .where(m.Volunteer.last_key == d.last_key, m.Volunteer.first_key == d.first_key), ["volunteers"]),
+    "filtre de la liste des bénévoles (sous-chaîne)": (lambda d: select(m.Volunteer.id).where(or_(
+        m.Volunteer.last_key.contains(d.last_key[2:], autoescape=True),
+        m.Volunteer.first_key.contains(d.last_key[2:], autoescape=True),
+        m.db.func.lower(m.Volunteer.note).contains(d.last_key[2:], autoescape=True),
+    )), ["volunteers"]),
+}
+TRIGRAM_CASES = {"filtre de la liste des bénévoles (sous-chaîne)"}  # index pg_trgm (migration 15)
+
+@pytest.fixture(scope="module")
+def seeded():
+    """Base PostgreSQL peuplée et analysée une fois pour tous les plans ; un prêt et une session de référence."""
+    uri = os.environ.get("TEST_DATABASE_URL", "")
+    if not uri.startswith("postgresql"):
+        pytest.skip("TEST_DATABASE_URL (PostgreSQL) non défini")
+    app = make_app(uri)
+    bench.seed_dataset(m, app, scale=SCALE)
+    with app.app_context():
+        ref = m.db.session.execute(
+            select(m.Loan.volunteer_id, m.Loan.stock_item_id, m.StockItem.garment_type_id, m.StockItem.antenna_id,
+                   m.StockItem.size, m.Volunteer.last_key, m.Volunteer.first_key, m.InventorySession.id.label("session_id"))
+            .join(m.StockItem, m.Loan.stock_item_id == m.StockItem.id)
+            .join(m.Volunteer, m.Loan.volunteer_id == m.Volunteer.id)
+            .join(m.InventorySession, m.InventorySession.antenna_id == m.StockItem.antenna_id)
+            .order_by(m.Loan.id.desc()).limit(1)
+        ).one()
+        m.db.session.rollback()
+    yield app, ref
+    dispose(app)
+
+@pytest.mark.parametrize("name", list(CASES))
+def test_hot_query_uses_index(seeded, name):
+    app, ref = seeded
+    build, tables = CASES[name]
+    with app.app_context():
+        if name in TRIGRAM_CASES and not m.db.session.scalar(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")):
+            pytest.skip("extension pg_trgm absente du serveur de test")
+        try:
+            assert_uses_index(build(ref), *tables)
+        finally:
+            m.db.session.rollback()
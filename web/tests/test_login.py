@@ -0,0 +1,33 @@
+from conftest import m
+
+def test_throttle_evicts_least_recent_key():
+    t = m.LoginThrottle(max_keys=3)
+    for key in ("a", "b", "c"):
+        t.hit(key, window=300)
+    t.hit("a", window=300)   # "b" devient la plus ancienne
+    t.hit("d", window=300)   # table pleine, rien d'expiré : "b" est évincée
+    assert list(t._hits) == ["c", "a", "d"]
+    assert t.retry_after("a", limit=2, window=300) > 0
+    assert t.retry_after("b", limit=1, window=300) == 0
+
+def test_login_limits(app):
+    app.config.update(LOGIN_ACCOUNT_LIMIT=2, LOGIN_WINDOW=300)
+    client = app.test_client()
+    bad = {"email": "admin@pc.fr", "password": "non"}
+    assert [client.post("/api/login", json=bad).status_code for _ in range(3)] == [401, 401, 429]
+
+def post_login(client, ip, password):
+    return client.post("/api/login", json={"email": "admin@pc.fr", "password": password},
+                       environ_base={"REMOTE_ADDR": ip}).status_code
+
+def test_account_lock_is_per_ip(app):
+    app.config.update(LOGIN_ACCOUNT_LIMIT=2, LOGIN_WINDOW=300)
+    client = app.test_client()
+    assert [post_login(client, "10.0.0.1", "non") for _ in range(3)] == [401, 401, 429]
+    assert post_login(client, "10.0.0.2", "admin123") == 200  # l'admin n'est pas bloqué ailleurs
+
+def test_only_failures_count_per_ip(app):
+    app.config.update(LOGIN_IP_LIMIT=2, LOGIN_WINDOW=300)
+    client = app.test_client()
+    assert [post_login(client, "10.0.1.1", "admin123") for _ in range(4)] == [200] * 4  # même NAT
+    assert [post_login(client, "10.0.1.1", "non") for _ in range(3)] == [401, 401, 429]
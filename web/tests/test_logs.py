@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+
+from conftest import m
+
+def old_logs(app, n, days=400):
+    at = datetime.utcnow() - timedelta(days=days)
+    with app.app_context():
+        m.db.session.execute(m.insert(m.Log), [
+            {"at": at + timedelta(seconds=i), "actor": "admin@pc.fr", "action": "stock.update", "entity": "stock",
+             "entity_id": i, "details": ""} for i in range(n)
+        ])
+        m.db.session.commit()
+
+def test_archive_runs_bounded_batches(app, client, tmp_path):
+    app.config.update(LOG_ARCHIVE_DIR=str(tmp_path), LOG_ARCHIVE_BATCH_SIZE=10, LOG_ARCHIVE_API_BATCHES=1)
+    old_logs(app, 35)
+    remaining = []
+    while True:
+        r = client.post("/api/logs/archive", json={})
+        assert r.status_code == 200 and len(r.json["files"]) <= 1
+        remaining.append(r.json["remaining"])
+        if not r.json["remaining"]:
+            break
+    assert remaining == [25, 15, 5, 0]
+    assert len(list(tmp_path.glob("logs-*.jsonl.gz"))) == 4
+    archived = client.get("/api/logs/archived?action=stock.update").json
+    assert sorted(l["entity_id"] for l in archived) == list(range(35))
+
+def test_archive_keeps_recent_logs(app, client, tmp_path):
+    app.config.update(LOG_ARCHIVE_DIR=str(tmp_path))
+    old_logs(app, 3, days=10)
+    r = client.post("/api/logs/archive", json={})
+    assert r.json == {"ok": True, "files": [], "remaining": 0}
+    assert client.post("/api/logs/archive", json={"older_than_days": 5}).json["remaining"] == 0
+    assert client.post("/api/logs/archive", json={"older_than_days": 0}).status_code == 400
@@ -0,0 +1,19 @@
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from conftest import m
+
+def test_failed_statement_leaves_no_timer(app):
+    with app.app_context(), m.db.engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.execute(text("SELECT * FROM table_inconnue"))
+        conn.rollback()
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+        assert not any(k.startswith("metrics") for k in conn.info)
+
+def test_metrics_export(app, client):
+    client.get("/api/stock")
+    body = client.get("/metrics").get_data(as_text=True)
+    assert 'habillement_http_requests_total{endpoint="main.stock_list",method="GET",status="200"}' in body
+    assert 'habillement_db_statements_total{endpoint="main.stock_list"}' in body
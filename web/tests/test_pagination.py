@@ -0,0 +1,24 @@
+from conftest import seed
+
+def test_default_page_and_cursor(app, client):
+    data = seed(app, types=10)
+    app.config["PAGE_DEFAULT_LIMIT"] = 25
+    seen, url = [], "/api/stock"
+    while url:
+        r = client.get(url)
+        assert r.status_code == 200
+        assert len(r.json) <= 25
+        seen += [s["id"] for s in r.json]
+        cursor = r.headers.get("X-Next-Cursor")
+        url = f"/api/stock?after={cursor}" if cursor else None
+    assert seen == sorted(data["items"])
+
+def test_explicit_limit_and_stream(app, client):
+    data = seed(app, types=10)
+    app.config["PAGE_DEFAULT_LIMIT"] = 25
+    assert len(client.get("/api/stock?limit=40").json) == 40
+    assert len(client.get("/api/stock?stream=1").json) == len(data["items"])
+
+def test_invalid_cursor(client):
+    r = client.get("/api/stock?after=nope")
+    assert r.status_code == 400 and not r.json["ok"]
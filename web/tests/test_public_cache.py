@@ -0,0 +1,56 @@
+"""Invalidation du cache public (ETag "stock-<version>") après chaque mouvement de stock."""
+import pytest
+
+from conftest import seed
+
+def open_loan(client, volunteer_id):
+    return client.get(f"/api/volunteers/{volunteer_id}/loans").json[0]["id"]
+
+MUTATIONS = {
+    "stock_add": lambda c, d: c.post("/api/stock", json={
+        "garment_type_id": d["types"][0], "antenna_id": d["antennas"][0], "size": "XL", "quantity": 3}),
+    "stock_update": lambda c, d: c.put(f"/api/stock/{d['items'][4]}", json={"quantity": 7}),
+    "stock_delete": lambda c, d: c.delete(f"/api/stock/{d['items'][5]}"),
+    "public_loan": lambda c, d: c.post("/api/public/loan", json={
+        "volunteer_id": d["volunteers"][0], "stock_item_id": d["items"][4], "qty": 1}),
+    "loan_return": lambda c, d: c.post(f"/api/loans/return/{open_loan(c, d['volunteers'][0])}"),
+    "public_return": lambda c, d: c.post(f"/api/public/return/{open_loan(c, d['volunteers'][1])}"),
+    "inventory_close": lambda c, d: c.post(f"/api/inventory/{start_inventory(c, d)}/close"),
+    "stock_transfer": lambda c, d: c.post("/api/stock/transfer", json={
+        "from_antenna_id": d["antennas"][0], "to_antenna_id": d["antennas"][1],
+        "lines": [{"garment_type_id": d["types"][0], "size": "S", "qty": 2}]}),
+}
+
+def start_inventory(client, d):
+    sid = client.post("/api/inventory/start", json={"antenna_id": d["antennas"][0]}).json["id"]
+    r = client.post(f"/api/inventory/{sid}/count", json={"stock_item_id": d["items"][4], "counted_qty": 2})
+    assert r.json["ok"]
+    return sid
+
+@pytest.mark.parametrize("mutation", sorted(MUTATIONS))
+def test_mutation_invalidates_public_cache(app, client, mutation):
+    d = seed(app)
+    urls = [f"/api/public/stock?antenna_id={a}" for a in d["antennas"]] + ["/api/public/stock", "/api/public/types"]
+    if mutation != "stock_transfer":
+        urls.pop(1)  # seule l'antenne 0 est touchée
+    etags = {}
+    for url in urls:
+        first = client.get(url)
+        assert first.status_code == 200 and first.headers["ETag"]
+        etags[url] = first.headers["ETag"]
+        assert client.get(url, headers={"If-None-Match": etags[url]}).status_code == 304
+
+    r = MUTATIONS[mutation](client, d)
+    assert r.status_code == 200 and r.json.get("ok", True), r.get_data(as_text=True)
+
+    for url in urls:
+        again = client.get(url, headers={"If-None-Match": etags[url]})
+        assert again.status_code == 200, url
+        assert again.headers["ETag"] != etags[url], url
+
+def test_untouched_antenna_keeps_etag(app, client):
+    d = seed(app)
+    url = f"/api/public/stock?antenna_id={d['antennas'][1]}"
+    etag = client.get(url).headers["ETag"]
+    MUTATIONS["public_loan"](client, d)
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
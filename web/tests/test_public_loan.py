@@ -0,0 +1,73 @@
+import uuid
+
+from conftest import m, seed
+
+def quantities(app, ids):
+    with app.app_context():
+        return dict(m.db.session.query(m.StockItem.id, m.StockItem.quantity).filter(m.StockItem.id.in_(ids)).all())
+
+def batch(client, vol, items, key=None):
+    return client.post(
+        "/api/public/loan/batch", json={"volunteer_id": vol, "items": items},
+        headers={"Idempotency-Key": key or str(uuid.uuid4())},
+    )
+
+def test_batch_is_all_or_nothing(app):
+    d = seed(app, quantity=2, loans=0)
+    client, (a, b) = app.test_client(), d["items"][:2]
+    r = batch(client, d["volunteers"][0], [{"stock_item_id": a, "qty": 1}, {"stock_item_id": b, "qty": 3}])
+    assert r.status_code == 400 and r.json["stock_item_ids"] == [b]
+    assert quantities(app, [a, b]) == {a: 2, b: 2}
+
+    r = batch(client, d["volunteers"][0], [{"stock_item_id": a}, {"stock_item_id": b, "qty": 2}])
+    assert r.status_code == 200 and len(r.json["loan_ids"]) == 2
+    assert quantities(app, [a, b]) == {a: 1, b: 0}
+
+def test_batch_replay_with_same_key(app):
+    d = seed(app, quantity=5, loans=0)
+    client, a = app.test_client(), d["items"][0]
+    key = str(uuid.uuid4())
+    first = batch(client, d["volunteers"][0], [{"stock_item_id": a, "qty": 2}], key)
+    again = batch(client, d["volunteers"][0], [{"stock_item_id": a, "qty": 2}], key)
+    assert again.headers.get("Idempotent-Replayed") == "true"
+    assert again.json["loan_ids"] == first.json["loan_ids"]
+    assert quantities(app, [a]) == {a: 3}
+
+def test_sync_batch_keeps_previous_operations(app):
+    d = seed(app, quantity=2, loans=0)
+    client, (a, b) = app.test_client(), d["items"][:2]
+    vol = d["volunteers"][0]
+    ops = [
+        {"key": str(uuid.uuid4()), "op": "loan", "volunteer_id": vol, "stock_item_id": a, "qty": 1},
+        {"key": str(uuid.uuid4()), "op": "loan_batch", "volunteer_id": vol,
+         "items": [{"stock_item_id": a, "qty": 1}, {"stock_item_id": b, "qty": 5}]},
+        {"key": str(uuid.uuid4()), "op": "loan_batch", "volunteer_id": vol,
+         "items": [{"stock_item_id": a, "qty": 1}, {"stock_item_id": b, "qty": 1}]},
+    ]
+    r = client.post("/api/public/sync", json={"operations": ops})
+    assert [res["status"] for res in r.json["results"]] == [200, 400, 200]
+    assert quantities(app, [a, b]) == {a: 0, b: 1}
+    with app.app_context():
+        assert m.db.session.query(m.Counter.value).filter(m.Counter.name == "loans_open").scalar() == 3
+        assert m.Log.query.filter(m.Log.action == "loan.create").count() == 3
+
+    replay = client.post("/api/public/sync", json={"operations": ops})
+    assert [res.get("replayed", False) for res in replay.json["results"]] == [True, False, True]
+    assert quantities(app, [a, b]) == {a: 0, b: 1}
+
+def test_malformed_batch_is_rejected(app):
+    d = seed(app, quantity=2, loans=0)
+    client, vol, a = app.test_client(), d["volunteers"][0], d["items"][0]
+    for body in ({"volunteer_id": vol, "items": [{"qty": 1}]}, {"volunteer_id": vol, "items": ["x"]},
+                 {"volunteer_id": vol, "items": 3}, {"items": [{"stock_item_id": a}]},
+                 {"volunteer_id": "abc", "items": [{"stock_item_id": a}]}):
+        r = client.post("/api/public/loan/batch", json=body, headers={"Idempotency-Key": str(uuid.uuid4())})
+        assert r.status_code == 400 and not r.json["ok"], body
+    ops = [
+        {"key": str(uuid.uuid4()), "op": "loan_batch", "volunteer_id": vol, "items": ["x"]},
+        {"key": str(uuid.uuid4()), "op": "loan_batch", "volunteer_id": vol, "items": [{"qty": 1}]},
+        {"key": str(uuid.uuid4()), "op": "loan_batch", "volunteer_id": vol, "items": [{"stock_item_id": a}]},
+    ]
+    r = client.post("/api/public/sync", json={"operations": ops})
+    assert r.status_code == 200 and [res["status"] for res in r.json["results"]] == [400, 400, 200]
+    assert quantities(app, [a]) == {a: 1}
@@ -0,0 +1,101 @@
+"""Garde anti N+1 : le nombre de requêtes SQL d'une route ne doit pas croître avec le nombre de lignes."""
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from conftest import m, seed
+
+@contextmanager
+def count_statements(app):
+    """Compte les requêtes SQL émises dans le bloc.
+
+    >>> with count_statements(app) as stmts:
+    ...     client.get("/api/loans/open")
+    >>> len(stmts)
+    """
+    stmts = []
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        stmts.append(statement)
+    with app.app_context():
+        engine = m.db.engine
+    event.listen(engine, "before_cursor_execute", _on_execute)
+    try:
+        yield stmts
+    finally:
+        event.remove(engine, "before_cursor_execute", _on_execute)
+
+def assert_flat_statements(app, call, grow):
+    """Échoue si le nombre de requêtes de `call()` augmente après `grow()` (ajout de lignes)."""
+    with count_statements(app) as before:
+        r = call()
+        assert r.status_code == 200, r.get_data(as_text=True)
+    grow()
+    with count_statements(app) as after:
+        r = call()
+        assert r.status_code == 200, r.get_data(as_text=True)
+    assert len(after) <= len(before), f"N+1 : {len(before)} -> {len(after)} requêtes après ajout de lignes"
+    return r
+
+def add_items(app, antenna_id, n=20):
+    """Ajoute n articles (nouveaux types) à une antenne et invalide son cache public."""
+    with app.app_context():
+        kinds = [m.GarmentType(label=f"Ajout {antenna_id}-{i}") for i in range(n)]
+        m.db.session.add_all(kinds)
+        m.db.session.flush()
+        m.db.session.add_all(m.StockItem(garment_type_id=t.id, antenna_id=antenna_id, size="M", quantity=5) for t in kinds)
+        m.bump_stock_version(antenna_id)
+        m.db.session.commit()
+
+def add_loans(app, volunteer_id, item_ids, n=20):
+    with app.app_context():
+        m.db.session.add_all(
+            m.Loan(volunteer_id=volunteer_id, stock_item_id=item_ids[i % len(item_ids)], qty=1) for i in range(n)
+        )
+        m.db.session.commit()
+
+@pytest.fixture
+def data(app):
+    return seed(app)
+
+def test_stock_list(app, client, data):
+    r = assert_flat_statements(app, lambda: client.get("/api/stock"), lambda: add_items(app, data["antennas"][0]))
+    assert len(r.json) == len(data["items"]) + 20
+
+def test_loans_open(app, client, data):
+    r = assert_flat_statements(
+        app, lambda: client.get("/api/loans/open"),
+        lambda: add_loans(app, data["volunteers"][1], data["items"]),
+    )
+    assert len(r.json) == 23
+
+def test_volunteers_loans(app, client, data):
+    vol = data["volunteers"][0]
+    r = assert_flat_statements(
+        app, lambda: client.get(f"/api/volunteers/{vol}/loans"),
+        lambda: add_loans(app, vol, data["items"]),
+    )
+    assert len(r.json) == 21
+
+def test_public_stock(app, data):
+    client, ant = app.test_client(), data["antennas"][0]
+    r = assert_flat_statements(
+        app, lambda: client.get(f"/api/public/stock?antenna_id={ant}"), lambda: add_items(app, ant),
+    )
+    assert len(r.json) == len(data["items"]) // 2 + 20
+
+def test_public_loans(app, data):
+    client, vol = app.test_client(), data["volunteers"][0]
+    r = assert_flat_statements(
+        app, lambda: client.get(f"/api/public/loans?volunteer_id={vol}"),
+        lambda: add_loans(app, vol, data["items"]),
+    )
+    assert len(r.json) == 21
+
+def test_inventory_items(app, client, data):
+    ant = data["antennas"][0]
+    sid = client.post("/api/inventory/start", json={"antenna_id": ant}).json["id"]
+    r = assert_flat_statements(
+        app, lambda: client.get(f"/api/inventory/{sid}/items"), lambda: add_items(app, ant),
+    )
+    assert len(r.json["rows"]) == len(data["items"]) // 2 + 20
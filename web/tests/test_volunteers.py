@@ -0,0 +1,32 @@
+import pytest
+
+from conftest import m
+
+@pytest.fixture
+def people(app):
+    with app.app_context():
+        for first, last, note in [("Léa", "Dupont", "permis C"), ("Lea", "Martin", ""), ("Jean", "Dupont-Lefèvre", ""),
+                                  ("Élodie", "Bernard", "dupont"), ("Noé", "Petit", "")]:
+            m.db.session.add(m.Volunteer(first_name=first, last_name=last, note=note))
+        m.db.session.commit()
+
+def names(rows):
+    return [f"{v['first_name']} {v['last_name']}" for v in rows]
+
+def test_search_ranked_and_accent_insensitive(client, people):
+    assert names(client.get("/api/volunteers/search?q=dupont").json) == ["Léa Dupont", "Jean Dupont-Lefèvre"]
+    assert names(client.get("/api/volunteers/search?q=LEA").json) == ["Léa Dupont", "Lea Martin"]
+    assert names(client.get("/api/volunteers/search?q=lea dup").json) == ["Léa Dupont"]
+    assert names(client.get("/api/volunteers/search?q=elo").json) == ["Élodie Bernard"]
+
+def test_search_is_prefix_only(client, people):
+    # autocomplétion servie par l'index B-tree : ni sous-chaîne ni note
+    assert client.get("/api/volunteers/search?q=pont").json == []
+    assert client.get("/api/volunteers/search?q=permis").json == []
+
+def test_list_filter_matches_infix_and_notes(client, people):
+    assert sorted(names(client.get("/api/volunteers?q=dup").json)) == ["Jean Dupont-Lefèvre", "Léa Dupont", "Élodie Bernard"]
+    assert sorted(names(client.get("/api/volunteers?q=pont").json)) == ["Jean Dupont-Lefèvre", "Léa Dupont", "Élodie Bernard"]
+    assert names(client.get("/api/volunteers?q=lefevre").json) == ["Jean Dupont-Lefèvre"]
+    assert names(client.get("/api/volunteers?q=permis").json) == ["Léa Dupont"]
+    assert names(client.get("/api/volunteers?q=petit noe").json) == ["Noé Petit"]